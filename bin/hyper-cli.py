@@ -3,7 +3,7 @@
 
 import numpy as np
 
-from hyper.io import read_triples, serialize
+from hyper.io import read_triples, serialize, ResultsSink
 from hyper.parsing import knowledgebase
 from hyper import optimizers
 
@@ -13,12 +13,20 @@ from hyper.regularizers import L1, L2, GroupRegularizer, TranslationRuleRegulari
 from keras.constraints import nonneg
 
 from hyper.pathranking.api import PathRankingClient
-from hyper.evaluation import metrics
+from hyper.evaluation import metrics, parallel
+from hyper.evaluation.filters import FilterIndex
+from hyper.evaluation.scoring import EmbeddingScorer, FunctionScorer, get_embeddings
 
 import hyper.learning.core as learning
 import hyper.learning.robust as robust
+import hyper.learning.hogwild as hogwild
+import hyper.learning.synchronous as synchronous
+from hyper.learning.engine import TRAIN_ENGINES
+from hyper.learning.samples import INDEX_GENERATORS
 
+import os
 import sys
+import time
 
 import logging
 import argparse
@@ -27,7 +35,8 @@ __author__ = 'pminervini'
 __copyright__ = 'INSIGHT Centre for Data Analytics 2016'
 
 
-def evaluate_model(model, evaluation_sequences, nb_entities, true_triples=None, tag=None, fast_eval=False):
+def evaluate_model(model, evaluation_sequences, nb_entities, true_triples=None, tag=None, fast_eval=False,
+                   memory_budget_mb=None, tie_policy='mean', per_relation=False, sink=None, record=None):
 
     def scoring_function(args):
         Xr, Xe = args[0], args[1]
@@ -35,25 +44,96 @@ def evaluate_model(model, evaluation_sequences, nb_entities, true_triples=None,
         return y[:, 0]
 
     evaluation_triples = [(s, p, o) for (p, [s, o]) in evaluation_sequences]
+    idxo = [p for (p, _) in evaluation_sequences] if per_relation is True else None
+    start_time = time.time()
 
     if true_triples is None:
         if fast_eval is True:
-            res = metrics.ranking_score_fast(scoring_function, evaluation_triples, nb_entities, nb_entities)
+            res = metrics.ranking_score_fast(scoring_function, evaluation_triples, nb_entities, nb_entities,
+                                             memory_budget_mb=memory_budget_mb, tie_policy=tie_policy)
         else:
-            res = metrics.ranking_score(scoring_function, evaluation_triples, nb_entities, nb_entities)
+            res = metrics.ranking_score(scoring_function, evaluation_triples, nb_entities, nb_entities,
+                                        tie_policy=tie_policy)
     else:
         if fast_eval is True:
             res = metrics.filtered_ranking_score_fast(scoring_function, evaluation_triples,
-                                                      nb_entities, nb_entities, true_triples)
+                                                      nb_entities, nb_entities, true_triples,
+                                                      memory_budget_mb=memory_budget_mb, tie_policy=tie_policy)
         else:
             res = metrics.filtered_ranking_score(scoring_function, evaluation_triples,
-                                                 nb_entities, nb_entities, true_triples)
-    for n in [1, 3, 5, 10]:
-        metrics.ranking_summary(res, tag=tag, n=n)
+                                                 nb_entities, nb_entities, true_triples, tie_policy=tie_policy)
+
+    record = dict(record if record is not None else {})
+    record['timings'] = dict(record.get('timings', {}), ranking=time.time() - start_time)
+    metrics.ranking_summary(res, idxo=idxo, tag=tag, n=[1, 3, 5, 10], sink=sink, record=record, tie_policy=tie_policy)
 
     return res
 
 
+def evaluate_scorer(scorer, evaluation_sequences, filter_index, tag=None, is_raw=True, is_filtered=True,
+                    nb_workers=1, memory_budget_mb=None, tie_policy='mean', per_relation=False, sink=None,
+                    record=None):
+    evaluation_triples = [(s, p, o) for (p, [s, o]) in evaluation_sequences]
+    idxo = [p for (p, _) in evaluation_sequences] if per_relation is True else None
+    start_time = time.time()
+
+    # Raw and filtered ranks are computed from the same scores
+    stats = {}
+    res, filtered_res = parallel.parallel_ranking_scores(scorer, evaluation_triples,
+                                                         filter_index=filter_index if is_filtered else None,
+                                                         nb_workers=nb_workers, memory_budget_mb=memory_budget_mb,
+                                                         tie_policy=tie_policy, stats=stats)
+
+    nb_queries, nb_scored_queries = stats.get('queries', 0), stats.get('scored_queries', 0)
+    logging.info('[%s] Scored %d distinct queries out of %d (%d saved)' %
+                 (tag, nb_scored_queries, nb_queries, nb_queries - nb_scored_queries))
+
+    record = dict(record if record is not None else {}, **stats)
+    record['timings'] = dict(record.get('timings', {}), ranking=time.time() - start_time)
+
+    if is_raw is True:
+        metrics.ranking_summary(res, idxo=idxo, tag='%s raw' % tag, n=[1, 3, 5, 10], sink=sink,
+                                record=dict(record, setting='raw'), tie_policy=tie_policy)
+
+    if is_filtered is True:
+        metrics.ranking_summary(filtered_res, idxo=idxo, tag='%s filtered' % tag, n=[1, 3, 5, 10], sink=sink,
+                                record=dict(record, setting='filtered'), tie_policy=tie_policy)
+
+    return res, filtered_res
+
+
+def evaluate_sampled(scorer, evaluation_sequences, filter_index, tag=None, is_raw=True, is_filtered=True,
+                     nb_candidates=100, entity_frequencies=None, nb_bootstrap=1000, seed=1, tie_policy='mean',
+                     per_relation=False, sink=None, record=None):
+    evaluation_triples = [(s, p, o) for (p, [s, o]) in evaluation_sequences]
+    idxo = [p for (p, _) in evaluation_sequences] if per_relation is True else None
+    start_time = time.time()
+
+    res, filtered_res = metrics.sampled_ranking_scores(scorer, evaluation_triples, nb_candidates=nb_candidates,
+                                                       filter_index=filter_index if is_filtered else None,
+                                                       entity_frequencies=entity_frequencies, seed=seed,
+                                                       tie_policy=tie_policy)
+
+    record = dict(record if record is not None else {}, nb_candidates=nb_candidates,
+                  stratified=entity_frequencies is not None)
+    record['timings'] = dict(record.get('timings', {}), ranking=time.time() - start_time)
+
+    for setting, setting_res in [('raw', res if is_raw else None), ('filtered', filtered_res)]:
+        if setting_res is not None:
+            setting_tag = '%s sampled %s' % (tag, setting)
+            intervals = metrics.bootstrap_rank_metrics(setting_res[0] + setting_res[1], nb_samples=nb_bootstrap,
+                                                       seed=seed)
+
+            logging.info('[%s] 95%% confidence intervals >> %s' %
+                         (setting_tag, ', '.join(['%s: [%s, %s]' % (name, round(lower, 3), round(upper, 3))
+                                                  for name, (lower, upper) in sorted(intervals.items())])))
+
+            metrics.ranking_summary(setting_res, idxo=idxo, tag=setting_tag, n=[1, 3, 5, 10], sink=sink,
+                                    record=dict(record, setting=setting, intervals=intervals), tie_policy=tie_policy)
+
+    return res, filtered_res
+
+
 def main(argv):
     def formatter(prog):
         return argparse.HelpFormatter(prog, max_help_position=100, width=200)
@@ -131,7 +211,29 @@ def main(argv):
     argparser.add_argument('--loss', action='store', type=str, default='hinge',
                            help='Loss function to be used (e.g. hinge, logistic)')
     argparser.add_argument('--negatives', action='store', type=str, default='corrupt',
-                           help='Method for generating the negative examples (e.g. corrupt, lcwa, schema, bernoulli)')
+                           help='Method for generating the negative examples '
+                                '(e.g. corrupt, lcwa, schema, bernoulli, hard)')
+    argparser.add_argument('--negatives-per-positive', action='store', type=int, default=1,
+                           help='Number of corruptions of each positive example (of both the subject and the object, '
+                                'for the corrupt method)')
+    argparser.add_argument('--negatives-sampler', action='store', type=str, default='glorot',
+                           choices=INDEX_GENERATORS,
+                           help='Distribution of the corrupting entities - glorot (random permutations), uniform, '
+                                'unigram (frequency of the entities in the training facts, to the power of 3/4) or '
+                                'predicate-unigram (unigram, restricted to the subjects and objects seen with each '
+                                'predicate, with the corrupt and lcwa negatives only)')
+    argparser.add_argument('--filtered-negatives', action='store_true',
+                           help='Reject (and redraw) negative examples which are training facts')
+    argparser.add_argument('--hard-negatives-interval', action='store', type=int, default=None,
+                           help='Refresh the cache of hard negatives every this many epochs (default: 10)')
+    argparser.add_argument('--hard-negatives-pool', action='store', type=int, default=None,
+                           help='Number of random candidates scored for each predicate when refreshing the cache of '
+                                'hard negatives (default: 1000)')
+    argparser.add_argument('--hard-negatives-ratio', action='store', type=float, default=None,
+                           help='Share of the corruptions drawn from the cache of hard negatives (default: 0.5)')
+    argparser.add_argument('--no-predicate-types-cache', action='store_true',
+                           help='Do not cache the types of the predicates (used by the schema negatives) alongside '
+                                'the training set')
 
     argparser.add_argument('--predicate-l1', action='store', type=float, default=None,
                            help='L1 Regularizer on the Predicate Embeddings')
@@ -164,13 +266,81 @@ def main(argv):
                            help='Beta1 parameter for the adam and adamax optimizers')
     argparser.add_argument('--optimizer-beta2', action='store', type=float, default=0.999,
                            help='Beta2 parameter for the adam and adamax optimizers')
+    argparser.add_argument('--sparse-updates', action='store_true',
+                           help='Only update the rows of the embedding matrices (and of the optimizer state) read by '
+                                'each batch - supported by the sgd, adagrad and adam optimizers')
 
     argparser.add_argument('--fast-eval', action='store_true', help='Fast Evaluation')
+    argparser.add_argument('--eval-memory-mb', action='store', type=float, default=None,
+                           help='Memory budget (in MB) for the buffers used when evaluating batches of queries')
+    argparser.add_argument('--eval-ties', action='store', type=str, default='mean', choices=metrics.TIE_POLICIES,
+                           help='How to rank a target scored as high as other candidates - optimistic, '
+                                'pessimistic or mean (earlier versions broke ties by sort order, so their ranks lie '
+                                'between the optimistic and pessimistic ones)')
+    argparser.add_argument('--eval-workers', action='store', type=int, default=1,
+                           help='Number of worker processes used by the NumPy scoring engine')
+    argparser.add_argument('--eval-engine', action='store', type=str, default='numpy', choices=['numpy', 'keras'],
+                           help='Scoring engine used for evaluating the model - numpy (if supported by the model) '
+                                'or keras')
+
+    argparser.add_argument('--train-engine', action='store', type=str, default='step', choices=TRAIN_ENGINES,
+                           help='How to run each optimisation step - step (direct calls to the compiled train '
+                                'function) or fit (one model.fit call per batch)')
+
+    argparser.add_argument('--hogwild-workers', action='store', type=int, default=None,
+                           help='Train with this many worker processes updating the embeddings in shared memory '
+                                'without locks (NumPy engine: TransE, DistMult and ComplEx, sgd and adagrad)')
+    argparser.add_argument('--sync-workers', action='store', type=int, default=None,
+                           help='Train with this many worker processes computing the gradients of slices of each '
+                                'batch, summed before each update: deterministic for a given seed and number of '
+                                'workers (NumPy engine, as --hogwild-workers)')
+
+    argparser.add_argument('--prefetch-epochs', action='store', type=int, default=None,
+                           help='Number of epochs whose negative examples and batches are prepared in advance by a '
+                                'background thread (0: prepare them in the training loop, default: 1)')
+
+    argparser.add_argument('--validation-interval', action='store', type=int, default=None,
+                           help='Evaluate the model on the validation set every this many epochs during training, '
+                                'keeping the best weights')
+    argparser.add_argument('--validation-patience', action='store', type=int, default=None,
+                           help='Stop training after this many evaluations without improvements of the validation '
+                                'filtered MRR')
+    argparser.add_argument('--validation-size', action='store', type=int, default=None,
+                           help='Number of validation triples (randomly sampled) used during training')
+    argparser.add_argument('--validation-candidates', action='store', type=int, default=None,
+                           help='Rank validation triples against this many sampled candidates during training')
+
+    argparser.add_argument('--eval-sampled', action='store', type=int, default=None,
+                           help='Approximate evaluation: rank each target against a fixed sample of this many '
+                                'candidates, rather than against all entities')
+    argparser.add_argument('--eval-stratified', action='store_true',
+                           help='Stratify the sampled candidates by the frequency of entities in the training set')
+    argparser.add_argument('--eval-bootstrap', action='store', type=int, default=1000,
+                           help='Number of bootstrap samples used for the confidence intervals of the approximate '
+                                'evaluation')
+
+    argparser.add_argument('--eval-per-relation', action='store_true',
+                           help='Compute per-relation and macro-averaged metrics')
+
+    argparser.add_argument('--results', action='store', type=str, default=None,
+                           help='JSON lines file where the evaluation results are appended')
 
     argparser.add_argument('--save', action='store', type=str, default=None,
                            help='Where to save the trained model')
 
+    argparser.add_argument('--checkpoint', action='store', type=str, default=None,
+                           help='Where to periodically save the state of training (weights, optimizer state, random '
+                                'state, epoch number and negative sampler state)')
+    argparser.add_argument('--checkpoint-interval', action='store', type=int, default=10,
+                           help='Save the state of training every this many epochs')
+    argparser.add_argument('--resume', action='store_true',
+                           help='Resume training from the checkpoint given by --checkpoint, if it exists')
+
     args = argparser.parse_args(argv)
+    if args.resume is True and args.checkpoint is None:
+        raise ValueError('Resuming training requires a checkpoint (--checkpoint)')
+    if args.checkpoint is not None and args.robust is True:
+        raise ValueError('Checkpoints are not supported by robust ranking')
 
     def fact(s, p, o):
         return knowledgebase.Fact(predicate_name=p, argument_names=[s, o])
@@ -334,7 +504,8 @@ def main(argv):
                                           lr=optimizer_lr, momentum=optimizer_momentum,
                                           decay=optimizer_decay, nesterov=optimizer_nesterov,
                                           epsilon=optimizer_epsilon, rho=optimizer_rho,
-                                          beta_1=optimizer_beta_1, beta_2=optimizer_beta_2)
+                                          beta_1=optimizer_beta_1, beta_2=optimizer_beta_2,
+                                          sparse=args.sparse_updates)
 
     train_sequences = parser.facts_to_sequences(train_facts)
 
@@ -396,19 +567,69 @@ def main(argv):
                                          mask_ranges=mask_ranges)
             entity_constraint = MaskConstraint(mask=mask)
 
+    validation_sequences = parser.facts_to_sequences(validation_facts)
+    test_sequences = parser.facts_to_sequences(test_facts)
+
+    true_triples = np.array([[s, p, o] for (p, [s, o]) in train_sequences + validation_sequences + test_sequences])
+
+    # Index of the true triples, built once and shared by all filtered evaluations
+    filter_index = FilterIndex(true_triples)
+
     # Constraints on the predicate embeddings
     predicate_constraint = nonneg() if predicate_nonnegative is True else None
 
+    # The types of the predicates are cached alongside the training set, so repeated runs skip their computation
+    predicate_types_cache = None if args.no_predicate_types_cache else os.path.dirname(os.path.abspath(args.train))
+
     kwargs = dict(train_sequences=train_sequences, nb_entities=nb_entities, nb_predicates=nb_predicates, seed=seed,
                   entity_embedding_size=entity_embedding_size, predicate_embedding_size=predicate_embedding_size,
                   dropout_entity_embeddings=dropout_entity_embeddings,
                   dropout_predicate_embeddings=dropout_predicate_embeddings,
                   model_name=model_name, similarity_name=similarity_name,
                   nb_epochs=nb_epochs, batch_size=batch_size, nb_batches=nb_batches, margin=margin,
-                  loss_name=loss_name, negatives_name=negatives_name, optimizer=optimizer, regularizer=regularizer,
-                  predicate_constraint=predicate_constraint, visualize=is_visualize)
-
-    if args.robust is True:
+                  loss_name=loss_name, negatives_name=negatives_name, nb_negatives=args.negatives_per_positive,
+                  negatives_sampler=args.negatives_sampler,
+                  filtered_negatives=args.filtered_negatives, predicate_types_cache=predicate_types_cache,
+                  optimizer=optimizer, regularizer=regularizer,
+                  predicate_constraint=predicate_constraint, visualize=is_visualize, train_engine=args.train_engine)
+
+    training_start_time = time.time()
+
+    # Embedding matrices trained by the NumPy (Hogwild or synchronous) engines, which do not build a Keras model
+    hogwild_embeddings = None
+
+    if args.hogwild_workers is not None or args.sync_workers is not None:
+        # Options of the Keras training procedure that the NumPy engine would otherwise silently ignore
+        unsupported_options = [
+            ('--robust', args.robust is True), ('regularizers', regularizer is not None),
+            ('--filtered-negatives', args.filtered_negatives is True), ('--checkpoint', args.checkpoint is not None),
+            ('--resume', args.resume is True), ('--validation-interval', args.validation_interval is not None),
+            ('--prefetch-epochs', args.prefetch_epochs is not None),
+            ('--hard-negatives-*', any(value is not None for value in [args.hard_negatives_interval,
+                                                                       args.hard_negatives_pool,
+                                                                       args.hard_negatives_ratio])),
+            ('--frequency-mask-type 3 (frames)', entity_frames is not None),
+            ('--frequency-mask-type 1 and 2 (mask constraints)', entity_constraint is not None),
+            ('--entity-rank', entity_rank is not None), ('--predicate-rank', predicate_rank is not None),
+            ('--predicate-nonnegative', predicate_constraint is not None),
+            ('--dropout-*', dropout_entity_embeddings is not None or dropout_predicate_embeddings is not None)]
+        unsupported_names = [name for name, is_set in unsupported_options if is_set]
+        if len(unsupported_names) > 0:
+            raise ValueError('Unsupported options with the NumPy training engine: %s' % ', '.join(unsupported_names))
+
+        hogwild_kwargs = {key: kwargs[key] for key in ['train_sequences', 'nb_entities', 'nb_predicates', 'seed',
+                                                       'entity_embedding_size', 'predicate_embedding_size',
+                                                       'model_name', 'similarity_name', 'nb_epochs', 'batch_size',
+                                                       'nb_batches', 'margin', 'loss_name', 'negatives_name',
+                                                       'nb_negatives', 'negatives_sampler']}
+        hogwild_kwargs.update(optimizer_name=optimizer_name, lr=optimizer_lr, epsilon=optimizer_epsilon)
+
+        if args.sync_workers is not None:
+            hogwild_embeddings = synchronous.synchronous_training(nb_workers=args.sync_workers, **hogwild_kwargs)
+        else:
+            hogwild_embeddings = hogwild.hogwild_training(nb_workers=args.hogwild_workers, **hogwild_kwargs)
+        model = None
+    elif args.robust is True:
         robust_alpha, robust_beta = args.robust_alpha, args.robust_beta
         model = robust.pairwise_training(robust_alpha=robust_alpha, robust_beta=robust_beta, **kwargs)
     else:
@@ -418,34 +639,111 @@ def main(argv):
         kwargs['entity_frames'] = entity_frames
         kwargs['entity_rank'] = entity_rank
         kwargs['predicate_rank'] = predicate_rank
+        kwargs['prefetch_epochs'] = args.prefetch_epochs if args.prefetch_epochs is not None else 1
+
+        hard_negatives_kwargs = dict(hard_negatives_interval=args.hard_negatives_interval,
+                                     hard_negatives_pool_size=args.hard_negatives_pool,
+                                     hard_negatives_ratio=args.hard_negatives_ratio)
+        kwargs.update({key: value for key, value in hard_negatives_kwargs.items() if value is not None})
+
+        kwargs.update(checkpoint_path=args.checkpoint, checkpoint_interval=args.checkpoint_interval,
+                      resume=args.resume)
+
+        if args.validation_interval is not None:
+            # Periodic evaluation on the validation set, with early stopping
+            kwargs.update(validation_sequences=validation_sequences, true_triples=filter_index,
+                          validation_interval=args.validation_interval, validation_patience=args.validation_patience,
+                          validation_size=args.validation_size, validation_candidates=args.validation_candidates)
 
         model = learning.pairwise_training(**kwargs)
 
+    training_time = time.time() - training_start_time
+
     if args.save is not None:
         prefix = args.save
-        serialize(prefix, model=model, parser=parser, argv=argv)
-
-    validation_sequences = parser.facts_to_sequences(validation_facts)
-    test_sequences = parser.facts_to_sequences(test_facts)
-
-    true_triples = np.array([[s, p, o] for (p, [s, o]) in train_sequences + validation_sequences + test_sequences])
+        serialize(prefix, model=model, embeddings=hogwild_embeddings, parser=parser, argv=argv)
+
+    # Scoring engine working directly on the embedding matrices, bypassing model.predict
+    scorer, eval_memory_mb = None, args.eval_memory_mb
+    if args.eval_engine == 'numpy' or hogwild_embeddings is not None:
+        if hogwild_embeddings is not None or \
+                (args.robust is False and EmbeddingScorer.is_supported(model_name, similarity_name)):
+            scorer_kwargs = dict(model_name=model_name, similarity_name=similarity_name)
+
+            if eval_memory_mb is not None:
+                # Half of the budget goes to the score matrices, and half to the scorer's intermediate buffers
+                eval_memory_mb /= 2
+                scorer_kwargs['buffer_size'] = int(eval_memory_mb * 2 ** 20) // 8
+
+            entity_embeddings, predicate_embeddings = hogwild_embeddings if model is None else get_embeddings(model)
+            scorer = EmbeddingScorer(entity_embeddings, predicate_embeddings, **scorer_kwargs)
+        else:
+            logging.info('NumPy scoring engine not available for %s (%s), using Keras' % (model_name, similarity_name))
 
     if (is_raw is False) and (is_filtered is False):
         is_raw, is_filtered = True, True
 
-    if len(validation_sequences) > 0:
-        if is_raw is True:
-            evaluate_model(model, validation_sequences, nb_entities, tag='validation raw', fast_eval=args.fast_eval)
-        if is_filtered is True:
-            evaluate_model(model, validation_sequences, nb_entities,
-                           true_triples=true_triples, tag='validation filtered', fast_eval=args.fast_eval)
-
-    if len(test_sequences) > 0:
-        if is_raw is True:
-            evaluate_model(model, test_sequences, nb_entities, tag='test raw', fast_eval=args.fast_eval)
-        if is_filtered is True:
-            evaluate_model(model, test_sequences, nb_entities,
-                           true_triples=true_triples, tag='test filtered', fast_eval=args.fast_eval)
+    # Sink for the evaluation results: each record contains the configuration of the run
+    sink = ResultsSink(args.results, config=vars(args)) if args.results is not None else None
+
+    if args.eval_sampled is not None:
+        entity_frequencies = None
+        if args.eval_stratified is True:
+            train_entities = np.array([[s, o] for (p, [s, o]) in train_sequences]).reshape(-1)
+            entity_frequencies = np.bincount(train_entities, minlength=nb_entities + 1)[1:]
+
+        if scorer is None:
+            def scoring_function(inputs):
+                return model.predict([inputs[0], inputs[1]], batch_size=inputs[0].shape[0])[:, 0]
+            scorer = FunctionScorer(scoring_function, nb_entities)
+
+        eval_kwargs = dict(is_raw=is_raw, is_filtered=is_filtered, nb_candidates=args.eval_sampled,
+                           entity_frequencies=entity_frequencies, nb_bootstrap=args.eval_bootstrap, seed=seed,
+                           tie_policy=args.eval_ties, per_relation=args.eval_per_relation, sink=sink)
+
+        for split, evaluation_sequences in [('validation', validation_sequences), ('test', test_sequences)]:
+            if len(evaluation_sequences) > 0:
+                evaluate_sampled(scorer, evaluation_sequences, filter_index, tag=split,
+                                 record=dict(split=split, timings={'training': training_time}), **eval_kwargs)
+    elif scorer is not None:
+        eval_kwargs = dict(is_raw=is_raw, is_filtered=is_filtered, nb_workers=args.eval_workers,
+                           memory_budget_mb=eval_memory_mb, tie_policy=args.eval_ties,
+                           per_relation=args.eval_per_relation, sink=sink)
+
+        def record(split):
+            return dict(split=split, engine='numpy', timings={'training': training_time})
+
+        if len(validation_sequences) > 0:
+            evaluate_scorer(scorer, validation_sequences, filter_index, tag='validation',
+                            record=record('validation'), **eval_kwargs)
+
+        if len(test_sequences) > 0:
+            evaluate_scorer(scorer, test_sequences, filter_index, tag='test', record=record('test'), **eval_kwargs)
+    else:
+        eval_kwargs = dict(fast_eval=args.fast_eval, memory_budget_mb=eval_memory_mb, tie_policy=args.eval_ties,
+                           per_relation=args.eval_per_relation, sink=sink)
+
+        def record(split, setting):
+            return dict(split=split, setting=setting, engine='keras', timings={'training': training_time})
+
+        if len(validation_sequences) > 0:
+            if is_raw is True:
+                evaluate_model(model, validation_sequences, nb_entities, tag='validation raw',
+                               record=record('validation', 'raw'), **eval_kwargs)
+            if is_filtered is True:
+                evaluate_model(model, validation_sequences, nb_entities, true_triples=filter_index,
+                               tag='validation filtered', record=record('validation', 'filtered'), **eval_kwargs)
+
+        if len(test_sequences) > 0:
+            if is_raw is True:
+                evaluate_model(model, test_sequences, nb_entities, tag='test raw',
+                               record=record('test', 'raw'), **eval_kwargs)
+            if is_filtered is True:
+                evaluate_model(model, test_sequences, nb_entities, true_triples=filter_index,
+                               tag='test filtered', record=record('test', 'filtered'), **eval_kwargs)
+
+    if sink is not None:
+        sink.close()
 
     return model
 
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
+
 from keras.constraints import Constraint
 from keras import backend as K
 
+import theano.tensor as T
+
 from keras.utils.generic_utils import get_from_module
 
 
@@ -44,6 +48,32 @@ class GroupConstraint(Constraint):
         return {'name': self.__class__.__name__}
 
 
+class RowProjection:
+    """
+    Applies a row-wise constraint (e.g. NormConstraint(axis=1)) to a weight matrix outside of the train function,
+    either to all rows or only to a given subset of rows (e.g. the ones updated by the last optimisation step).
+    """
+    def __init__(self, W, constraint):
+        """
+        :param W: Weight matrix (shared variable).
+        :param constraint: Constraint acting independently on each row of W.
+        """
+        rows = K.placeholder(ndim=1, dtype='int32')
+        self.project_rows = K.function([rows], [], updates=[(W, T.set_subtensor(W[rows], constraint(W[rows])))])
+        self.project_all = K.function([], [], updates=[(W, constraint(W))])
+
+    def __call__(self, rows=None):
+        """
+        Projects the given rows of the weight matrix.
+
+        :param rows: Vector of row indices (possibly with repetitions) - if None, all rows are projected.
+        """
+        if rows is None:
+            self.project_all([])
+        else:
+            self.project_rows([np.unique(rows).astype('int32')])
+
+
 norm = Norm = NormConstraint
 mask = Mask = MaskConstraint
 group = Group = GroupConstraint
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+def _build_csr(keys, values):
+    """
+    Groups the values by key, returning the sorted unique keys, the offsets of each group and the grouped values.
+
+    :param keys: [nb_triples] vector of int64 keys.
+    :param values: [nb_triples] vector of values associated to each key.
+    :return: (unique keys, offsets, values) triple, where the values associated to unique_keys[i] are
+        values[offsets[i]:offsets[i + 1]].
+    """
+    order = np.lexsort((values, keys))
+    sorted_keys, sorted_values = keys[order], values[order]
+    unique_keys, starts = np.unique(sorted_keys, return_index=True)
+    offsets = np.append(starts, sorted_keys.shape[0])
+    return unique_keys, offsets, sorted_values
+
+
+class FilterIndex:
+    """
+    Index over a set of true triples, used for computing filtered ranks [1].
+
+    Triples are grouped in a CSR-style layout keyed both by (subject, predicate) and by (predicate, object), so that
+    retrieving the true objects of a (s, p, ?) query, or the true subjects of a (?, p, o) query, only costs a binary
+    search plus the size of the answer list.
+
+    [1] A Bordes et al. - Translating Embeddings for Modeling Multi-relational Data - NIPS 2013
+    """
+    def __init__(self, triples):
+        """
+        Builds the index.
+
+        :param triples: [nb_triples, 3] matrix (or list of (s, p, o) tuples) containing the true triples.
+        """
+        triples = np.asarray(triples).astype(np.int64).reshape((-1, 3))
+        triples = np.unique(triples, axis=0) if triples.shape[0] > 0 else triples
+
+        self.nb_triples = triples.shape[0]
+
+        subjects, predicates, objects = triples[:, 0], triples[:, 1], triples[:, 2]
+
+        # Sizes of the (predicate, entity) spaces used for encoding pairs in a single int64 key
+        self.predicate_range = int(predicates.max()) + 1 if self.nb_triples > 0 else 1
+        self.entity_range = int(max(subjects.max(), objects.max())) + 1 if self.nb_triples > 0 else 1
+
+        self.sp_keys, self.sp_offsets, self.sp_objects = _build_csr(
+            self._encode_sp(subjects, predicates), objects)
+        self.po_keys, self.po_offsets, self.po_subjects = _build_csr(
+            self._encode_po(predicates, objects), subjects)
+
+    def _encode_sp(self, subj_idx, pred_idx):
+        return np.asarray(subj_idx, dtype=np.int64) * self.predicate_range + np.asarray(pred_idx, dtype=np.int64)
+
+    def _encode_po(self, pred_idx, obj_idx):
+        return np.asarray(pred_idx, dtype=np.int64) * self.entity_range + np.asarray(obj_idx, dtype=np.int64)
+
+    @staticmethod
+    def _lookup(unique_keys, offsets, values, key, is_valid):
+        if is_valid:
+            i = np.searchsorted(unique_keys, key)
+            if i < unique_keys.shape[0] and unique_keys[i] == key:
+                return values[offsets[i]:offsets[i + 1]]
+        return values[:0]
+
+    def objects(self, subj_idx, pred_idx):
+        """
+        Returns the objects o such that (subj_idx, pred_idx, o) is a true triple.
+
+        :param subj_idx: Subject index.
+        :param pred_idx: Predicate index.
+        :return: Sorted vector of object indices.
+        """
+        is_valid = 0 <= subj_idx < self.entity_range and 0 <= pred_idx < self.predicate_range
+        return self._lookup(self.sp_keys, self.sp_offsets, self.sp_objects,
+                            self._encode_sp(subj_idx, pred_idx), is_valid)
+
+    def subjects(self, pred_idx, obj_idx):
+        """
+        Returns the subjects s such that (s, pred_idx, obj_idx) is a true triple.
+
+        :param pred_idx: Predicate index.
+        :param obj_idx: Object index.
+        :return: Sorted vector of subject indices.
+        """
+        is_valid = 0 <= pred_idx < self.predicate_range and 0 <= obj_idx < self.entity_range
+        return self._lookup(self.po_keys, self.po_offsets, self.po_subjects,
+                            self._encode_po(pred_idx, obj_idx), is_valid)
+
+
+def make_filter_index(true_triples):
+    """
+    Returns a FilterIndex over the given true triples, or the index itself if one is provided.
+
+    :param true_triples: FilterIndex, or [nb_triples, 3] matrix of true triples.
+    :return: FilterIndex instance.
+    """
+    return true_triples if isinstance(true_triples, FilterIndex) else FilterIndex(true_triples)
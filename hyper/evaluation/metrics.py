@@ -1,10 +1,58 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
+from hyper.evaluation.filters import make_filter_index
+
 import logging
 
 
-def ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx):
+TIE_POLICIES = ['optimistic', 'pessimistic', 'mean']
+
+
+def compute_ranks(scores, target_idxs, tie_policy='mean'):
+    """
+    Computes the rank of a target candidate for each of a batch of queries, by counting the candidates scoring
+    higher than (and as high as) the target - in O(nb_candidates) per query, rather than sorting the scores.
+
+    :param scores: [nb_queries, nb_candidates] matrix (or [nb_candidates] vector) of scores.
+    :param target_idxs: [nb_queries] vector (or scalar) of (0-based) positions of the target candidates.
+    :param tie_policy: How to rank the target with respect to candidates with exactly the same score:
+        optimistic (the target is ranked first), pessimistic (the target is ranked last) or
+        mean (average of the optimistic and pessimistic ranks).
+    :return: [nb_queries] vector of (1-based) ranks.
+    """
+    if tie_policy not in TIE_POLICIES:
+        raise ValueError('Unknown tie policy: %s' % tie_policy)
+
+    scores = np.asarray(scores)
+    scores = scores.reshape((-1, scores.shape[-1]))
+    target_idxs = np.asarray(target_idxs).reshape(-1)
+
+    target_scores = scores[np.arange(scores.shape[0]), target_idxs].reshape((-1, 1))
+
+    nb_higher = np.sum(scores > target_scores, axis=1)
+    if tie_policy == 'optimistic':
+        return nb_higher + 1
+
+    # Candidates other than the target with the same score
+    nb_ties = np.sum(scores == target_scores, axis=1) - 1
+    if tie_policy == 'pessimistic':
+        return nb_higher + nb_ties + 1
+
+    return nb_higher + (nb_ties / 2.) + 1
+
+
+def _filter_scores(filter_index, triples, all_scores_left, all_scores_right):
+    # Sets to -inf, in place, the scores of true subjects and objects other than the ones being ranked
+    for (subj_idx, pred_idx, obj_idx), scores_left, scores_right in zip(triples, all_scores_left, all_scores_right):
+        true_subj_idxs = filter_index.subjects(pred_idx, obj_idx)
+        scores_left[true_subj_idxs[true_subj_idxs != subj_idx] - 1] = - np.inf
+
+        true_obj_idxs = filter_index.objects(subj_idx, pred_idx)
+        scores_right[true_obj_idxs[true_obj_idxs != obj_idx] - 1] = - np.inf
+
+
+def ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx, tie_policy='mean'):
     err_subj, err_obj = [], []
 
     for subj_idx, pred_idx, obj_idx in triples:
@@ -17,7 +65,7 @@ def ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx):
 
         scores_left = scoring_function([Xr, Xe])
 
-        err_subj += [np.argsort(np.argsort(- scores_left))[subj_idx - 1] + 1]
+        err_subj += compute_ranks(scores_left, subj_idx - 1, tie_policy=tie_policy).tolist()
 
         Xr = np.empty((max_obj_idx, 1))
         Xr[:, 0] = pred_idx
@@ -28,71 +76,97 @@ def ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx):
 
         scores_right = scoring_function([Xr, Xe])
 
-        err_obj += [np.argsort(np.argsort(- scores_right))[obj_idx - 1] + 1]
+        err_obj += compute_ranks(scores_right, obj_idx - 1, tie_policy=tie_policy).tolist()
 
     return err_subj, err_obj
 
 
-def ranking_score_fast(scoring_function, triples, max_subj_idx, max_obj_idx):
-    subj_idx_lst, obj_idx_lst = [], []
-    Xr_l_lst, Xe_l_lst = [], []
-    Xr_r_lst, Xe_r_lst = [], []
+def memory_chunk_size(bytes_per_item, memory_budget_mb=None):
+    """
+    Number of items that can be processed at once within a given memory budget.
 
-    for subj_idx, pred_idx, obj_idx in triples:
-        subj_idx_lst += [subj_idx]
-        obj_idx_lst += [obj_idx]
+    :param bytes_per_item: Memory needed for processing a single item, in bytes.
+    :param memory_budget_mb: Memory budget, in MB - if None, the memory is considered unbounded.
+    :return: Number of items (at least 1), or None if the memory budget is None.
+    """
+    if memory_budget_mb is None:
+        return None
+    return max(1, int((memory_budget_mb * 2 ** 20) // bytes_per_item))
 
-        Xr = np.empty((max_subj_idx, 1))
-        Xr[:, 0] = pred_idx
 
-        Xe = np.empty((max_subj_idx, 2))
-        Xe[:, 0] = np.arange(1, max_subj_idx + 1)
-        Xe[:, 1] = obj_idx
+def _fast_eval_chunks(triples, max_subj_idx, max_obj_idx, memory_budget_mb):
+    # Each triple needs [max_idx, 1] predicate indices, [max_idx, 2] entity indices and [max_idx] scores
+    # (float64) on both the subject and the object side
+    triples = np.asarray(triples, dtype=np.int64).reshape((-1, 3))
+    chunk_size = memory_chunk_size((max_subj_idx + max_obj_idx) * 4 * 8, memory_budget_mb)
+    chunk_size = chunk_size if chunk_size is not None else max(1, triples.shape[0])
+    for chunk_start in range(0, triples.shape[0], chunk_size):
+        yield triples[chunk_start:chunk_start + chunk_size]
 
-        Xr_l_lst += [Xr]
-        Xe_l_lst += [Xe]
 
-        Xr = np.empty((max_obj_idx, 1))
-        Xr[:, 0] = pred_idx
+def _fast_eval_scores(scoring_function, chunk_triples, max_subj_idx, max_obj_idx):
+    # Scores all the (?, p, o) and (s, p, ?) corruptions of the triples in a chunk, with one call per side;
+    # each distinct (p, o) and (s, p) pattern in the chunk is only scored once
+    po_patterns, po_inverse = np.unique(chunk_triples[:, [1, 2]], axis=0, return_inverse=True)
+    nb_patterns = po_patterns.shape[0]
 
-        Xe = np.empty((max_obj_idx, 2))
-        Xe[:, 0] = subj_idx
-        Xe[:, 1] = np.arange(1, max_obj_idx + 1)
+    Xr = np.empty((nb_patterns * max_subj_idx, 1))
+    Xr[:, 0] = np.repeat(po_patterns[:, 0], max_subj_idx)
 
-        Xr_r_lst += [Xr]
-        Xe_r_lst += [Xe]
+    Xe = np.empty((nb_patterns * max_subj_idx, 2))
+    Xe[:, 0] = np.tile(np.arange(1, max_subj_idx + 1), nb_patterns)
+    Xe[:, 1] = np.repeat(po_patterns[:, 1], max_subj_idx)
 
-    all_Xr_l = np.concatenate(Xr_l_lst, axis=0)
-    all_Xe_l = np.concatenate(Xe_l_lst, axis=0)
+    all_scores_left = np.asarray(scoring_function([Xr, Xe])).reshape((nb_patterns, max_subj_idx))
+    all_scores_left = all_scores_left[po_inverse.reshape(-1), :]
 
-    all_Xr_r = np.concatenate(Xr_r_lst, axis=0)
-    all_Xe_r = np.concatenate(Xe_r_lst, axis=0)
+    sp_patterns, sp_inverse = np.unique(chunk_triples[:, [0, 1]], axis=0, return_inverse=True)
+    nb_patterns = sp_patterns.shape[0]
 
-    all_scores_left = scoring_function([all_Xr_l, all_Xe_l])
-    all_scores_right = scoring_function([all_Xr_r, all_Xe_r])
+    Xr = np.empty((nb_patterns * max_obj_idx, 1))
+    Xr[:, 0] = np.repeat(sp_patterns[:, 1], max_obj_idx)
 
-    err_subj, err_obj = [], []
-    start_idx, end_idx = 0, 0
+    Xe = np.empty((nb_patterns * max_obj_idx, 2))
+    Xe[:, 0] = np.repeat(sp_patterns[:, 0], max_obj_idx)
+    Xe[:, 1] = np.tile(np.arange(1, max_obj_idx + 1), nb_patterns)
+
+    all_scores_right = np.asarray(scoring_function([Xr, Xe])).reshape((nb_patterns, max_obj_idx))
+    all_scores_right = all_scores_right[sp_inverse.reshape(-1), :]
+
+    return all_scores_left, all_scores_right
 
-    for (subj_idx, pred_idx, obj_idx), Xr_l in zip(triples, Xr_l_lst):
-        end_idx += Xr_l.shape[0]
 
-        err_obj += [np.argsort(np.argsort(- all_scores_right[start_idx:end_idx]))[obj_idx - 1] + 1]
-        err_subj += [np.argsort(np.argsort(- all_scores_left[start_idx:end_idx]))[subj_idx - 1] + 1]
+def ranking_score_fast(scoring_function, triples, max_subj_idx, max_obj_idx, memory_budget_mb=None,
+                       tie_policy='mean'):
+    """
+    Batched version of ranking_score: the queries of (a chunk of) the triples are scored with a single call
+    to the scoring function.
+
+    :param scoring_function: Function mapping a list [Xr, Xe] of predicate and entity indices to scores.
+    :param triples: List of (s, p, o) triples.
+    :param max_subj_idx: Number of candidate subjects.
+    :param max_obj_idx: Number of candidate objects.
+    :param memory_budget_mb: Memory budget, in MB, for the chunks of triples scored at once (unbounded if None).
+    :param tie_policy: Tie policy used for computing the ranks (see compute_ranks).
+    :return: (err_subj, err_obj) lists of subject and object ranks.
+    """
+    err_subj, err_obj = [], []
+
+    for chunk_triples in _fast_eval_chunks(triples, max_subj_idx, max_obj_idx, memory_budget_mb):
+        all_scores_left, all_scores_right = _fast_eval_scores(scoring_function, chunk_triples,
+                                                              max_subj_idx, max_obj_idx)
 
-        start_idx += Xr_l.shape[0]
+        err_subj += compute_ranks(all_scores_left, chunk_triples[:, 0] - 1, tie_policy=tie_policy).tolist()
+        err_obj += compute_ranks(all_scores_right, chunk_triples[:, 2] - 1, tie_policy=tie_policy).tolist()
 
     return err_subj, err_obj
 
 
-def filtered_ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx, true_triples):
+def filtered_ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx, true_triples, tie_policy='mean'):
+    filter_index = make_filter_index(true_triples)
     err_subj, err_obj = [], []
 
     for subj_idx, pred_idx, obj_idx in triples:
-        _is = np.argwhere(true_triples[:, 0] == subj_idx).reshape(-1,)
-        _ip = np.argwhere(true_triples[:, 1] == pred_idx).reshape(-1,)
-        _io = np.argwhere(true_triples[:, 2] == obj_idx).reshape(-1,)
-
         Xr = np.empty((max_subj_idx, 1))
         Xr[:, 0] = pred_idx
 
@@ -102,11 +176,11 @@ def filtered_ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx,
 
         scores_left = scoring_function([Xr, Xe])
 
-        inter_subj = [i for i in _io if i in _ip]
-        rmv_idx_subj = [true_triples[i, 0] - 1 for i in inter_subj if true_triples[i, 0] != subj_idx]
+        true_subj_idxs = filter_index.subjects(pred_idx, obj_idx)
+        rmv_idx_subj = true_subj_idxs[true_subj_idxs != subj_idx] - 1
         scores_left[rmv_idx_subj] = - np.inf
 
-        err_subj += [np.argsort(np.argsort(scores_left.flatten())[::-1])[subj_idx - 1] + 1]
+        err_subj += compute_ranks(scores_left, subj_idx - 1, tie_policy=tie_policy).tolist()
 
         Xr = np.empty((max_obj_idx, 1))
         Xr[:, 0] = pred_idx
@@ -117,173 +191,502 @@ def filtered_ranking_score(scoring_function, triples, max_subj_idx, max_obj_idx,
 
         scores_right = scoring_function([Xr, Xe])
 
-        inter_obj = [i for i in _is if i in _ip]
-        rmv_idx_obj = [true_triples[i, 2] - 1 for i in inter_obj if true_triples[i, 2] != obj_idx]
+        true_obj_idxs = filter_index.objects(subj_idx, pred_idx)
+        rmv_idx_obj = true_obj_idxs[true_obj_idxs != obj_idx] - 1
         scores_right[rmv_idx_obj] = - np.inf
 
-        err_obj += [np.argsort(np.argsort(scores_right.flatten())[::-1])[obj_idx - 1] + 1]
+        err_obj += compute_ranks(scores_right, obj_idx - 1, tie_policy=tie_policy).tolist()
 
     return err_subj, err_obj
 
 
-def filtered_ranking_score_fast(scoring_function, triples, max_subj_idx, max_obj_idx, true_triples):
-    Xr_l_lst, Xe_l_lst = [], []
-    Xr_r_lst, Xe_r_lst = [], []
+def filtered_ranking_score_fast(scoring_function, triples, max_subj_idx, max_obj_idx, true_triples,
+                                memory_budget_mb=None, tie_policy='mean'):
+    """
+    Batched version of filtered_ranking_score: the queries of (a chunk of) the triples are scored with a single
+    call to the scoring function.
+
+    :param scoring_function: Function mapping a list [Xr, Xe] of predicate and entity indices to scores.
+    :param triples: List of (s, p, o) triples.
+    :param max_subj_idx: Number of candidate subjects.
+    :param max_obj_idx: Number of candidate objects.
+    :param true_triples: FilterIndex or [nb_triples, 3] matrix of true triples.
+    :param memory_budget_mb: Memory budget, in MB, for the chunks of triples scored at once (unbounded if None).
+    :param tie_policy: Tie policy used for computing the ranks (see compute_ranks).
+    :return: (err_subj, err_obj) lists of subject and object ranks.
+    """
+    filter_index = make_filter_index(true_triples)
+    err_subj, err_obj = [], []
 
-    for subj_idx, pred_idx, obj_idx in triples:
-        Xr = np.empty((max_subj_idx, 1))
-        Xr[:, 0] = pred_idx
+    for chunk_triples in _fast_eval_chunks(triples, max_subj_idx, max_obj_idx, memory_budget_mb):
+        all_scores_left, all_scores_right = _fast_eval_scores(scoring_function, chunk_triples,
+                                                              max_subj_idx, max_obj_idx)
 
-        Xe = np.empty((max_subj_idx, 2))
-        Xe[:, 0] = np.arange(1, max_subj_idx + 1)
-        Xe[:, 1] = obj_idx
+        _filter_scores(filter_index, chunk_triples, all_scores_left, all_scores_right)
 
-        Xr_l_lst += [Xr]
-        Xe_l_lst += [Xe]
+        err_subj += compute_ranks(all_scores_left, chunk_triples[:, 0] - 1, tie_policy=tie_policy).tolist()
+        err_obj += compute_ranks(all_scores_right, chunk_triples[:, 2] - 1, tie_policy=tie_policy).tolist()
 
-        Xr = np.empty((max_obj_idx, 1))
-        Xr[:, 0] = pred_idx
+    return err_subj, err_obj
 
-        Xe = np.empty((max_obj_idx, 2))
-        Xe[:, 0] = subj_idx
-        Xe[:, 1] = np.arange(1, max_obj_idx + 1)
 
-        Xr_r_lst += [Xr]
-        Xe_r_lst += [Xe]
+def _grouped_ranks(score_patterns, patterns, target_idxs, true_idxs_function=None, batch_size=128,
+                   tie_policy='mean'):
+    """
+    Ranks the targets of a set of queries, scoring each distinct query pattern only once.
+
+    :param score_patterns: Function mapping a [nb_patterns, 2] matrix of query patterns, e.g. (p, o) pairs,
+        to a [nb_patterns, nb_entities] matrix of scores.
+    :param patterns: [nb_queries, 2] matrix of query patterns.
+    :param target_idxs: [nb_queries] vector of (1-based) target entities.
+    :param true_idxs_function: Function mapping a pattern to the true answers to be filtered out - if None,
+        filtered ranks are not computed.
+    :param batch_size: Number of patterns scored (and of queries ranked) at once.
+    :param tie_policy: Tie policy used for computing the ranks (see compute_ranks).
+    :return: (ranks, filtered_ranks, nb_patterns) triple.
+    """
+    nb_queries = patterns.shape[0]
+    dtype = float if tie_policy == 'mean' else np.int64
+
+    ranks = np.zeros(nb_queries, dtype=dtype)
+    filtered_ranks = np.zeros(nb_queries, dtype=dtype) if true_idxs_function is not None else None
+
+    if nb_queries == 0:
+        return ranks, filtered_ranks, 0
+
+    # Queries grouped by pattern: the queries of the i-th pattern are order[offsets[i]:offsets[i + 1]]
+    unique_patterns, inverse = np.unique(patterns, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind='stable')
+    offsets = np.searchsorted(inverse[order], np.arange(unique_patterns.shape[0] + 1))
+
+    for batch_start in range(0, unique_patterns.shape[0], batch_size):
+        batch_end = min(batch_start + batch_size, unique_patterns.shape[0])
+        batch_scores = score_patterns(unique_patterns[batch_start:batch_end])
+        batch_query_idxs = order[offsets[batch_start]:offsets[batch_end]]
+
+        for chunk_start in range(0, batch_query_idxs.shape[0], batch_size):
+            query_idxs = batch_query_idxs[chunk_start:chunk_start + batch_size]
+
+            # Score vectors are shared by all the queries with the same pattern
+            chunk_scores = batch_scores[inverse[query_idxs] - batch_start, :]
+            chunk_target_idxs = target_idxs[query_idxs]
+
+            ranks[query_idxs] = compute_ranks(chunk_scores, chunk_target_idxs - 1, tie_policy=tie_policy)
+
+            if true_idxs_function is not None:
+                for scores, query_idx, target_idx in zip(chunk_scores, query_idxs, chunk_target_idxs):
+                    true_idxs = true_idxs_function(*patterns[query_idx])
+                    scores[true_idxs[true_idxs != target_idx] - 1] = - np.inf
+
+                filtered_ranks[query_idxs] = compute_ranks(chunk_scores, chunk_target_idxs - 1, tie_policy=tie_policy)
+
+    return ranks, filtered_ranks, unique_patterns.shape[0]
+
+
+def scorer_ranking_scores(scorer, triples, filter_index=None, batch_size=128, memory_budget_mb=None,
+                          tie_policy='mean', stats=None):
+    """
+    Computes the raw and (if filter_index is provided) the filtered ranks of the subject and object of each triple,
+    scoring batches of (?, p, o) and (s, p, ?) queries against all entities by means of a scorer
+    (e.g. hyper.evaluation.scoring.EmbeddingScorer).
+
+    Each distinct (?, p, o) and (s, p, ?) query is scored only once, and raw and filtered ranks of all the triples
+    sharing it are computed from the same scores.
+
+    :param scorer: Object exposing score_subjects(pred_idxs, obj_idxs) and score_objects(subj_idxs, pred_idxs).
+    :param triples: List of (s, p, o) triples.
+    :param filter_index: FilterIndex or [nb_triples, 3] matrix of true triples, used for the filtered ranks.
+    :param batch_size: Number of queries scored at once.
+    :param memory_budget_mb: Memory budget, in MB, for the [batch_size, nb_entities] score matrices: if provided,
+        it overrides batch_size.
+    :param tie_policy: Tie policy used for computing the ranks (see compute_ranks).
+    :param stats: If provided, dictionary where the number of queries ('queries') and of distinct, scored
+        queries ('scored_queries') are accumulated.
+    :return: ((err_subj, err_obj), (filtered_err_subj, filtered_err_obj)) pair, where the latter is None if
+        filter_index is None.
+    """
+    filter_index = make_filter_index(filter_index) if filter_index is not None else None
+    triples = np.asarray(triples, dtype=np.int64).reshape((-1, 3))
+
+    if memory_budget_mb is not None:
+        # Pattern scores and (copies of the) query scores (float64)
+        batch_size = memory_chunk_size(scorer.nb_entities * 2 * 8, memory_budget_mb)
+
+    kwargs = dict(batch_size=batch_size, tie_policy=tie_policy)
+
+    # (?, p, o) queries
+    err_subj, filtered_err_subj, nb_subj_patterns = _grouped_ranks(
+        lambda patterns: scorer.score_subjects(patterns[:, 0], patterns[:, 1]), triples[:, [1, 2]], triples[:, 0],
+        true_idxs_function=filter_index.subjects if filter_index is not None else None, **kwargs)
+
+    # (s, p, ?) queries
+    err_obj, filtered_err_obj, nb_obj_patterns = _grouped_ranks(
+        lambda patterns: scorer.score_objects(patterns[:, 0], patterns[:, 1]), triples[:, [0, 1]], triples[:, 2],
+        true_idxs_function=filter_index.objects if filter_index is not None else None, **kwargs)
+
+    if stats is not None:
+        stats['queries'] = stats.get('queries', 0) + 2 * triples.shape[0]
+        stats['scored_queries'] = stats.get('scored_queries', 0) + nb_subj_patterns + nb_obj_patterns
+
+    filtered_res = (filtered_err_subj.tolist(), filtered_err_obj.tolist()) if filter_index is not None else None
+    return (err_subj.tolist(), err_obj.tolist()), filtered_res
+
+
+def scorer_ranking_score(scorer, triples, true_triples=None, batch_size=128, memory_budget_mb=None,
+                         tie_policy='mean'):
+    """
+    Computes the ranks of the subject and object of each triple, scoring batches of (?, p, o) and (s, p, ?)
+    queries against all entities by means of a scorer (e.g. hyper.evaluation.scoring.EmbeddingScorer).
+
+    :param scorer: Object exposing score_subjects(pred_idxs, obj_idxs) and score_objects(subj_idxs, pred_idxs).
+    :param triples: List of (s, p, o) triples.
+    :param true_triples: FilterIndex or [nb_triples, 3] matrix of true triples: if provided, filtered ranks
+        are computed.
+    :param batch_size: Number of queries scored at once.
+    :param memory_budget_mb: Memory budget, in MB, for the [batch_size, nb_entities] score matrices: if provided,
+        it overrides batch_size.
+    :param tie_policy: Tie policy used for computing the ranks (see compute_ranks).
+    :return: (err_subj, err_obj) lists of subject and object ranks.
+    """
+    res, filtered_res = scorer_ranking_scores(scorer, triples, filter_index=true_triples, batch_size=batch_size,
+                                              memory_budget_mb=memory_budget_mb, tie_policy=tie_policy)
+    return res if true_triples is None else filtered_res
+
+
+def candidate_strata(nb_entities, nb_candidates, entity_frequencies=None, nb_strata=4):
+    """
+    Splits the entities in strata, and allocates a number of sampled candidates to each stratum proportionally
+    to its size.
+
+    :param nb_entities: Number of entities (indexed from 1 to nb_entities).
+    :param nb_candidates: Total number of candidates to sample.
+    :param entity_frequencies: If provided, [nb_entities] vector containing the frequency of each entity (the i-th
+        element refers to entity i + 1): entities are then split in nb_strata strata of entities with similar
+        frequencies. Otherwise, all entities are in a single stratum.
+    :param nb_strata: Number of strata.
+    :return: (strata, allocation) pair, where strata is a list of vectors of entity indices, and allocation[i] is
+        the number of candidates sampled from strata[i] (at least one).
+    """
+    if entity_frequencies is None:
+        strata = [np.arange(1, nb_entities + 1)]
+    else:
+        order = np.argsort(np.asarray(entity_frequencies)[:nb_entities], kind='stable') + 1
+        strata = np.array_split(order, min(nb_strata, nb_entities))
+
+    sizes = np.array([stratum.shape[0] for stratum in strata])
+    allocation = np.maximum(1, np.round(nb_candidates * sizes / float(nb_entities)).astype(int))
+    return strata, allocation
+
+
+def _estimated_ranks(target_scores, candidate_scores, weights, mask, tie_policy):
+    # Stratified estimate of the number of entities scoring higher than (and as high as) the target
+    nb_higher = np.sum(((candidate_scores > target_scores) & mask) * weights, axis=1)
+    if tie_policy == 'optimistic':
+        return nb_higher + 1
+
+    nb_ties = np.sum(((candidate_scores == target_scores) & mask) * weights, axis=1)
+    if tie_policy == 'pessimistic':
+        return nb_higher + nb_ties + 1
+
+    return nb_higher + (nb_ties / 2.) + 1
+
+
+def sampled_ranking_scores(scorer, triples, nb_candidates=100, filter_index=None, entity_frequencies=None,
+                           nb_strata=4, seed=1, batch_size=1024, tie_policy='mean'):
+    """
+    Estimates the raw and (if filter_index is provided) the filtered ranks of the subject and object of each triple
+    by ranking each target against a random sample of candidates rather than against all entities.
+
+    Candidates are drawn with a fixed seed, so that different models (or epochs) are compared on the same sample.
+    If entity frequencies are provided, the sampling is stratified by frequency: each candidate drawn from a stratum
+    counts as size of the stratum / candidates drawn from the stratum entities, which yields an unbiased estimate
+    of the number of entities scoring higher than the target.
+
+    :param scorer: Object mapping a list [Xr, Xe] of predicate and entity indices to scores
+        (e.g. hyper.evaluation.scoring.EmbeddingScorer).
+    :param triples: List of (s, p, o) triples.
+    :param nb_candidates: Number of candidates sampled for each query.
+    :param filter_index: FilterIndex or [nb_triples, 3] matrix of true triples, used for the filtered ranks.
+    :param entity_frequencies: Entity frequencies used for stratifying the sample (see candidate_strata).
+    :param nb_strata: Number of frequency strata.
+    :param seed: Seed used for sampling the candidates.
+    :param batch_size: Number of triples scored at once.
+    :param tie_policy: Tie policy used for computing the ranks (see compute_ranks).
+    :return: ((err_subj, err_obj), (filtered_err_subj, filtered_err_obj)) pair of estimated ranks, where the latter
+        is None if filter_index is None.
+    """
+    if tie_policy not in TIE_POLICIES:
+        raise ValueError('Unknown tie policy: %s' % tie_policy)
+
+    filter_index = make_filter_index(filter_index) if filter_index is not None else None
+    triples = np.asarray(triples, dtype=np.int64).reshape((-1, 3))
+    nb_triples = triples.shape[0]
+
+    random_state = np.random.RandomState(seed)
+    strata, allocation = candidate_strata(scorer.nb_entities, nb_candidates, entity_frequencies, nb_strata)
+    weights = np.concatenate([np.full(k, stratum.shape[0] / float(k)) for stratum, k in zip(strata, allocation)])
+
+    def sample_candidates():
+        return np.concatenate([stratum[random_state.randint(0, stratum.shape[0], size=(nb_triples, k))]
+                               for stratum, k in zip(strata, allocation)], axis=1)
+
+    # [nb_triples, nb_candidates] matrices of candidate subjects and objects, drawn once
+    subj_candidates, obj_candidates = sample_candidates(), sample_candidates()
+
+    def true_subjects(subj_idx, pred_idx, obj_idx):
+        return filter_index.subjects(pred_idx, obj_idx)
+
+    def true_objects(subj_idx, pred_idx, obj_idx):
+        return filter_index.objects(subj_idx, pred_idx)
+
+    res, filtered_res = ([], []), ([], [])
+
+    for batch_start in range(0, nb_triples, batch_size):
+        batch_triples = triples[batch_start:batch_start + batch_size]
+        batch_end = batch_start + batch_triples.shape[0]
+
+        # Each row contains the target, followed by the sampled candidates
+        subj_idxs = np.column_stack([batch_triples[:, 0], subj_candidates[batch_start:batch_end]])
+        obj_idxs = np.column_stack([batch_triples[:, 2], obj_candidates[batch_start:batch_end]])
+        nb_columns = subj_idxs.shape[1]
+
+        pred_idxs = np.tile(batch_triples[:, 1:2], (1, nb_columns))
+
+        # (?, p, o) and (s, p, ?) queries, as (subjects, objects, ranked entities, true answers) tuples
+        queries = [(subj_idxs, np.tile(batch_triples[:, 2:3], (1, nb_columns)), subj_idxs, true_subjects),
+                   (np.tile(batch_triples[:, 0:1], (1, nb_columns)), obj_idxs, obj_idxs, true_objects)]
+
+        for side, (query_subj_idxs, query_obj_idxs, entity_idxs, true_idxs_function) in enumerate(queries):
+            Xr = pred_idxs.reshape((-1, 1))
+            Xe = np.column_stack([query_subj_idxs.reshape(-1), query_obj_idxs.reshape(-1)])
+
+            scores = np.asarray(scorer([Xr, Xe])).reshape((-1, nb_columns))
+            target_scores, candidate_scores = scores[:, :1], scores[:, 1:]
+
+            # Sampled copies of the target itself are not counted
+            mask = entity_idxs[:, 1:] != entity_idxs[:, :1]
+            res[side].extend(_estimated_ranks(target_scores, candidate_scores, weights, mask, tie_policy).tolist())
+
+            if filter_index is not None:
+                # Neither are the true answers other than the target
+                for row_mask, triple, row_candidate_idxs in zip(mask, batch_triples, entity_idxs[:, 1:]):
+                    row_mask &= ~ np.isin(row_candidate_idxs, true_idxs_function(*triple))
+
+                filtered_ranks = _estimated_ranks(target_scores, candidate_scores, weights, mask, tie_policy)
+                filtered_res[side].extend(filtered_ranks.tolist())
+
+    return res, filtered_res if filter_index is not None else None
+
+
+def bootstrap_rank_metrics(ranks, hits_at=(1, 3, 5, 10), nb_samples=1000, confidence=0.95, seed=1):
+    """
+    Computes percentile bootstrap confidence intervals for the mean rank, mean reciprocal rank and Hits@k (in %)
+    of a vector of ranks.
+
+    :param ranks: Vector (or list) of ranks.
+    :param hits_at: List of cut-offs k.
+    :param nb_samples: Number of bootstrap samples.
+    :param confidence: Confidence level of the intervals.
+    :param seed: Seed used for drawing the bootstrap samples.
+    :return: Dictionary mapping mr, mrr and hits@k to (lower, upper) pairs - (nan, nan) if there are no ranks.
+    """
+    ranks = np.asarray(ranks, dtype=float).reshape(-1)
+    nb_ranks = ranks.shape[0]
+    random_state = np.random.RandomState(seed)
+
+    names = ['mr', 'mrr'] + ['hits@%d' % k for k in hits_at]
+    if nb_ranks == 0:
+        return {name: (float('nan'), float('nan')) for name in names}
+
+    # [nb_ranks, 2 + nb_cutoffs] matrix of the per-query values of each metric
+    values = np.column_stack([ranks, 1. / ranks, (ranks[:, None] <= np.asarray(hits_at)[None, :]) * 100.])
+
+    # Bootstrap samples are drawn in chunks of at most ~2^20 indices
+    chunk_size = max(1, 2 ** 20 // max(1, nb_ranks))
+    sample_means = []
+    for chunk_start in range(0, nb_samples, chunk_size):
+        sample_idxs = random_state.randint(0, nb_ranks, size=(min(chunk_size, nb_samples - chunk_start), nb_ranks))
+        sample_means += [np.mean(values[sample_idxs], axis=1)]
+
+    alpha = (1. - confidence) / 2. * 100
+    lower, upper = np.percentile(np.concatenate(sample_means), [alpha, 100 - alpha], axis=0)
+
+    return {name: (float(lower[i]), float(upper[i])) for i, name in enumerate(names)}
+
+
+def rank_metrics(ranks, hits_at=(1, 3, 5, 10)):
+    """
+    Computes the mean rank, median rank, mean reciprocal rank and Hits@k (in %, for every k in hits_at) of a vector
+    of ranks, in a single pass: the ranks are sorted once, and all the Hits@k values are read with a binary search.
+
+    :param ranks: Vector (or list) of ranks.
+    :param hits_at: List of cut-offs k.
+    :return: Dictionary with keys mr, median, mrr and hits@k.
+    """
+    ranks = np.asarray(ranks, dtype=float).reshape(-1)
+    sorted_ranks = np.sort(ranks)
 
-    all_Xr_l = np.concatenate(Xr_l_lst, axis=0)
-    all_Xe_l = np.concatenate(Xe_l_lst, axis=0)
+    hits = np.searchsorted(sorted_ranks, np.asarray(hits_at), side='right') / float(ranks.shape[0]) * 100
 
-    all_Xr_r = np.concatenate(Xr_r_lst, axis=0)
-    all_Xe_r = np.concatenate(Xe_r_lst, axis=0)
+    res = {'mr': np.mean(ranks), 'median': np.median(sorted_ranks), 'mrr': np.mean(1. / ranks)}
+    res.update({'hits@%d' % k: value for k, value in zip(hits_at, hits)})
+    return res
 
-    all_scores_left = scoring_function([all_Xr_l, all_Xe_l])
-    all_scores_right = scoring_function([all_Xr_r, all_Xe_r])
 
-    err_subj, err_obj = [], []
-    start_idx, end_idx = 0, 0
+def ranking_summary(res, idxo=None, n=10, tag='raw', sink=None, record=None, tie_policy=None):
+    """
+    Logs (and optionally writes to a results sink) a summary of the subject and object ranks of a set of triples.
+
+    :param res: (err_subj, err_obj) pair of lists of subject and object ranks.
+    :param idxo: If provided, predicate of each triple, used for computing per-relation (see relation_metrics) and
+        macro-averaged metrics.
+    :param n: Cut-off, or list of cut-offs, for Hits@n: all metrics are computed at once, and a summary is
+        logged for each cut-off.
+    :param tag: Tag used in the logs.
+    :param sink: If provided, results sink (e.g. hyper.io.ResultsSink) where a record with the micro-averaged
+        left, right and global metrics (and, if idxo is provided, the per-relation and macro-averaged metrics)
+        is written.
+    :param record: Additional fields (e.g. split, timings) of the record written to the sink.
+    :param tie_policy: If provided, tie policy used for computing the ranks (see compute_ranks), which is logged
+        and written to the sink.
+    :return: Dictionary containing the metrics - Hits@n values for each cut-off k are stored as e.g.
+        microlhits@k, while microlhits@n refers to the last cut-off; the per-relation table is stored in relations,
+        and the per-relation metrics at the last cut-off also in the dictrel* dictionaries.
+    """
+    ns = [int(k) for k in np.asarray(n).reshape(-1)]
+
+    resg = list(res[0]) + list(res[1])
+    side_metrics = [('l', rank_metrics(res[0], ns)), ('r', rank_metrics(res[1], ns)), ('g', rank_metrics(resg, ns))]
 
-    for (subj_idx, pred_idx, obj_idx), Xr_l in zip(triples, Xr_l_lst):
-        end_idx += Xr_l.shape[0]
+    dres = {}
+    for side, side_res in side_metrics:
+        dres.update({'micro%smean' % side: side_res['mr'], 'micro%smedian' % side: side_res['median'],
+                     'micro%smrr' % side: side_res['mrr'], 'micro%shits@n' % side: side_res['hits@%d' % ns[-1]]})
+        dres.update({'micro%shits@%d' % (side, k): side_res['hits@%d' % k] for k in ns})
+
+    table = relation_metrics(res, idxo, ns) if idxo is not None else None
+    if table is not None:
+        dres['relations'] = table
+        dres.update(_relation_dicts(res, idxo, table, ns[-1]))
+
+    if tie_policy is not None:
+        logging.info('### TIES (%s): %s' % (tag, tie_policy))
+
+    for k in ns:
+        logging.info('### MICRO (%s):' % (tag))
+        logging.info('\t-- left   >> mean: %s, median: %s, mrr: %s, hits@%s: %s%%' %
+                     (round(dres['microlmean'], 5), round(dres['microlmedian'], 5),
+                      round(dres['microlmrr'], 3), k, round(dres['microlhits@%d' % k], 3)))
+        logging.info('\t-- right  >> mean: %s, median: %s, mrr: %s, hits@%s: %s%%' %
+                     (round(dres['micrormean'], 5), round(dres['micrormedian'], 5),
+                      round(dres['micrormrr'], 3), k, round(dres['microrhits@%d' % k], 3)))
+        logging.info('\t-- global >> mean: %s, median: %s, mrr: %s, hits@%s: %s%%' %
+                     (round(dres['microgmean'], 5), round(dres['microgmedian'], 5),
+                      round(dres['microgmrr'], 3), k, round(dres['microghits@%d' % k], 3)))
+
+        if table is not None:
+            dres.update(_macro_summary(table, k, tag))
+
+    if sink is not None:
+        sink_record = dict(record if record is not None else {})
+        if tie_policy is not None:
+            sink_record['tie_policy'] = tie_policy
+        sink_record.update({'tag': tag, 'nb_triples': len(res[0]),
+                            'left': side_metrics[0][1], 'right': side_metrics[1][1], 'global': side_metrics[2][1]})
+        if table is not None:
+            sink_record['relations'] = {key: value.tolist() for key, value in table.items()}
+            sink_record['macro'] = {key[5:]: value for key, value in dres.items()
+                                    if key.startswith('macro') and not key.endswith('@n')}
+        sink.write(sink_record)
 
-        scores_left = all_scores_left[start_idx:end_idx]
-        scores_right = all_scores_right[start_idx:end_idx]
+    return dres
 
-        _is = np.argwhere(true_triples[:, 0] == subj_idx).reshape(-1,)
-        _ip = np.argwhere(true_triples[:, 1] == pred_idx).reshape(-1,)
-        _io = np.argwhere(true_triples[:, 2] == obj_idx).reshape(-1,)
 
-        inter_subj = [i for i in _io if i in _ip]
-        rmv_idx_subj = [true_triples[i, 0] - 1 for i in inter_subj if true_triples[i, 0] != subj_idx]
-        scores_left[rmv_idx_subj] = - np.inf
+def _relation_dicts(res, idxo, table, n):
+    # Per-relation ranks and metrics as dictionaries keyed by predicate, as in the dictrel* entries of the summary
+    relations = table['relations'].tolist()
 
-        err_subj += [np.argsort(np.argsort(scores_left.flatten())[::-1])[subj_idx - 1] + 1]
+    # Ranks grouped by predicate, following the (sorted) order of the relations in the table
+    order = np.argsort(np.asarray(idxo).reshape(-1), kind='mergesort')
+    splits = np.cumsum(table['count'])[:-1]
+    left_ranks, right_ranks = [np.split(np.asarray(ranks)[order], splits) for ranks in res]
 
-        inter_obj = [i for i in _is if i in _ip]
-        rmv_idx_obj = [true_triples[i, 2] - 1 for i in inter_obj if true_triples[i, 2] != obj_idx]
-        scores_right[rmv_idx_obj] = - np.inf
+    dres = {'dictrelres': {relation: [left.tolist(), right.tolist()]
+                           for relation, left, right in zip(relations, left_ranks, right_ranks)}}
+    for side in ['l', 'r', 'g']:
+        for name, key in [('mean', 'mean'), ('median', 'median'), ('rn', 'hits@%d' % n)]:
+            dres['dictrel%s%s' % (side, name)] = dict(zip(relations, table['%s%s' % (side, key)].tolist()))
+    return dres
 
-        err_obj += [np.argsort(np.argsort(scores_right.flatten())[::-1])[obj_idx - 1] + 1]
 
-        start_idx += Xr_l.shape[0]
+def _segment_medians(values, groups, nb_groups):
+    # Medians of the values in each group, by sorting the values by (group, value) once
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
 
-    return err_subj, err_obj
+    counts = np.bincount(groups, minlength=nb_groups)
+    starts = np.cumsum(counts) - counts
+
+    lower, upper = starts + (counts - 1) // 2, starts + counts // 2
+    return (sorted_values[lower] + sorted_values[upper]) / 2.
+
+
+def relation_metrics(res, idxo, hits_at=(1, 3, 5, 10)):
+    """
+    Computes mean rank, median rank, mean reciprocal rank and Hits@k (in %) of the subject (l), object (r) and all
+    (g) ranks of the triples of each predicate, by means of segment reductions over the rank vectors.
+
+    :param res: (err_subj, err_obj) pair of lists of subject and object ranks.
+    :param idxo: Predicate of each triple.
+    :param hits_at: List of cut-offs k.
+    :return: Per-relation table, as a dictionary mapping 'relations' to the sorted vector of distinct predicates,
+        'count' to the number of triples of each predicate, and e.g. 'lmean', 'rmrr', 'ghits@10' to the vectors
+        containing the corresponding metric for each predicate.
+    """
+    relations, inverse = np.unique(np.asarray(idxo), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    nb_relations = relations.shape[0]
+
+    left_ranks, right_ranks = np.asarray(res[0], dtype=float), np.asarray(res[1], dtype=float)
+    counts = np.bincount(inverse, minlength=nb_relations)
+
+    table = {'relations': relations, 'count': counts}
+
+    for side, ranks, groups in [('l', left_ranks, inverse), ('r', right_ranks, inverse),
+                                ('g', np.concatenate([left_ranks, right_ranks]), np.concatenate([inverse, inverse]))]:
+        side_counts = np.bincount(groups, minlength=nb_relations).astype(float)
+
+        table['%smean' % side] = np.bincount(groups, weights=ranks, minlength=nb_relations) / side_counts
+        table['%smedian' % side] = _segment_medians(ranks, groups, nb_relations)
+        table['%smrr' % side] = np.bincount(groups, weights=1. / ranks, minlength=nb_relations) / side_counts
+
+        for k in hits_at:
+            nb_hits = np.bincount(groups, weights=(ranks <= k).astype(float), minlength=nb_relations)
+            table['%shits@%d' % (side, k)] = nb_hits / side_counts * 100
+
+    return table
 
 
-def ranking_summary(res, idxo=None, n=10, tag='raw'):
+def _macro_summary(table, n, tag):
+    # Macro-averaged metrics: averages over relations of the per-relation metrics
     dres = {}
-    dres.update({'microlmean': np.mean(res[0])})
-    dres.update({'microlmedian': np.median(res[0])})
-    dres.update({'microlhits@n': np.mean(np.asarray(res[0]) <= n) * 100})
-    dres.update({'micrormean': np.mean(res[1])})
-    dres.update({'micrormedian': np.median(res[1])})
-    dres.update({'microrhits@n': np.mean(np.asarray(res[1]) <= n) * 100})
-
-    resg = res[0] + res[1]
-
-    dres.update({'microgmean': np.mean(resg)})
-    dres.update({'microgmedian': np.median(resg)})
-    dres.update({'microghits@n': np.mean(np.asarray(resg) <= n) * 100})
-
-    dres.update({'microlmrr': np.mean(1. / np.asarray(res[0]))})
-    dres.update({'micrormrr': np.mean(1. / np.asarray(res[1]))})
-    dres.update({'microgmrr': np.mean(1. / np.asarray(resg))})
-
-    logging.info('### MICRO (%s):' % (tag))
-    logging.info('\t-- left   >> mean: %s, median: %s, mrr: %s, hits@%s: %s%%' %
-                 (round(dres['microlmean'], 5), round(dres['microlmedian'], 5),
-                  round(dres['microlmrr'], 3), n, round(dres['microlhits@n'], 3)))
-    logging.info('\t-- right  >> mean: %s, median: %s, mrr: %s, hits@%s: %s%%' %
-                 (round(dres['micrormean'], 5), round(dres['micrormedian'], 5),
-                  round(dres['micrormrr'], 3), n, round(dres['microrhits@n'], 3)))
-    logging.info('\t-- global >> mean: %s, median: %s, mrr: %s, hits@%s: %s%%' %
-                 (round(dres['microgmean'], 5), round(dres['microgmedian'], 5),
-                  round(dres['microgmrr'], 3), n, round(dres['microghits@n'], 3)))
-
-    if idxo is not None:
-        listrel = set(idxo)
-        dictrelres = {}
-        dictrellmean = {}
-        dictrelrmean = {}
-        dictrelgmean = {}
-        dictrellmedian = {}
-        dictrelrmedian = {}
-        dictrelgmedian = {}
-        dictrellrn = {}
-        dictrelrrn = {}
-        dictrelgrn = {}
-
-        for i in listrel:
-            dictrelres.update({i: [[], []]})
-
-        for i, j in enumerate(res[0]):
-            dictrelres[idxo[i]][0] += [j]
-
-        for i, j in enumerate(res[1]):
-            dictrelres[idxo[i]][1] += [j]
-
-        for i in listrel:
-            dictrellmean[i] = np.mean(dictrelres[i][0])
-            dictrelrmean[i] = np.mean(dictrelres[i][1])
-            dictrelgmean[i] = np.mean(dictrelres[i][0] + dictrelres[i][1])
-            dictrellmedian[i] = np.median(dictrelres[i][0])
-            dictrelrmedian[i] = np.median(dictrelres[i][1])
-            dictrelgmedian[i] = np.median(dictrelres[i][0] + dictrelres[i][1])
-            dictrellrn[i] = np.mean(np.asarray(dictrelres[i][0]) <= n) * 100
-            dictrelrrn[i] = np.mean(np.asarray(dictrelres[i][1]) <= n) * 100
-            dictrelgrn[i] = np.mean(np.asarray(dictrelres[i][0] + dictrelres[i][1]) <= n) * 100
-
-        dres.update({'dictrelres': dictrelres})
-        dres.update({'dictrellmean': dictrellmean})
-        dres.update({'dictrelrmean': dictrelrmean})
-        dres.update({'dictrelgmean': dictrelgmean})
-        dres.update({'dictrellmedian': dictrellmedian})
-        dres.update({'dictrelrmedian': dictrelrmedian})
-        dres.update({'dictrelgmedian': dictrelgmedian})
-
-        dres.update({'dictrellrn': dictrellrn})
-        dres.update({'dictrelrrn': dictrelrrn})
-        dres.update({'dictrelgrn': dictrelgrn})
-
-        dres.update({'macrolmean': np.mean(dictrellmean.values())})
-        dres.update({'macrolmedian': np.mean(dictrellmedian.values())})
-        dres.update({'macrolhits@n': np.mean(dictrellrn.values())})
-        dres.update({'macrormean': np.mean(dictrelrmean.values())})
-        dres.update({'macrormedian': np.mean(dictrelrmedian.values())})
-        dres.update({'macrorhits@n': np.mean(dictrelrrn.values())})
-        dres.update({'macrogmean': np.mean(dictrelgmean.values())})
-        dres.update({'macrogmedian': np.mean(dictrelgmedian.values())})
-        dres.update({'macroghits@n': np.mean(dictrelgrn.values())})
-
-        logging.info('### MACRO (%s):' % (tag))
-        logging.info('\t-- left   >> mean: %s, median: %s, hits@%s: %s%%' %
-                     (round(dres['macrolmean'], 5), round(dres['macrolmedian'], 5),
-                      n, round(dres['macrolhits@n'], 3)))
-        logging.info('\t-- right  >> mean: %s, median: %s, hits@%s: %s%%' %
-                     (round(dres['macrormean'], 5), round(dres['macrormedian'], 5),
-                      n, round(dres['macrorhits@n'], 3)))
-        logging.info('\t-- global >> mean: %s, median: %s, hits@%s: %s%%' %
-                     (round(dres['macrogmean'], 5), round(dres['macrogmedian'], 5),
-                      n, round(dres['macroghits@n'], 3)))
+    for side in ['l', 'r', 'g']:
+        dres.update({'macro%smean' % side: np.mean(table['%smean' % side]),
+                     'macro%smedian' % side: np.mean(table['%smedian' % side]),
+                     'macro%smrr' % side: np.mean(table['%smrr' % side]),
+                     'macro%shits@%d' % (side, n): np.mean(table['%shits@%d' % (side, n)]),
+                     'macro%shits@n' % side: np.mean(table['%shits@%d' % (side, n)])})
+
+    logging.info('### MACRO (%s):' % (tag))
+    logging.info('\t-- left   >> mean: %s, median: %s, hits@%s: %s%%' %
+                 (round(dres['macrolmean'], 5), round(dres['macrolmedian'], 5),
+                  n, round(dres['macrolhits@n'], 3)))
+    logging.info('\t-- right  >> mean: %s, median: %s, hits@%s: %s%%' %
+                 (round(dres['macrormean'], 5), round(dres['macrormedian'], 5),
+                  n, round(dres['macrorhits@n'], 3)))
+    logging.info('\t-- global >> mean: %s, median: %s, hits@%s: %s%%' %
+                 (round(dres['macrogmean'], 5), round(dres['macrogmedian'], 5),
+                  n, round(dres['macroghits@n'], 3)))
 
     return dres
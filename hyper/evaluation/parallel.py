@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from hyper.evaluation import metrics
+from hyper.evaluation.filters import make_filter_index
+from hyper.evaluation.scoring import EmbeddingScorer
+
+import logging
+
+
+class SharedArrays:
+    """
+    Copies a set of NumPy arrays into shared memory blocks, so that they can be accessed by worker processes
+    without being pickled or copied.
+    """
+    def __init__(self, arrays):
+        """
+        :param arrays: Dictionary mapping names to NumPy arrays.
+        """
+        self.blocks, self.descriptors = [], {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks += [block]
+            self.descriptors[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attach_shared_arrays(descriptors):
+    """
+    Attaches to the shared memory blocks created by a SharedArrays instance.
+
+    :param descriptors: SharedArrays.descriptors.
+    :return: (arrays, blocks) pair, where arrays maps names to NumPy views of the shared blocks; the blocks need to
+        be kept alive as long as the arrays are in use.
+    """
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in descriptors.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        blocks += [block]
+    return arrays, blocks
+
+
+# State of each worker process, set by _init_worker
+_worker_state = {}
+
+
+def _init_worker(descriptors, scorer_kwargs, filter_index, ranking_kwargs):
+    arrays, blocks = attach_shared_arrays(descriptors)
+    scorer = EmbeddingScorer(arrays['entity_embeddings'], arrays['predicate_embeddings'], **scorer_kwargs)
+    _worker_state.update(scorer=scorer, triples=arrays['triples'], filter_index=filter_index,
+                         ranking_kwargs=ranking_kwargs, blocks=blocks)
+
+
+def _evaluate_shard(shard):
+    shard_start, shard_end = shard
+    triples, stats = _worker_state['triples'][shard_start:shard_end], {}
+    res = metrics.scorer_ranking_scores(_worker_state['scorer'], triples, filter_index=_worker_state['filter_index'],
+                                        stats=stats, **_worker_state['ranking_kwargs'])
+    return res, stats
+
+
+def parallel_ranking_scores(scorer, triples, filter_index=None, nb_workers=None, shards_per_worker=4, stats=None,
+                            **kwargs):
+    """
+    Parallel version of metrics.scorer_ranking_scores: the triples are split in contiguous shards, evaluated by a
+    pool of worker processes sharing the embedding matrices of the scorer through shared memory. Ranks are merged
+    following the order of the shards, so the results do not depend on the number of workers.
+
+    Triples are sorted by (predicate, subject, object) before sharding, so that triples sharing a query pattern
+    tend to end up in the same shard, where the pattern is only scored once.
+
+    :param scorer: EmbeddingScorer instance.
+    :param triples: List of (s, p, o) triples.
+    :param filter_index: FilterIndex or [nb_triples, 3] matrix of true triples, used for the filtered ranks.
+    :param nb_workers: Number of worker processes (defaults to the number of CPUs).
+    :param shards_per_worker: Number of shards per worker, for balancing the load between workers.
+    :param stats: If provided, dictionary where the query counters of metrics.scorer_ranking_scores are accumulated.
+    :param kwargs: Arguments passed to metrics.scorer_ranking_scores (e.g. batch_size, tie_policy).
+    :return: ((err_subj, err_obj), (filtered_err_subj, filtered_err_obj)) pair, where the latter is None if
+        filter_index is None.
+    """
+    filter_index = make_filter_index(filter_index) if filter_index is not None else None
+    triples = np.asarray(triples, dtype=np.int64).reshape((-1, 3))
+
+    nb_workers = nb_workers if nb_workers is not None else mp.cpu_count()
+    nb_workers = min(nb_workers, triples.shape[0])
+
+    if nb_workers <= 1 or not isinstance(scorer, EmbeddingScorer):
+        return metrics.scorer_ranking_scores(scorer, triples, filter_index=filter_index, stats=stats, **kwargs)
+
+    order = np.lexsort((triples[:, 2], triples[:, 0], triples[:, 1]))
+    triples = triples[order]
+
+    nb_shards = min(nb_workers * shards_per_worker, triples.shape[0])
+    boundaries = np.linspace(0, triples.shape[0], nb_shards + 1).astype(int)
+    shards = [(int(start), int(end)) for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+    logging.info('Evaluating %d triples in %d shards, using %d workers' % (triples.shape[0], nb_shards, nb_workers))
+
+    scorer_kwargs = dict(model_name=scorer.model_name, similarity_name=scorer.similarity_name,
+                         buffer_size=scorer.buffer_size)
+
+    arrays = dict(entity_embeddings=scorer.entity_embeddings, predicate_embeddings=scorer.predicate_embeddings,
+                  triples=triples)
+
+    with SharedArrays(arrays) as shared_arrays:
+        initargs = (shared_arrays.descriptors, scorer_kwargs, filter_index, kwargs)
+        with mp.Pool(processes=nb_workers, initializer=_init_worker, initargs=initargs) as pool:
+            shard_results = pool.map(_evaluate_shard, shards, chunksize=1)
+
+    def merge(shard_ranks):
+        # Concatenates the ranks of the shards, and restores the original order of the triples
+        ranks = np.zeros(triples.shape[0], dtype=np.asarray(shard_ranks[0]).dtype)
+        ranks[order] = np.concatenate(shard_ranks)
+        return ranks.tolist()
+
+    if stats is not None:
+        for _, shard_stats in shard_results:
+            for key, value in shard_stats.items():
+                stats[key] = stats.get(key, 0) + value
+
+    shard_res = [res for res, _ in shard_results]
+    res = (merge([r[0][0] for r in shard_res]), merge([r[0][1] for r in shard_res]))
+
+    filtered_res = None
+    if filter_index is not None:
+        filtered_res = (merge([r[1][0] for r in shard_res]), merge([r[1][1] for r in shard_res]))
+
+    return res, filtered_res
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+def negative_l1_distance(x, y):
+    return - np.sum(np.abs(x - y), axis=-1)
+
+
+def negative_l2_distance(x, y):
+    return - np.sqrt(np.sum(np.square(x - y), axis=-1))
+
+
+def negative_square_l2_distance(x, y):
+    return - np.sum(np.square(x - y), axis=-1)
+
+
+def dot_product(x, y):
+    return np.sum(x * y, axis=-1)
+
+
+def absolute_dot_product(x, y):
+    return np.sum(np.abs(x) * np.abs(y), axis=-1)
+
+
+def cosine_similarity(x, y):
+    x_norm = x / np.sqrt(np.sum(np.square(x), axis=-1, keepdims=True))
+    y_norm = y / np.sqrt(np.sum(np.square(y), axis=-1, keepdims=True))
+    return np.sum(x_norm * y_norm, axis=-1)
+
+
+# NumPy counterparts of the similarity functions in hyper.similarities, reducing over the last axis
+similarities = dict(l1=negative_l1_distance, l2=negative_l2_distance, l2sqr=negative_square_l2_distance,
+                    dot=dot_product, absdot=absolute_dot_product, cosine=cosine_similarity)
+
+
+def circular_cross_correlation(x, y):
+    """
+    Circular cross-correlation along the last axis: ccorr(x, y)[i] = sum_j x[j] y[(i + j) % n].
+    """
+    return np.real(np.fft.ifft(np.conj(np.fft.fft(x)) * np.fft.fft(y)))
+
+
+def circular_convolution(x, y):
+    """
+    Circular convolution along the last axis: cconv(x, y)[i] = sum_j x[j] y[(i - j) % n].
+    """
+    return np.real(np.fft.ifft(np.fft.fft(x) * np.fft.fft(y)))
+
+
+def _linear(x, W):
+    # Maps x through the (flattened, row-major) n x n matrix W, i.e. computes x W
+    n = x.shape[-1]
+    return np.einsum('...i,...ij->...j', x, W.reshape(W.shape[:-1] + (n, n)))
+
+
+def _linear_transposed(x, W):
+    # Computes x W^T, i.e. the vector W x
+    n = x.shape[-1]
+    return np.einsum('...j,...ij->...i', x, W.reshape(W.shape[:-1] + (n, n)))
+
+
+def translating(s, p, o, sim):
+    return sim(s + p, o)
+
+
+def dual_translating(s, p, o, sim):
+    n = s.shape[-1]
+    return sim(s + p[..., :n], o + p[..., n:])
+
+
+def complex_product(s, p, o, sim):
+    n = s.shape[-1] // 2
+    es_re, es_im, ep_re, ep_im, eo_re, eo_im = s[..., :n], s[..., n:], p[..., :n], p[..., n:], o[..., :n], o[..., n:]
+    return sim(es_re * ep_re, eo_re) + sim(es_im * ep_re, eo_im) + sim(es_re * ep_im, eo_im) - sim(es_im * ep_im, eo_re)
+
+
+def scaling(s, p, o, sim):
+    return sim(s * p, o)
+
+
+def dual_scaling(s, p, o, sim):
+    n = s.shape[-1]
+    return sim(s * p[..., :n], o * p[..., n:])
+
+
+def scaling_translating(s, p, o, sim):
+    n = s.shape[-1]
+    return sim((s * p[..., :n]) + p[..., n:], o)
+
+
+def holographic(s, p, o, sim):
+    return sim(p, circular_cross_correlation(s, o))
+
+
+def dual_diagonal_affine(s, p, o, sim):
+    # Mirrors the Keras merge function, where both transformations are applied to the subject
+    n = s.shape[-1]
+    pred_subj, pred_obj = p[..., (2 * n):], p[..., :(2 * n)]
+    affine_subj = (s * pred_subj[..., :n]) + pred_subj[..., n:]
+    affine_obj = (s * pred_obj[..., :n]) + pred_obj[..., n:]
+    return sim(affine_subj, affine_obj) + np.zeros(o.shape[:-1])
+
+
+def concatenate(s, p, o, sim):
+    shape = np.broadcast(s[..., 0], o[..., 0]).shape
+    s, o = np.broadcast_to(s, shape + s.shape[-1:]), np.broadcast_to(o, shape + o.shape[-1:])
+    return sim(np.concatenate([s, o], axis=-1), p)
+
+
+def bilinear(s, p, o, sim):
+    return sim(_linear(s, p), o)
+
+
+def dual_bilinear(s, p, o, sim):
+    n = s.shape[-1]
+    return sim(_linear(s, p[..., (n ** 2):]), _linear(o, p[..., :(n ** 2)]))
+
+
+def affine(s, p, o, sim):
+    n = s.shape[-1]
+    return sim(_linear(s, p[..., :(n ** 2)]) + p[..., (n ** 2):], o)
+
+
+def dual_affine(s, p, o, sim):
+    # Mirrors the Keras merge function, where both transformations are applied to the subject
+    n = s.shape[-1]
+    pred_subj, pred_obj = p[..., ((n ** 2) + n):], p[..., :((n ** 2) + n)]
+    affine_subj = _linear(s, pred_subj[..., :(n ** 2)]) + pred_subj[..., (n ** 2):]
+    affine_obj = _linear(s, pred_obj[..., :(n ** 2)]) + pred_obj[..., (n ** 2):]
+    return sim(affine_subj, affine_obj) + np.zeros(o.shape[:-1])
+
+
+def manifold_sphere(s, p, o, sim):
+    n = s.shape[-1]
+    M = - sim(s + p[..., :n], o)
+    return np.sum(np.square(M[..., np.newaxis] - (p[..., n:] ** 2)), axis=-1)
+
+
+def manifold_hyperplane(s, p, o, sim):
+    n = s.shape[-1]
+    M = - sim(s + p[..., :n], o + p[..., n:(2 * n)])
+    return np.sum(np.square(M[..., np.newaxis] - (p[..., (2 * n):] ** 2)), axis=-1)
+
+
+# NumPy counterparts of the merge functions in hyper.layers.binary.merge_functions: arguments are
+# (subject, predicate, object) arrays whose leading dimensions are broadcast against each other.
+merge_functions = dict(
+    TransE=translating, DualTransE=dual_translating, ComplEx=complex_product,
+    ScalE=scaling, ScalEQ=scaling, DistMult=scaling, DualScalE=dual_scaling, ScalTransE=scaling_translating,
+    HolE=holographic, DAffinE=scaling_translating, DualDAffinE=dual_diagonal_affine, ConcatE=concatenate,
+    BilinearE=bilinear, RESCAL=bilinear, DualBilinearE=dual_bilinear, DualRESCAL=dual_bilinear,
+    AffinE=affine, DualAffinE=dual_affine,
+    ManifoldESphere=manifold_sphere, ManifoldEHyperplane=manifold_hyperplane)
+
+
+def _object_query_vectors(model_name, s, p):
+    """
+    For dot-product models that are linear in the object embedding, returns (w, c) such that
+    the score of (s, p, o) is w . o + c.
+    """
+    n = s.shape[-1]
+    if model_name == 'TransE':
+        return s + p, 0.
+    elif model_name in ['ScalE', 'ScalEQ', 'DistMult']:
+        return s * p, 0.
+    elif model_name in ['ScalTransE', 'DAffinE']:
+        return (s * p[:, :n]) + p[:, n:], 0.
+    elif model_name == 'ComplEx':
+        m = n // 2
+        s_re, s_im, p_re, p_im = s[:, :m], s[:, m:], p[:, :m], p[:, m:]
+        return np.concatenate([s_re * p_re - s_im * p_im, s_im * p_re + s_re * p_im], axis=1), 0.
+    elif model_name == 'HolE':
+        return circular_convolution(s, p), 0.
+    elif model_name in ['BilinearE', 'RESCAL']:
+        return _linear(s, p), 0.
+    elif model_name == 'AffinE':
+        return _linear(s, p[:, :n ** 2]) + p[:, n ** 2:], 0.
+    elif model_name == 'DualTransE':
+        w = s + p[:, :n]
+        return w, np.sum(w * p[:, n:], axis=1, keepdims=True)
+    elif model_name == 'DualScalE':
+        return s * p[:, :n] * p[:, n:], 0.
+    elif model_name == 'ConcatE':
+        return p[:, n:], np.sum(s * p[:, :n], axis=1, keepdims=True)
+    elif model_name in ['DualBilinearE', 'DualRESCAL']:
+        return _linear_transposed(_linear(s, p[:, (n ** 2):]), p[:, :(n ** 2)]), 0.
+    return None
+
+
+def _subject_query_vectors(model_name, p, o):
+    """
+    For dot-product models that are linear in the subject embedding, returns (w, c) such that
+    the score of (s, p, o) is w . s + c.
+    """
+    n = o.shape[-1]
+    if model_name == 'TransE':
+        return o, np.sum(p * o, axis=1, keepdims=True)
+    elif model_name in ['ScalE', 'ScalEQ', 'DistMult']:
+        return p * o, 0.
+    elif model_name in ['ScalTransE', 'DAffinE']:
+        return p[:, :n] * o, np.sum(p[:, n:] * o, axis=1, keepdims=True)
+    elif model_name == 'ComplEx':
+        m = n // 2
+        o_re, o_im, p_re, p_im = o[:, :m], o[:, m:], p[:, :m], p[:, m:]
+        return np.concatenate([p_re * o_re + p_im * o_im, p_re * o_im - p_im * o_re], axis=1), 0.
+    elif model_name == 'HolE':
+        return circular_cross_correlation(p, o), 0.
+    elif model_name in ['BilinearE', 'RESCAL']:
+        return _linear_transposed(o, p), 0.
+    elif model_name == 'AffinE':
+        return _linear_transposed(o, p[:, :n ** 2]), np.sum(p[:, n ** 2:] * o, axis=1, keepdims=True)
+    elif model_name == 'DualTransE':
+        w = o + p[:, n:]
+        return w, np.sum(p[:, :n] * w, axis=1, keepdims=True)
+    elif model_name == 'DualScalE':
+        return p[:, :n] * o * p[:, n:], 0.
+    elif model_name == 'ConcatE':
+        return p[:, :n], np.sum(o * p[:, n:], axis=1, keepdims=True)
+    elif model_name in ['DualBilinearE', 'DualRESCAL']:
+        return _linear_transposed(_linear(o, p[:, :(n ** 2)]), p[:, (n ** 2):]), 0.
+    return None
+
+
+class EmbeddingScorer:
+    """
+    Scores link prediction queries directly from the entity and predicate embedding matrices of a trained model,
+    without going through the Keras/Theano computation graph.
+
+    Queries of the form (s, p, ?) and (?, p, o) are scored against all entities at once: for dot-product models
+    that are linear in the candidate entity, and for TransE with the L2 distances, a batch of queries is scored
+    with a single matrix product against the entity embedding matrix; other models are evaluated by broadcasting
+    the NumPy version of their merge function over all candidates.
+    """
+    def __init__(self, entity_embeddings, predicate_embeddings, model_name='TransE', similarity_name='L1',
+                 buffer_size=2 ** 25):
+        """
+        Initializes the scorer.
+
+        :param entity_embeddings: [nb_entities + 1, k] matrix of entity embeddings (row 0 is not used).
+        :param predicate_embeddings: [nb_predicates + 1, k'] matrix of predicate embeddings.
+        :param model_name: Name of the model (e.g. TransE, DistMult, ComplEx).
+        :param similarity_name: Name of the similarity function (e.g. L1, L2, dot).
+        :param buffer_size: Maximum number of elements of the intermediate tensors of the broadcasting path.
+        """
+        if model_name not in merge_functions:
+            raise ValueError('Unsupported model: %s' % model_name)
+        if similarity_name.lower() not in similarities:
+            raise ValueError('Unsupported similarity function: %s' % similarity_name)
+
+        self.entity_embeddings = np.asarray(entity_embeddings)
+        self.predicate_embeddings = np.asarray(predicate_embeddings)
+
+        self.model_name = model_name
+        self.similarity_name = similarity_name.lower()
+        self.buffer_size = buffer_size
+
+        self.merge_function = merge_functions[model_name]
+        self.similarity_function = similarities[self.similarity_name]
+
+        # Candidate entities are indexed from 1 to nb_entities
+        self.candidate_embeddings = self.entity_embeddings[1:, :]
+        self.nb_entities = self.candidate_embeddings.shape[0]
+
+        self.candidate_square_norms = np.sum(np.square(self.candidate_embeddings), axis=1)
+
+    @staticmethod
+    def is_supported(model_name, similarity_name):
+        return model_name in merge_functions and similarity_name is not None and similarity_name.lower() in similarities
+
+    def _candidates(self, candidate_idxs):
+        # Embeddings and square norms of the candidate entities (all entities, if candidate_idxs is None)
+        if candidate_idxs is None:
+            return self.candidate_embeddings, self.candidate_square_norms
+        candidate_idxs = np.asarray(candidate_idxs, dtype=np.int64)
+        return self.entity_embeddings[candidate_idxs, :], self.candidate_square_norms[candidate_idxs - 1]
+
+    def _distance_scores(self, targets, candidates, candidate_square_norms):
+        # Scores of all candidates e, computed as the similarity between e and each row of targets
+        if self.similarity_name in ['l2', 'l2sqr']:
+            square_distances = candidate_square_norms[np.newaxis, :] \
+                + np.sum(np.square(targets), axis=1, keepdims=True) \
+                - 2. * np.dot(targets, candidates.T)
+            square_distances = np.maximum(square_distances, 0.)
+            return - (np.sqrt(square_distances) if self.similarity_name == 'l2' else square_distances)
+        return self._broadcast(lambda t, e: self.similarity_function(t, e), targets, candidates)
+
+    def _broadcast(self, function, queries, candidates):
+        # Evaluates function(queries[:, np.newaxis, :], candidates[np.newaxis, :, :]) in chunks of queries
+        nb_queries, nb_candidates = queries.shape[0], candidates.shape[0]
+        chunk_size = max(1, self.buffer_size // max(1, nb_candidates * self.entity_embeddings.shape[1]))
+        scores = np.empty((nb_queries, nb_candidates))
+        for start in range(0, nb_queries, chunk_size):
+            end = min(start + chunk_size, nb_queries)
+            scores[start:end, :] = function(queries[start:end, np.newaxis, :], candidates[np.newaxis, :, :])
+        return scores
+
+    def score_objects(self, subj_idxs, pred_idxs, candidate_idxs=None):
+        """
+        Scores the queries (s, p, ?) against all entities.
+
+        :param subj_idxs: [nb_queries] vector of subject indices.
+        :param pred_idxs: [nb_queries] vector of predicate indices.
+        :param candidate_idxs: If provided, vector of entity indices to score, in place of all entities.
+        :return: [nb_queries, nb_entities] matrix, whose (i, j) element is the score of (s_i, p_i, j + 1)
+            (or of (s_i, p_i, candidate_idxs[j]) if candidate_idxs is provided).
+        """
+        s = self.entity_embeddings[np.asarray(subj_idxs, dtype=np.int64), :]
+        p = self.predicate_embeddings[np.asarray(pred_idxs, dtype=np.int64), :]
+        candidates, candidate_square_norms = self._candidates(candidate_idxs)
+
+        if self.similarity_name == 'dot':
+            query_vectors = _object_query_vectors(self.model_name, s, p)
+            if query_vectors is not None:
+                w, c = query_vectors
+                return np.dot(w, candidates.T) + c
+
+        if self.model_name == 'TransE' and self.similarity_name in ['l1', 'l2', 'l2sqr']:
+            return self._distance_scores(s + p, candidates, candidate_square_norms)
+
+        def function(q, e):
+            return self.merge_function(q[..., :s.shape[1]], q[..., s.shape[1]:], e, self.similarity_function)
+
+        return self._broadcast(function, np.concatenate([s, p], axis=1), candidates)
+
+    def score_subjects(self, pred_idxs, obj_idxs, candidate_idxs=None):
+        """
+        Scores the queries (?, p, o) against all entities.
+
+        :param pred_idxs: [nb_queries] vector of predicate indices.
+        :param obj_idxs: [nb_queries] vector of object indices.
+        :param candidate_idxs: If provided, vector of entity indices to score, in place of all entities.
+        :return: [nb_queries, nb_entities] matrix, whose (i, j) element is the score of (j + 1, p_i, o_i)
+            (or of (candidate_idxs[j], p_i, o_i) if candidate_idxs is provided).
+        """
+        p = self.predicate_embeddings[np.asarray(pred_idxs, dtype=np.int64), :]
+        o = self.entity_embeddings[np.asarray(obj_idxs, dtype=np.int64), :]
+        candidates, candidate_square_norms = self._candidates(candidate_idxs)
+
+        if self.similarity_name == 'dot':
+            query_vectors = _subject_query_vectors(self.model_name, p, o)
+            if query_vectors is not None:
+                w, c = query_vectors
+                return np.dot(w, candidates.T) + c
+
+        if self.model_name == 'TransE' and self.similarity_name in ['l1', 'l2', 'l2sqr']:
+            # The distance between s + p and o is the distance between s and o - p
+            return self._distance_scores(o - p, candidates, candidate_square_norms)
+
+        def function(q, e):
+            return self.merge_function(e, q[..., :p.shape[1]], q[..., p.shape[1]:], self.similarity_function)
+
+        return self._broadcast(function, np.concatenate([p, o], axis=1), candidates)
+
+    def __call__(self, args):
+        """
+        Scores a set of triples; it can be used in place of the scoring functions based on model.predict.
+
+        :param args: List [Xr, Xe], with Xr a [nb_samples, 1] matrix of predicate indices, and Xe a
+            [nb_samples, 2] matrix of subject and object indices.
+        :return: [nb_samples] vector of scores.
+        """
+        Xr, Xe = np.asarray(args[0], dtype=np.int64), np.asarray(args[1], dtype=np.int64)
+        s = self.entity_embeddings[Xe[:, 0], :]
+        p = self.predicate_embeddings[Xr[:, 0], :]
+        o = self.entity_embeddings[Xe[:, 1], :]
+        return self.merge_function(s, p, o, self.similarity_function)
+
+
+class FunctionScorer:
+    """
+    Adapts a scoring function, mapping a list [Xr, Xe] of predicate and entity indices to a vector of scores
+    (e.g. a wrapper around model.predict), to the query-based interface of EmbeddingScorer.
+    """
+    def __init__(self, scoring_function, nb_entities):
+        self.scoring_function = scoring_function
+        self.nb_entities = nb_entities
+
+    def _score(self, pred_idxs, subj_idxs, obj_idxs, candidate_idxs=None):
+        if candidate_idxs is None:
+            candidate_idxs = np.arange(1, self.nb_entities + 1)
+        nb_queries, nb_candidates = pred_idxs.shape[0], len(candidate_idxs)
+        Xr = np.repeat(pred_idxs, nb_candidates).reshape((-1, 1))
+        Xe = np.empty((nb_queries * nb_candidates, 2))
+        Xe[:, 0] = np.repeat(subj_idxs, nb_candidates) if subj_idxs is not None \
+            else np.tile(candidate_idxs, nb_queries)
+        Xe[:, 1] = np.repeat(obj_idxs, nb_candidates) if obj_idxs is not None \
+            else np.tile(candidate_idxs, nb_queries)
+        return np.asarray(self.scoring_function([Xr, Xe])).reshape((nb_queries, nb_candidates))
+
+    def score_objects(self, subj_idxs, pred_idxs, candidate_idxs=None):
+        return self._score(np.asarray(pred_idxs), np.asarray(subj_idxs), None, candidate_idxs)
+
+    def score_subjects(self, pred_idxs, obj_idxs, candidate_idxs=None):
+        return self._score(np.asarray(pred_idxs), None, np.asarray(obj_idxs), candidate_idxs)
+
+    def __call__(self, args):
+        return self.scoring_function(args)
+
+
+def get_embeddings(model):
+    """
+    Extracts the entity and predicate embedding matrices from a model built by hyper.learning.core.pairwise_training.
+
+    :param model: Keras model.
+    :return: (entity_embeddings, predicate_embeddings) pair of NumPy matrices.
+    """
+    from keras import backend as K
+
+    merge_layer = model.layers[0]
+    predicate_encoder, entity_encoder = merge_layer.layers[0], merge_layer.layers[1]
+
+    # Embedding, LowRankEmbedding and FrameEmbedding layers all expose the embedding matrix as W
+    entity_embeddings = K.eval(entity_encoder.layers[0].W)
+    predicate_embeddings = K.eval(predicate_encoder.layers[0].W)
+
+    return entity_embeddings, predicate_embeddings
+
+
+def make_scorer(model, nb_entities, model_name='TransE', similarity_name='L1'):
+    """
+    Returns a scorer for a model built by hyper.learning.core.pairwise_training: an EmbeddingScorer on its embedding
+    matrices when the model is supported, and a FunctionScorer around model.predict otherwise.
+
+    :param model: Keras model.
+    :param nb_entities: Number of entities.
+    :param model_name: Name of the model.
+    :param similarity_name: Name of the similarity function.
+    :return: EmbeddingScorer or FunctionScorer instance.
+    """
+    if EmbeddingScorer.is_supported(model_name, similarity_name):
+        entity_embeddings, predicate_embeddings = get_embeddings(model)
+        return EmbeddingScorer(entity_embeddings, predicate_embeddings,
+                               model_name=model_name, similarity_name=similarity_name)
+
+    def scoring_function(inputs):
+        return model.predict([inputs[0], inputs[1]], batch_size=inputs[0].shape[0])[:, 0]
+    return FunctionScorer(scoring_function, nb_entities)
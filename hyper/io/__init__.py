@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from hyper.io.base import iopen, read_triples
-from hyper.io.serialization import serialize
+from hyper.io.serialization import serialize, save_checkpoint, load_checkpoint, CheckpointWriter
+from hyper.io.results import ResultsSink, read_results
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import json
+
+
+def _to_json(obj):
+    # NumPy scalars and arrays are not natively serializable
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+class ResultsSink:
+    """
+    Streams evaluation results to a file, as one JSON record per line, so that they can be collected without
+    parsing the logs. Records are appended and flushed as soon as they are written.
+    """
+    def __init__(self, path, **context):
+        """
+        :param path: Path of the JSON lines file.
+        :param context: Fields added to every record (e.g. the configuration of the run).
+        """
+        self.path, self.context = path, context
+        self.file = open(path, 'a')
+
+    def write(self, record):
+        """
+        Writes a record, after adding the context fields to it.
+
+        :param record: Dictionary containing the record.
+        """
+        content = dict(self.context)
+        content.update(record)
+        self.file.write(json.dumps(content, default=_to_json, sort_keys=True) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_results(path):
+    """
+    Reads the records written by a ResultsSink.
+
+    :param path: Path of the JSON lines file.
+    :return: List of records.
+    """
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if len(line.strip()) > 0]
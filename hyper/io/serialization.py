@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
+
+import os
 import pickle
+import threading
+import logging
 
 
-def serialize(prefix, model=None, parser=None, argv=None):
+def serialize(prefix, model=None, embeddings=None, parser=None, argv=None):
 
     if model is not None:
         # Saving the weights of the model
         model_path = '%s_weights.h5' % prefix
         model.save_weights(model_path, overwrite=True)
 
+    if embeddings is not None:
+        # Saving the entity and predicate embeddings (e.g. of models trained without Keras)
+        entity_embeddings, predicate_embeddings = embeddings
+        embeddings_path = '%s_embeddings.npz' % prefix
+        np.savez(embeddings_path, entity_embeddings=entity_embeddings, predicate_embeddings=predicate_embeddings)
+
     if parser is not None:
         # Saving the fact parser
         parser_path = '%s_parser.p' % prefix
@@ -34,3 +45,90 @@ This model was created by using the following command line:
             f.write(content)
 
     return
+
+
+def save_checkpoint(path, state):
+    """
+    Writes a training checkpoint - written to a temporary file first, so that a run killed while writing never
+    leaves a partial checkpoint behind.
+
+    :param path: Path of the checkpoint.
+    :param state: Dictionary describing the state of training (see hyper.learning.core.pairwise_training).
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_checkpoint(path):
+    """
+    Reads a training checkpoint written by save_checkpoint.
+
+    :param path: Path of the checkpoint.
+    :return: Dictionary describing the state of training.
+    """
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class CheckpointWriter:
+    """
+    Writes training checkpoints in a background thread, so that the training loop only takes a snapshot of the
+    state. If a checkpoint is requested while the previous one is still being written, only the most recent of
+    the pending ones is written.
+    """
+    def __init__(self, path):
+        """
+        :param path: Path of the checkpoint.
+        """
+        self.path = path
+        self.condition = threading.Condition()
+        self.pending_state, self.is_closed, self.error = None, False, None
+
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            with self.condition:
+                while self.pending_state is None and not self.is_closed:
+                    self.condition.wait()
+                if self.pending_state is None:
+                    return
+                state, self.pending_state = self.pending_state, None
+
+            try:
+                save_checkpoint(self.path, state)
+            except Exception as e:
+                # Errors are re-raised in the training loop
+                self.error = e
+
+    def __call__(self, state):
+        """
+        Schedules the writing of a checkpoint.
+
+        :param state: Dictionary describing the state of training - it must not be modified afterwards.
+        """
+        if self.error is not None:
+            raise self.error
+        with self.condition:
+            self.pending_state = state
+            self.condition.notify()
+
+    def close(self):
+        """
+        Waits for the pending checkpoint, if any, to be written, and stops the background thread.
+        """
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify()
+        self.thread.join()
+        if self.error is not None:
+            logging.error('Could not write the checkpoint %s: %s' % (self.path, self.error))
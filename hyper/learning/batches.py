@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class BatchAssembler:
+    """
+    Assembles training batches in which each positive example is immediately followed by the corresponding
+    negative examples, i.e. the j-th example of the i-th set of samples is in position (j * nb_sample_sets + i),
+    as expected by the ranking objectives in hyper.ranking_objectives.
+
+    The positive and negative examples of an epoch are laid out once in a [nb_samples, nb_sample_sets, ...] buffer,
+    so that each batch is assembled with a single gather from the (shuffled) sample indices. All buffers are
+    integer-typed and reused across batches and epochs.
+    """
+    def __init__(self, nb_sample_sets, dtype=np.int32):
+        """
+        :param nb_sample_sets: Number of sets of samples (the positive examples plus the sets of negative examples).
+        :param dtype: Type of the index buffers.
+        """
+        self.nb_sample_sets = nb_sample_sets
+        self.dtype = np.dtype(dtype)
+
+        self.nb_samples, self.samples_Xr, self.samples_Xe = 0, None, None
+        self.batch_Xr, self.batch_Xe = None, None
+
+    @staticmethod
+    def _buffer(buffer, shape, dtype):
+        # Reuses the given buffer if it is large enough, and allocates a new one otherwise
+        if buffer is None or buffer.shape[0] < shape[0] or buffer.shape[1:] != shape[1:]:
+            buffer = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def set_samples(self, samples_sets):
+        """
+        Sets the positive and negative examples used for assembling the batches of an epoch.
+
+        :param samples_sets: List of nb_sample_sets (Xr, Xe) pairs, where Xr is a [nb_samples, 1] matrix of
+            relation indices and Xe is a [nb_samples, 2] matrix of subject and object indices; the first pair
+            contains the positive examples, and the j-th row of each pair refers to the j-th positive example.
+        """
+        if len(samples_sets) != self.nb_sample_sets:
+            raise ValueError('Expected %d sets of samples, got %d' % (self.nb_sample_sets, len(samples_sets)))
+
+        nb_samples = samples_sets[0][0].shape[0]
+        Xr_shape = (nb_samples, self.nb_sample_sets, samples_sets[0][0].shape[1])
+        Xe_shape = (nb_samples, self.nb_sample_sets, samples_sets[0][1].shape[1])
+
+        self.samples_Xr = self._buffer(self.samples_Xr, Xr_shape, self.dtype)
+        self.samples_Xe = self._buffer(self.samples_Xe, Xe_shape, self.dtype)
+
+        for i, (Xr, Xe) in enumerate(samples_sets):
+            self.samples_Xr[:nb_samples, i, :] = Xr
+            self.samples_Xe[:nb_samples, i, :] = Xe
+
+        self.nb_samples = nb_samples
+
+    def __call__(self, sample_idxs):
+        """
+        Assembles the batch containing the given positive examples, each followed by its negative examples.
+
+        :param sample_idxs: Vector of indices of the positive examples in the batch.
+        :return: ([batch_size * nb_sample_sets, 1], [batch_size * nb_sample_sets, 2]) pair of views of the batch
+            buffers - their content is overwritten by the next call.
+        """
+        batch_size = sample_idxs.shape[0]
+        samples_Xr, samples_Xe = self.samples_Xr[:self.nb_samples], self.samples_Xe[:self.nb_samples]
+
+        self.batch_Xr = self._buffer(self.batch_Xr, (batch_size,) + samples_Xr.shape[1:], self.dtype)
+        self.batch_Xe = self._buffer(self.batch_Xe, (batch_size,) + samples_Xe.shape[1:], self.dtype)
+
+        batch_Xr, batch_Xe = self.batch_Xr[:batch_size], self.batch_Xe[:batch_size]
+
+        np.take(samples_Xr, sample_idxs, axis=0, out=batch_Xr)
+        np.take(samples_Xe, sample_idxs, axis=0, out=batch_Xe)
+
+        return (batch_Xr.reshape((batch_size * self.nb_sample_sets, -1)),
+                batch_Xe.reshape((batch_size * self.nb_sample_sets, -1)))
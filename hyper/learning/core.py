@@ -4,6 +4,7 @@ import math
 import numpy as np
 
 from keras.models import Sequential
+from keras import backend as K
 from keras.layers import SimpleRNN, GRU, LSTM
 
 from keras.layers.embeddings import Embedding
@@ -15,21 +16,83 @@ from keras.engine.training import make_batches
 import hyper.layers.core as core
 
 from hyper.learning import samples, negatives
-from hyper import ranking_objectives, constraints
+from hyper.learning.pipeline import EpochProducer
+from hyper.learning.engine import make_train_step
+from hyper.learning.validation import EarlyStopping
+from hyper.evaluation.scoring import make_scorer
+from hyper.io.serialization import CheckpointWriter, load_checkpoint
+from hyper import ranking_objectives, constraints, optimizers
 
 import hyper.learning.util as learning_util
 
+import os
 import time
 import logging
 
 
+def _get_training_state(epoch_no, is_stopped, nb_samples, model, random_state, hard_negatives_generator=None,
+                        early_stopping=None):
+    """
+    Takes a snapshot of the state of training at the end of an epoch, to be written in a checkpoint.
+
+    :param epoch_no: Number of the last completed epoch.
+    :param is_stopped: Whether training was stopped early.
+    :param nb_samples: Number of training facts.
+    :param model: Compiled Keras model.
+    :param random_state: numpy.random.RandomState instance used for shuffling and sampling negative examples.
+    :param hard_negatives_generator: HardNegativeSamplesGenerator instance, if any.
+    :param early_stopping: EarlyStopping instance, if any.
+    :return: Dictionary describing the state of training.
+    """
+    optimizer = model.optimizer
+    iterations = getattr(optimizer, 'iterations', None)
+    return dict(epoch_no=epoch_no, is_stopped=is_stopped, nb_samples=nb_samples,
+                weights=model.get_weights(), optimizer_weights=optimizer.get_weights(),
+                optimizer_iterations=K.get_value(iterations) if iterations is not None else None,
+                random_state=random_state.get_state(),
+                negatives=hard_negatives_generator.get_state() if hard_negatives_generator is not None else None,
+                early_stopping=early_stopping.get_state() if early_stopping is not None else None)
+
+
+def _set_training_state(state, nb_samples, model, random_state, hard_negatives_generator=None,
+                        early_stopping=None):
+    """
+    Restores a state of training returned by _get_training_state.
+    """
+    if state['nb_samples'] != nb_samples:
+        raise ValueError('The checkpoint does not match the training set (%d facts, expected %d)' %
+                         (state['nb_samples'], nb_samples))
+
+    model.set_weights(state['weights'])
+
+    # The state variables of the optimizer are created together with the train function
+    getattr(model, 'model', model)._make_train_function()
+    optimizer = model.optimizer
+    optimizer.set_weights(state['optimizer_weights'])
+    if state['optimizer_iterations'] is not None:
+        K.set_value(optimizer.iterations, state['optimizer_iterations'])
+
+    random_state.set_state(state['random_state'])
+
+    if hard_negatives_generator is not None and state['negatives'] is not None:
+        hard_negatives_generator.set_state(state['negatives'])
+    if early_stopping is not None and state['early_stopping'] is not None:
+        early_stopping.set_state(state['early_stopping'])
+
+
 def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
                       entity_embedding_size=100, predicate_embedding_size=None,
                       dropout_entity_embeddings=None, dropout_predicate_embeddings=None,
                       model_name='TransE', similarity_name='L1', nb_epochs=1000, batch_size=128, nb_batches=None,
-                      margin=1.0, loss_name='hinge', negatives_name='corrupt', optimizer=None, regularizer=None,
+                      margin=1.0, loss_name='hinge', negatives_name='corrupt', nb_negatives=1,
+                      negatives_sampler='glorot', filtered_negatives=False, predicate_types_cache=None,
+                      hard_negatives_interval=10, hard_negatives_pool_size=1000, hard_negatives_ratio=.5,
+                      optimizer=None, regularizer=None,
                       hidden_size=None, entity_constraint=None, predicate_constraint=None,
-                      entity_frames=None, entity_rank=None, predicate_rank=None, visualize=False):
+                      entity_frames=None, entity_rank=None, predicate_rank=None, visualize=False,
+                      validation_sequences=None, true_triples=None, validation_interval=10, validation_patience=None,
+                      validation_size=None, validation_candidates=None, train_engine='step', prefetch_epochs=0,
+                      checkpoint_path=None, checkpoint_interval=10, resume=False):
 
     np.random.seed(seed)
     random_state = np.random.RandomState(seed=seed)
@@ -77,7 +140,15 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
         predicate_encoder.add(Dropout(dropout_predicate_embeddings))
 
     entity_constraints, norm_constraint = None, constraints.NormConstraint(m=1., axis=1)
-    if entity_constraint is None:
+
+    # When the optimizer only changes the rows of the entity embeddings read by each batch, the norm constraint is
+    # applied after each step to those rows only, rather than to the whole matrix within the train function
+    is_row_wise_norm = entity_frames is None and entity_rank is None and entity_constraint is None \
+        and optimizers.updates_only_read_rows(optimizer)
+
+    if is_row_wise_norm is True:
+        entity_constraints = None
+    elif entity_constraint is None:
         entity_constraints = norm_constraint
     else:
         entity_constraints = constraints.GroupConstraint(constraints=[entity_constraint, norm_constraint])
@@ -166,32 +237,51 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
         batch_size = math.ceil(nb_samples / nb_batches)
         logging.info("Samples: %d, no. batches: %d -> batch size: %d" % (nb_samples, nb_batches, batch_size))
 
-    # Random index generator for sampling negative examples
-    random_index_generator = samples.GlorotRandomIndexGenerator(random_state=random_state)
+    # Random index generators for sampling negative examples
+    subject_index_generator, object_index_generator = samples.make_index_generators(
+        negatives_sampler, random_state, Xr, Xe, nb_entities)
+
+    # Used by the methods that do not corrupt subjects and objects separately
+    random_index_generator = object_index_generator
 
     # Creating negative indices..
     candidate_negative_indices = np.arange(1, nb_entities + 1)
 
     if negatives_name == 'corrupt':
         negative_samples_generator = negatives.CorruptedSamplesGenerator(
-            subject_index_generator=random_index_generator, subject_candidate_indices=candidate_negative_indices,
-            object_index_generator=random_index_generator, object_candidate_indices=candidate_negative_indices)
+            subject_index_generator=subject_index_generator, subject_candidate_indices=candidate_negative_indices,
+            object_index_generator=object_index_generator, object_candidate_indices=candidate_negative_indices,
+            nb_negatives=nb_negatives)
     elif negatives_name == 'lcwa':
         negative_samples_generator = negatives.LCWANegativeSamplesGenerator(
-            object_index_generator=random_index_generator, object_candidate_indices=candidate_negative_indices)
+            object_index_generator=object_index_generator, object_candidate_indices=candidate_negative_indices,
+            nb_negatives=nb_negatives)
     elif negatives_name == 'schema':
-        predicate2type = learning_util.find_predicate_types(Xr, Xe)
+        predicate2type = learning_util.find_predicate_types(Xr, Xe, cache_dir=predicate_types_cache)
         negative_samples_generator = negatives.SchemaAwareNegativeSamplesGenerator(
             index_generator=random_index_generator, candidate_indices=candidate_negative_indices,
-            random_state=random_state, predicate2type=predicate2type)
+            random_state=random_state, predicate2type=predicate2type, nb_negatives=nb_negatives)
     elif negatives_name == 'binomial' or negatives_name == 'bernoulli':
         ps_count, po_count = learning_util.predicate_statistics(Xr, Xe)
         negative_samples_generator = negatives.BernoulliNegativeSamplesGenerator(
             index_generator=random_index_generator, candidate_indices=candidate_negative_indices,
-            random_state=random_state, ps_count=ps_count, po_count=po_count)
+            random_state=random_state, ps_count=ps_count, po_count=po_count, nb_negatives=nb_negatives)
+    elif negatives_name == 'hard':
+        negative_samples_generator = negatives.HardNegativeSamplesGenerator(
+            index_generator=random_index_generator, candidate_indices=candidate_negative_indices,
+            random_state=random_state, nb_negatives=nb_negatives,
+            pool_size=hard_negatives_pool_size, hard_ratio=hard_negatives_ratio, seed=seed)
     else:
         raise ValueError("Unknown negative samples generator: %s" % negatives_name)
 
+    # Generator whose cache of hard negatives is refreshed during training, if any
+    hard_negatives_generator = negative_samples_generator if negatives_name == 'hard' else None
+
+    if filtered_negatives is True:
+        # Corruptions which are training facts are rejected and redrawn
+        negative_samples_generator = negatives.FilteredNegativeSamplesGenerator(
+            negative_samples_generator, negatives.TripleSet(Xr, Xe))
+
     nb_sample_sets = negative_samples_generator.nb_sample_sets + 1
 
     def loss(y_true, y_predicted):
@@ -201,58 +291,140 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
 
     model.compile(loss=loss, optimizer=optimizer)
 
-    t0 = time.time()
+    row_projection = None
+    if is_row_wise_norm is True:
+        row_projection = constraints.RowProjection(entity_embedding_layer.W, norm_constraint)
 
-    for epoch_no in range(1, nb_epochs + 1):
-        logging.info('Epoch no. %d of %d (samples: %d)' % (epoch_no, nb_epochs, nb_samples))
+    # Function running one optimisation step on a batch, and returning the loss
+    train_step = make_train_step(model, engine_name=train_engine)
 
-        # Shuffling training (positive) triples..
-        order = random_state.permutation(nb_samples)
-        Xr_shuffled, Xe_shuffled = Xr[order, :], Xe[order, :]
+    early_stopping = None
+    if validation_sequences is not None and len(validation_sequences) > 0:
+        validation_triples = [(s, p, o) for (p, [s, o]) in validation_sequences]
+        if true_triples is None:
+            true_triples = [(s, p, o) for (p, [s, o]) in train_sequences] + validation_triples
 
-        negative_samples = negative_samples_generator(Xr_shuffled, Xe_shuffled)
-        positive_negative_samples = [(Xr_shuffled, Xe_shuffled)] + negative_samples
+        early_stopping = EarlyStopping(validation_triples, true_triples, nb_entities,
+                                       model_name=model_name, similarity_name=similarity_name,
+                                       interval=validation_interval, patience=validation_patience,
+                                       nb_triples=validation_size, nb_candidates=validation_candidates, seed=seed)
 
-        batches, losses = make_batches(nb_samples, batch_size), []
+    initial_epoch = 1
+    if resume is True and checkpoint_path is not None and os.path.isfile(checkpoint_path):
+        state = load_checkpoint(checkpoint_path)
+        _set_training_state(state, nb_samples, model, random_state, hard_negatives_generator=hard_negatives_generator,
+                            early_stopping=early_stopping)
 
-        # Iterate over batches of (positive) training examples
-        for batch_index, (batch_start, batch_end) in enumerate(batches):
-            current_batch_size = batch_end - batch_start
-            logging.debug('Batch no. %d of %d (%d:%d), size %d'
-                          % (batch_index, len(batches), batch_start, batch_end, current_batch_size))
+        # Runs which were stopped early are not resumed
+        initial_epoch = nb_epochs + 1 if state['is_stopped'] else state['epoch_no'] + 1
+        logging.info('Resuming training from epoch no. %d (checkpoint: %s)' % (initial_epoch, checkpoint_path))
 
-            train_Xr_batch = np.zeros((current_batch_size * nb_sample_sets, Xr_shuffled.shape[1]))
-            train_Xe_batch = np.zeros((current_batch_size * nb_sample_sets, Xe_shuffled.shape[1]))
+    # Checkpoints are written in a background thread, so that training only waits for the snapshot of its state
+    checkpoint_writer = CheckpointWriter(checkpoint_path) if checkpoint_path is not None else None
 
-            for i, samples_set in enumerate(positive_negative_samples):
-                (_Xr, _Xe) = samples_set
-                train_Xr_batch[i::nb_sample_sets, :] = _Xr[batch_start:batch_end, :]
-                train_Xe_batch[i::nb_sample_sets, :] = _Xe[batch_start:batch_end, :]
-
-            y_batch = np.zeros(train_Xr_batch.shape[0])
-
-            hist = model.fit([train_Xr_batch, train_Xe_batch], y_batch, nb_epoch=1, batch_size=train_Xr_batch.shape[0],
-                             shuffle=False, verbose=0)
-
-            losses += [hist.history['loss'][0] / float(train_Xr_batch.shape[0])]
-
-        if visualize is True:
-            #import hyper.visualization.visualization as visualization
-
-            #hinton_diagram = visualization.HintonDiagram()
-            #W_emb = predicate_embedding_layer.trainable_weights[0].get_value()
-            #print('Embedding dimensions: %s - Max value: %s, Min value: %s'
-            #      % (str(W_emb.shape), np.max(W_emb), np.min(W_emb)))
-            #print(hinton_diagram(W_emb))
-            pass
-
-        logging.info('Loss: %s +/- %s' % (round(np.mean(losses), 4), round(np.std(losses), 4)))
+    t0 = time.time()
 
-        if np.isnan(np.mean(losses)):
-            raise ValueError('NaN propagation.')
+    # Shuffling, negative sampling and interleaving of the examples of each epoch, possibly in the background;
+    # the random state is re-seeded at the beginning of each epoch, so resumed runs see the same examples
+    epoch_producer = EpochProducer(Xr, Xe, negative_samples_generator, random_state, nb_epochs, seed=seed,
+                                   queue_size=prefetch_epochs, initial_epoch=initial_epoch)
+    y_buffer = np.zeros(int(batch_size) * nb_sample_sets)
+
+    # Whether the norm constraint was already applied to all the entity embeddings
+    is_projected = initial_epoch > 1
+
+    try:
+        for epoch in epoch_producer:
+            epoch_no = epoch.epoch_no
+            logging.info('Epoch no. %d of %d (samples: %d)' % (epoch_no, nb_epochs, nb_samples))
+            epoch_start_time, train_step_time, constraint_time = time.time(), .0, .0
+
+            batches, losses = make_batches(nb_samples, batch_size), []
+
+            # Iterate over batches of (positive) training examples
+            for batch_index, (batch_start, batch_end) in enumerate(batches):
+                current_batch_size = batch_end - batch_start
+                logging.debug('Batch no. %d of %d (%d:%d), size %d'
+                              % (batch_index, len(batches), batch_start, batch_end, current_batch_size))
+
+                # Positive examples in the epoch are already shuffled, and followed by their negative examples
+                train_Xr_batch = epoch.Xr[batch_start * nb_sample_sets:batch_end * nb_sample_sets]
+                train_Xe_batch = epoch.Xe[batch_start * nb_sample_sets:batch_end * nb_sample_sets]
+                y_batch = y_buffer[:train_Xr_batch.shape[0]]
+
+                train_step_start_time = time.time()
+                batch_loss = train_step([train_Xr_batch, train_Xe_batch], y_batch)
+                train_step_time += time.time() - train_step_start_time
+
+                if row_projection is not None:
+                    # As the constraint within the train function, the first step projects all rows
+                    constraint_start_time = time.time()
+                    row_projection(train_Xe_batch.reshape(-1) if is_projected else None)
+                    constraint_time += time.time() - constraint_start_time
+                    is_projected = True
+
+                losses += [batch_loss / float(train_Xr_batch.shape[0])]
+
+            if visualize is True:
+                #import hyper.visualization.visualization as visualization
+
+                #hinton_diagram = visualization.HintonDiagram()
+                #W_emb = predicate_embedding_layer.trainable_weights[0].get_value()
+                #print('Embedding dimensions: %s - Max value: %s, Min value: %s'
+                #      % (str(W_emb.shape), np.max(W_emb), np.min(W_emb)))
+                #print(hinton_diagram(W_emb))
+                pass
+
+            logging.info('Loss: %s +/- %s' % (round(np.mean(losses), 4), round(np.std(losses), 4)))
+            logging.info('Epoch duration (s): %s (training steps: %s, constraints: %s, batches: %d)' %
+                         (round(time.time() - epoch_start_time, 4), round(train_step_time, 4),
+                          round(constraint_time, 4), len(batches)))
+
+            # Share of the time spent preparing the examples that was overlapped with training
+            overlap_ratio = 1. - (epoch.wait_time / epoch.preparation_time) if epoch.preparation_time > 0 else 1.
+            logging.info('Examples preparation (s): %s, waited for: %s (overlap ratio: %s)' %
+                         (round(epoch.preparation_time, 4), round(epoch.wait_time, 4),
+                          round(max(overlap_ratio, .0), 4)))
+
+            if epoch.rejection_rate is not None:
+                logging.info('Rejected negative examples: %s' % round(epoch.rejection_rate, 4))
+
+            if np.isnan(np.mean(losses)):
+                raise ValueError('NaN propagation.')
+
+            if hard_negatives_generator is not None and epoch_no % hard_negatives_interval == 0:
+                refresh_start_time = time.time()
+                scorer = make_scorer(model, nb_entities, model_name=model_name, similarity_name=similarity_name)
+                # Epochs prepared in advance used the previous cache, and are prepared again after the refresh
+                with epoch_producer.paused():
+                    hard_negatives_generator.refresh(scorer, Xr, Xe)
+                logging.info('Hard negatives refresh (s): %s' % round(time.time() - refresh_start_time, 4))
+
+            is_stopped = early_stopping is not None and early_stopping(model, epoch_no, force=epoch_no == nb_epochs)
+
+            # Checkpoints follow the refresh of the hard negatives, whose new cache is also used by the next epochs
+            # prepared in the background: resumed runs prepare the same examples
+            if checkpoint_writer is not None and (epoch_no % checkpoint_interval == 0 or epoch_no == nb_epochs or
+                                                  is_stopped):
+                checkpoint_start_time = time.time()
+                checkpoint_writer(_get_training_state(epoch_no, is_stopped, nb_samples, model, random_state,
+                                                      hard_negatives_generator=hard_negatives_generator,
+                                                      early_stopping=early_stopping))
+                logging.info('Checkpoint snapshot (s): %s' % round(time.time() - checkpoint_start_time, 4))
+
+            if is_stopped:
+                logging.info('No improvements in the last %d evaluations, stopping' % validation_patience)
+                break
+    finally:
+        epoch_producer.close()
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
 
     t1 = time.time()
 
     logging.info('Training duration (ms): %s' % str(t1 - t0))
 
+    if early_stopping is not None:
+        early_stopping.restore(model)
+
     return model
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from keras import backend as K
+
+
+TRAIN_ENGINES = ['fit', 'step']
+
+
+class TrainStep:
+    """
+    Runs single optimisation steps on a compiled Keras model by calling its train function directly, bypassing the
+    input standardisation, callbacks and History objects created by each model.fit call.
+    """
+    def __init__(self, model):
+        """
+        :param model: Compiled Keras model (Sequential or functional).
+        """
+        # Sequential models wrap a functional model, which owns the train function
+        inner_model = getattr(model, 'model', model)
+        inner_model._make_train_function()
+
+        self.train_function = inner_model.train_function
+        self.nb_outputs = len(inner_model.outputs)
+
+        self.learning_phase = []
+        if inner_model.uses_learning_phase and not isinstance(K.learning_phase(), int):
+            self.learning_phase = [1.]
+
+        self.sample_weights = np.ones(0, dtype=K.floatx())
+
+    def __call__(self, x, y):
+        """
+        Runs one optimisation step on a batch.
+
+        :param x: List of input matrices.
+        :param y: Target vector or matrix (one row per example).
+        :return: Value of the loss on the batch.
+        """
+        nb_samples = y.shape[0]
+        if self.sample_weights.shape[0] < nb_samples:
+            self.sample_weights = np.ones(nb_samples, dtype=K.floatx())
+
+        y = y.reshape((nb_samples, -1))
+        sample_weights = self.sample_weights[:nb_samples]
+
+        inputs = list(x) + [y] * self.nb_outputs + [sample_weights] * self.nb_outputs + self.learning_phase
+        outputs = self.train_function(inputs)
+
+        return outputs[0] if isinstance(outputs, list) else outputs
+
+
+def make_train_step(model, engine_name='step'):
+    """
+    Returns a function running one optimisation step on a batch, and returning the value of the loss.
+
+    :param model: Compiled Keras model.
+    :param engine_name: Either 'step' (direct calls to the train function) or 'fit' (one model.fit call per batch).
+    :return: Function mapping (x, y) to the value of the loss on the batch.
+    """
+    if engine_name == 'step':
+        return TrainStep(model)
+    elif engine_name == 'fit':
+        def train_step(x, y):
+            hist = model.fit(x, y, nb_epoch=1, batch_size=y.shape[0], shuffle=False, verbose=0)
+            return hist.history['loss'][0]
+        return train_step
+    raise ValueError('Unknown training engine: %s' % engine_name)
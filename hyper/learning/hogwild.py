@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+
+import math
+import numpy as np
+import multiprocessing as mp
+
+from hyper.learning import samples, negatives
+from hyper.evaluation.scoring import merge_functions, similarities
+from hyper.evaluation.parallel import SharedArrays, attach_shared_arrays
+
+import time
+import logging
+
+
+# Models (and their similarity functions) supported by the NumPy training engine
+HOGWILD_MODELS = dict(TransE=['l1', 'l2', 'l2sqr'], DistMult=['dot'], ComplEx=['dot'])
+
+HOGWILD_OPTIMIZERS = ['sgd', 'adagrad']
+
+HOGWILD_NEGATIVES = ['corrupt', 'lcwa']
+
+
+def score_gradients(model_name, similarity_name, s, p, o):
+    """
+    Computes the gradients of the scores of a set of triples with respect to the embeddings of their subjects,
+    predicates and objects.
+
+    :param model_name: Name of the model - TransE, DistMult or ComplEx.
+    :param similarity_name: Name of the similarity function (lowercase).
+    :param s: [nb_triples, k] matrix of subject embeddings.
+    :param p: [nb_triples, k] matrix of predicate embeddings.
+    :param o: [nb_triples, k] matrix of object embeddings.
+    :return: (d_s, d_p, d_o) triple of [nb_triples, k] matrices.
+    """
+    if model_name == 'TransE':
+        d = s + p - o
+        if similarity_name == 'l1':
+            d_s = - np.sign(d)
+        elif similarity_name == 'l2':
+            d_s = - d / np.maximum(np.sqrt(np.sum(np.square(d), axis=1, keepdims=True)), 1e-12)
+        else:
+            d_s = - 2. * d
+        return d_s, d_s, - d_s
+    elif model_name == 'DistMult':
+        return p * o, s * o, s * p
+    elif model_name == 'ComplEx':
+        n = s.shape[1] // 2
+        s_re, s_im, p_re, p_im, o_re, o_im = s[:, :n], s[:, n:], p[:, :n], p[:, n:], o[:, :n], o[:, n:]
+        d_s = np.concatenate([p_re * o_re + p_im * o_im, p_re * o_im - p_im * o_re], axis=1)
+        d_p = np.concatenate([s_re * o_re + s_im * o_im, s_re * o_im - s_im * o_re], axis=1)
+        d_o = np.concatenate([s_re * p_re - s_im * p_im, s_im * p_re + s_re * p_im], axis=1)
+        return d_s, d_p, d_o
+    raise ValueError('Unsupported model: %s' % model_name)
+
+
+def loss_gradients(loss_name, positive_scores, negative_scores, margin=1.):
+    """
+    Computes the pairwise ranking loss of a batch (see hyper.ranking_objectives), and its gradients with respect
+    to the scores of the positive and negative examples.
+
+    :param loss_name: Name of the loss - hinge or logistic.
+    :param positive_scores: [nb_positives] vector of scores of the positive examples.
+    :param negative_scores: [nb_positives, nb_negatives] matrix of scores of the negative examples.
+    :param margin: Margin of the hinge loss.
+    :return: (loss, d_positive, d_negative) triple.
+    """
+    diff = positive_scores[:, np.newaxis] - negative_scores
+    if loss_name == 'hinge':
+        losses = np.maximum(margin - diff, 0.)
+        d_diff = - (losses > 0.).astype(diff.dtype)
+    elif loss_name == 'logistic':
+        losses = np.logaddexp(0., - diff)
+        d_diff = - 1. / (1. + np.exp(diff))
+    else:
+        raise ValueError('Unknown loss: %s' % loss_name)
+    return np.sum(losses), np.sum(d_diff, axis=1), - d_diff
+
+
+def sum_rows(idxs, gradients):
+    """
+    Sums the gradients referring to the same row of an embedding matrix.
+
+    :param idxs: [nb_gradients] vector of row indices.
+    :param gradients: [nb_gradients, k] matrix of gradients.
+    :return: (rows, row_gradients) pair, where rows is a vector of distinct row indices, and row_gradients[i] is the
+        sum of the gradients of row rows[i].
+    """
+    order = np.argsort(idxs, kind='stable')
+    sorted_idxs = idxs[order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_idxs[1:] != sorted_idxs[:-1]]))
+    return sorted_idxs[starts], np.add.reduceat(gradients[order], starts, axis=0)
+
+
+def update_rows(W, accumulator, rows, gradients, lr=.1, epsilon=1e-6):
+    """
+    Updates some rows of an embedding matrix in place, via SGD (if accumulator is None) or Adagrad; reads and writes
+    are not synchronised with other processes updating the same matrix.
+
+    :param W: Embedding matrix.
+    :param accumulator: Adagrad accumulator of the squared gradients of W, or None.
+    :param rows: Vector of distinct row indices.
+    :param gradients: Matrix of gradients of the rows.
+    :param lr: Learning rate.
+    :param epsilon: Epsilon of Adagrad.
+    """
+    if accumulator is None:
+        W[rows] -= lr * gradients
+    else:
+        row_accumulator = accumulator[rows] + np.square(gradients)
+        accumulator[rows] = row_accumulator
+        W[rows] -= lr * gradients / (np.sqrt(row_accumulator) + epsilon)
+
+
+def project_rows(W, rows=None):
+    # Unit norm constraint (as hyper.constraints.NormConstraint(m=1., axis=1)) on the given rows, or on all rows
+    rows = slice(None) if rows is None else rows
+    W[rows] /= np.sqrt(np.sum(np.square(W[rows]), axis=1, keepdims=True)) + 1e-7
+
+
+class EmbeddingTrainer:
+    """
+    Trains a model on batches of triples, generating their negative examples and updating the (possibly shared)
+    entity and predicate embeddings and Adagrad accumulators in place. Updates only touch the rows read by each batch
+    and are not synchronised with other processes: with Hogwild training, updates made concurrently by other workers
+    to the same rows may be partially overwritten, which is tolerated since updates are sparse [1].
+
+    [1] F Niu et al. - Hogwild!: A Lock-Free Approach to Parallelizing Stochastic Gradient Descent - NIPS 2011
+    """
+    def __init__(self, arrays, negative_samples_generator, model_name='TransE', similarity_name='l1',
+                 loss_name='hinge', margin=1., lr=.1, epsilon=1e-6):
+        """
+        :param arrays: Dictionary containing the entity_embeddings and predicate_embeddings matrices, and their
+            entity_accumulator and predicate_accumulator (only with Adagrad).
+        :param negative_samples_generator: Generator of negative examples (see hyper.learning.negatives).
+        :param model_name: Name of the model - TransE, DistMult or ComplEx.
+        :param similarity_name: Name of the similarity function.
+        :param loss_name: Name of the loss - hinge or logistic.
+        :param margin: Margin of the hinge loss.
+        :param lr: Learning rate.
+        :param epsilon: Epsilon of Adagrad.
+        """
+        self.entity_embeddings, self.predicate_embeddings = arrays['entity_embeddings'], arrays['predicate_embeddings']
+        self.entity_accumulator = arrays.get('entity_accumulator')
+        self.predicate_accumulator = arrays.get('predicate_accumulator')
+
+        self.negative_samples_generator = negative_samples_generator
+
+        self.model_name, self.similarity_name = model_name, similarity_name.lower()
+        self.merge_function, self.similarity_function = merge_functions[model_name], similarities[self.similarity_name]
+
+        self.loss_name, self.margin = loss_name, margin
+        self.lr, self.epsilon = lr, epsilon
+
+    def gradients(self, Xr, Xe):
+        """
+        Generates the negative examples of a batch of positive examples, and computes the loss and its gradients.
+
+        :param Xr: [batch_size, 1] matrix containing the relation indices.
+        :param Xe: [batch_size, 2] matrix containing subject and object indices.
+        :return: (loss, (entity_rows, entity_gradients), (predicate_rows, predicate_gradients)) triple, where rows
+            are vectors of distinct row indices of the embedding matrices, and gradients the corresponding matrices
+            of gradients.
+        """
+        negative_samples = self.negative_samples_generator(Xr, Xe)
+
+        # [batch_size * (1 + nb_negatives)] vectors of indices: positive examples first, followed by the negative
+        # examples in row-major [batch_size, nb_negatives] order
+        p_idxs = np.concatenate([Xr[:, 0], np.stack([nXr[:, 0] for nXr, _ in negative_samples], axis=1).reshape(-1)])
+        Xe = np.concatenate([Xe, np.stack([nXe for _, nXe in negative_samples], axis=1).reshape((-1, 2))])
+        s_idxs, o_idxs = Xe[:, 0], Xe[:, 1]
+
+        s, o = self.entity_embeddings[s_idxs], self.entity_embeddings[o_idxs]
+        p = self.predicate_embeddings[p_idxs]
+
+        batch_size = Xr.shape[0]
+        scores = self.merge_function(s, p, o, self.similarity_function)
+        loss, d_positive, d_negative = loss_gradients(self.loss_name, scores[:batch_size],
+                                                      scores[batch_size:].reshape((batch_size, -1)),
+                                                      margin=self.margin)
+
+        d_scores = np.concatenate([d_positive, d_negative.reshape(-1)])[:, np.newaxis]
+        d_s, d_p, d_o = score_gradients(self.model_name, self.similarity_name, s, p, o)
+
+        entity_rows, entity_gradients = sum_rows(np.concatenate([s_idxs, o_idxs]),
+                                                 np.concatenate([d_s * d_scores, d_o * d_scores]))
+        predicate_rows, predicate_gradients = sum_rows(p_idxs, d_p * d_scores)
+        return loss, (entity_rows, entity_gradients), (predicate_rows, predicate_gradients)
+
+    def update(self, entity_rows, entity_gradients, predicate_rows, predicate_gradients):
+        """
+        Updates the given rows of the embedding matrices, and applies the norm constraint to the entity embeddings.
+        """
+        update_rows(self.entity_embeddings, self.entity_accumulator, entity_rows, entity_gradients,
+                    lr=self.lr, epsilon=self.epsilon)
+        update_rows(self.predicate_embeddings, self.predicate_accumulator, predicate_rows, predicate_gradients,
+                    lr=self.lr, epsilon=self.epsilon)
+
+        project_rows(self.entity_embeddings, entity_rows)
+
+    def step(self, Xr, Xe):
+        """
+        Runs one optimisation step on a batch of positive examples.
+
+        :param Xr: [batch_size, 1] matrix containing the relation indices.
+        :param Xe: [batch_size, 2] matrix containing subject and object indices.
+        :return: Value of the loss on the batch.
+        """
+        loss, (entity_rows, entity_gradients), (predicate_rows, predicate_gradients) = self.gradients(Xr, Xe)
+        self.update(entity_rows, entity_gradients, predicate_rows, predicate_gradients)
+        return loss
+
+
+def make_negative_samples_generator(negatives_name, random_state, Xr, Xe, nb_entities, nb_negatives=1,
+                                    negatives_sampler='glorot'):
+    """
+    Creates the generator of negative examples used by each worker.
+
+    :param negatives_name: Name of the generator - corrupt or lcwa.
+    :param random_state: numpy.random.RandomState instance.
+    :param Xr: [nb_samples, 1] matrix containing the relation indices of the training facts.
+    :param Xe: [nb_samples, 2] matrix containing subject and object indices of the training facts.
+    :param nb_entities: Number of entities.
+    :param nb_negatives: Number of negative examples per positive example (and corrupted side).
+    :param negatives_sampler: Name of the generator of random entity indices (see hyper.learning.samples).
+    :return: NegativeSamplesGenerator instance.
+    """
+    subject_index_generator, object_index_generator = samples.make_index_generators(
+        negatives_sampler, random_state, Xr, Xe, nb_entities)
+    candidate_negative_indices = np.arange(1, nb_entities + 1)
+
+    if negatives_name == 'corrupt':
+        return negatives.CorruptedSamplesGenerator(
+            subject_index_generator=subject_index_generator, subject_candidate_indices=candidate_negative_indices,
+            object_index_generator=object_index_generator, object_candidate_indices=candidate_negative_indices,
+            nb_negatives=nb_negatives)
+    elif negatives_name == 'lcwa':
+        return negatives.LCWANegativeSamplesGenerator(
+            object_index_generator=object_index_generator, object_candidate_indices=candidate_negative_indices,
+            nb_negatives=nb_negatives)
+    raise ValueError('Unsupported negative samples generator: %s' % negatives_name)
+
+
+def check_negatives(negatives_name, negatives_sampler):
+    """
+    Checks, in the calling process, that the worker processes can create their generators of negative examples:
+    errors raised while initialising the workers of a multiprocessing.Pool are not propagated, and the pool keeps
+    replacing the failed workers instead.
+
+    :param negatives_name: Name of the generator of negative examples - corrupt or lcwa.
+    :param negatives_sampler: Name of the generator of random entity indices (see hyper.learning.samples).
+    """
+    if negatives_name not in HOGWILD_NEGATIVES:
+        raise ValueError('Unsupported negative samples generator: %s' % negatives_name)
+    if negatives_sampler not in samples.INDEX_GENERATORS:
+        raise ValueError('Unknown index generator: %s' % negatives_sampler)
+
+
+def make_arrays(train_sequences, nb_entities, nb_predicates, seed=1, entity_embedding_size=100,
+                predicate_embedding_size=None, model_name='TransE', similarity_name='L1', optimizer_name='adagrad'):
+    """
+    Initialises the arrays used for training: the embedding matrices (as the glorot_uniform initialisation of the
+    Keras Embedding layers, followed by the norm constraint on the entity embeddings), the Adagrad accumulators, and
+    the training facts.
+
+    :param train_sequences: List of (predicate index, [subject index, object index]) training facts.
+    :param nb_entities: Number of entities.
+    :param nb_predicates: Number of predicates.
+    :param seed: Seed used for initialising the embeddings.
+    :param entity_embedding_size: Size of the entity embeddings (doubled for ComplEx).
+    :param predicate_embedding_size: Size of the predicate embeddings (same as the entity embeddings if None).
+    :param model_name: Name of the model - TransE, DistMult or ComplEx.
+    :param similarity_name: Name of the similarity function - L1, L2 or L2sqr for TransE, dot otherwise.
+    :param optimizer_name: Name of the optimizer - sgd or adagrad.
+    :return: Dictionary containing the entity_embeddings, predicate_embeddings, entity_accumulator and
+        predicate_accumulator (only with Adagrad) matrices, the Xr and Xe matrices of training facts, and the order
+        vector of indices of the training facts.
+    """
+    if model_name not in HOGWILD_MODELS or similarity_name.lower() not in HOGWILD_MODELS[model_name]:
+        raise ValueError('Unsupported model: %s (%s)' % (model_name, similarity_name))
+    if optimizer_name not in HOGWILD_OPTIMIZERS:
+        raise ValueError('Unsupported optimizer: %s' % optimizer_name)
+
+    random_state = np.random.RandomState(seed=seed)
+
+    if predicate_embedding_size is None:
+        predicate_embedding_size = entity_embedding_size
+        if model_name in ['ComplEx']:
+            entity_embedding_size *= 2
+            predicate_embedding_size *= 2
+
+    def glorot_uniform(shape):
+        scale = np.sqrt(6. / (shape[0] + shape[1]))
+        return random_state.uniform(low=- scale, high=scale, size=shape)
+
+    entity_embeddings = glorot_uniform((nb_entities + 1, entity_embedding_size))
+    predicate_embeddings = glorot_uniform((nb_predicates + 1, predicate_embedding_size))
+
+    # The first optimisation step of pairwise_training projects all entity embeddings, later ones the updated rows
+    project_rows(entity_embeddings)
+
+    Xr = np.array([[rel_idx] for (rel_idx, _) in train_sequences])
+    Xe = np.array([ent_idxs for (_, ent_idxs) in train_sequences])
+
+    arrays = dict(entity_embeddings=entity_embeddings, predicate_embeddings=predicate_embeddings,
+                  Xr=Xr, Xe=Xe, order=np.arange(Xr.shape[0]))
+    if optimizer_name == 'adagrad':
+        arrays.update(entity_accumulator=np.zeros_like(entity_embeddings),
+                      predicate_accumulator=np.zeros_like(predicate_embeddings))
+    return arrays
+
+
+# State of each worker process, set by _init_worker
+_worker_state = {}
+
+
+def _set_worker_state(arrays, negatives_kwargs, worker_kwargs):
+    random_state = np.random.RandomState()
+    negative_samples_generator = make_negative_samples_generator(random_state=random_state, Xr=arrays['Xr'],
+                                                                 Xe=arrays['Xe'], **negatives_kwargs)
+    worker = EmbeddingTrainer(arrays, negative_samples_generator, **worker_kwargs)
+    _worker_state.update(worker=worker, random_state=random_state, arrays=arrays)
+
+
+def _init_worker(descriptors, negatives_kwargs, worker_kwargs):
+    arrays, blocks = attach_shared_arrays(descriptors)
+    _set_worker_state(arrays, negatives_kwargs, worker_kwargs)
+    _worker_state.update(blocks=blocks)
+
+
+def _train_shard(task):
+    shard_start, shard_end, batch_size, shard_seed = task
+    worker, arrays = _worker_state['worker'], _worker_state['arrays']
+
+    # Negative examples of each shard only depend on the seed of the shard, not on the process training it
+    _worker_state['random_state'].seed(shard_seed)
+
+    start_time, losses = time.time(), []
+    for batch_start in range(shard_start, shard_end, batch_size):
+        sample_idxs = arrays['order'][batch_start:min(batch_start + batch_size, shard_end)]
+        batch_loss = worker.step(arrays['Xr'][sample_idxs], arrays['Xe'][sample_idxs])
+        losses += [batch_loss / float(sample_idxs.shape[0] * (worker.negative_samples_generator.nb_sample_sets + 1))]
+    return losses, shard_end - shard_start, time.time() - start_time
+
+
+def hogwild_training(train_sequences, nb_entities, nb_predicates, seed=1, entity_embedding_size=100,
+                     predicate_embedding_size=None, model_name='TransE', similarity_name='L1', nb_epochs=1000,
+                     batch_size=128, nb_batches=None, margin=1.0, loss_name='hinge', negatives_name='corrupt',
+                     nb_negatives=1, negatives_sampler='glorot', optimizer_name='adagrad', lr=.1, epsilon=1e-6,
+                     nb_workers=None):
+    """
+    Trains TransE, DistMult or ComplEx with a NumPy implementation of the pairwise training procedure in
+    hyper.learning.core, using nb_workers processes that update the embedding matrices (and Adagrad accumulators)
+    in shared memory without locks. In each epoch the shuffled training facts are split in nb_workers disjoint
+    shards, and each worker generates the negative examples of the facts in its shard.
+
+    :param train_sequences: List of (predicate index, [subject index, object index]) training facts.
+    :param nb_entities: Number of entities.
+    :param nb_predicates: Number of predicates.
+    :param seed: Seed used for initialising the embeddings, shuffling and sampling the negative examples.
+    :param entity_embedding_size: Size of the entity embeddings (doubled for ComplEx).
+    :param predicate_embedding_size: Size of the predicate embeddings (same as the entity embeddings if None).
+    :param model_name: Name of the model - TransE, DistMult or ComplEx.
+    :param similarity_name: Name of the similarity function - L1, L2 or L2sqr for TransE, dot otherwise.
+    :param nb_epochs: Number of epochs.
+    :param batch_size: Number of positive examples in each batch.
+    :param nb_batches: If provided, number of batches per epoch (overrides batch_size).
+    :param margin: Margin of the hinge loss.
+    :param loss_name: Name of the loss - hinge or logistic.
+    :param negatives_name: Name of the generator of negative examples - corrupt or lcwa.
+    :param nb_negatives: Number of negative examples per positive example (and corrupted side).
+    :param negatives_sampler: Name of the generator of random entity indices (see hyper.learning.samples).
+    :param optimizer_name: Name of the optimizer - sgd or adagrad.
+    :param lr: Learning rate.
+    :param epsilon: Epsilon of Adagrad.
+    :param nb_workers: Number of worker processes (defaults to the number of CPUs) - if 1, training runs in the
+        calling process.
+    :return: (entity_embeddings, predicate_embeddings) pair of NumPy matrices.
+    """
+    check_negatives(negatives_name, negatives_sampler)
+    arrays = make_arrays(train_sequences, nb_entities, nb_predicates, seed=seed,
+                         entity_embedding_size=entity_embedding_size,
+                         predicate_embedding_size=predicate_embedding_size, model_name=model_name,
+                         similarity_name=similarity_name, optimizer_name=optimizer_name)
+    nb_samples = arrays['Xr'].shape[0]
+
+    if nb_batches is not None:
+        batch_size = math.ceil(nb_samples / nb_batches)
+        logging.info("Samples: %d, no. batches: %d -> batch size: %d" % (nb_samples, nb_batches, batch_size))
+
+    nb_workers = nb_workers if nb_workers is not None else mp.cpu_count()
+    nb_workers = max(1, min(nb_workers, nb_samples))
+
+    negatives_kwargs = dict(negatives_name=negatives_name, nb_entities=nb_entities, nb_negatives=nb_negatives,
+                            negatives_sampler=negatives_sampler)
+    worker_kwargs = dict(model_name=model_name, similarity_name=similarity_name, loss_name=loss_name,
+                         margin=margin, lr=lr, epsilon=epsilon)
+
+    boundaries = np.linspace(0, nb_samples, nb_workers + 1).astype(int)
+    epoch_seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=nb_epochs)
+
+    logging.info('Hogwild training with %d workers' % nb_workers)
+
+    t0, pool = time.time(), None
+    with SharedArrays(arrays) as shared_arrays:
+        shared, blocks = attach_shared_arrays(shared_arrays.descriptors)
+        try:
+            if nb_workers > 1:
+                initargs = (shared_arrays.descriptors, negatives_kwargs, worker_kwargs)
+                pool = mp.Pool(processes=nb_workers, initializer=_init_worker, initargs=initargs)
+            else:
+                _set_worker_state(shared, negatives_kwargs, worker_kwargs)
+
+            for epoch_no in range(1, nb_epochs + 1):
+                logging.info('Epoch no. %d of %d (samples: %d)' % (epoch_no, nb_epochs, nb_samples))
+                epoch_start_time = time.time()
+
+                epoch_random_state = np.random.RandomState(epoch_seeds[epoch_no - 1])
+                shared['order'][:] = epoch_random_state.permutation(nb_samples)
+                shard_seeds = epoch_random_state.randint(0, 2 ** 31 - 1, size=nb_workers)
+
+                tasks = [(int(start), int(end), int(batch_size), int(shard_seed))
+                         for start, end, shard_seed in zip(boundaries[:-1], boundaries[1:], shard_seeds)]
+                results = pool.map(_train_shard, tasks, chunksize=1) if pool is not None \
+                    else [_train_shard(task) for task in tasks]
+
+                losses = [loss for shard_losses, _, _ in results for loss in shard_losses]
+                epoch_duration = time.time() - epoch_start_time
+
+                logging.info('Loss: %s +/- %s' % (round(np.mean(losses), 4), round(np.std(losses), 4)))
+                logging.info('Epoch duration (s): %s (batches: %d)' % (round(epoch_duration, 4), len(losses)))
+
+                # Throughput of the whole epoch, and average throughput of the workers on their shards
+                worker_throughputs = [nb / duration for _, nb, duration in results if duration > 0]
+                logging.info('Throughput (triples/s): %s with %d workers (per worker: %s)' %
+                             (round(nb_samples / epoch_duration, 2), nb_workers,
+                              round(np.mean(worker_throughputs), 2) if worker_throughputs else 0.))
+
+                if np.isnan(np.mean(losses)):
+                    raise ValueError('NaN propagation.')
+
+            entity_embeddings = np.copy(shared['entity_embeddings'])
+            predicate_embeddings = np.copy(shared['predicate_embeddings'])
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+            # Views of the shared blocks need to be released before closing them
+            _worker_state.clear()
+            shared.clear()
+            for block in blocks:
+                block.close()
+
+    t1 = time.time()
+
+    logging.info('Training duration (ms): %s' % str(t1 - t0))
+    logging.info('Throughput (triples/s): %s with %d workers' % (round(nb_samples * nb_epochs / (t1 - t0), 2),
+                                                                  nb_workers))
+
+    return entity_embeddings, predicate_embeddings
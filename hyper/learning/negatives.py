@@ -8,6 +8,16 @@ import sys
 import logging
 
 
+def _repeat_samples(X, nb_negatives):
+    # [nb_samples, nb_negatives, ...] tensor containing nb_negatives copies of each row of X
+    return np.repeat(X[:, np.newaxis, ...], nb_negatives, axis=1)
+
+
+def _sample_sets(negative_Xr, negative_Xe):
+    # Splits a [nb_samples, nb_negatives, 2] block of negative examples in nb_negatives sets (as views of the block)
+    return [(negative_Xr, negative_Xe[:, i, :]) for i in range(negative_Xe.shape[1])]
+
+
 class NegativeSamplesGenerator(metaclass=ABCMeta):
     @abstractmethod
     def __call__(self, Xr, Xe):
@@ -28,7 +38,7 @@ class CorruptedSamplesGenerator(NegativeSamplesGenerator):
     [1] A Bordes et al. - Translating Embeddings for Modeling Multi-relational Data - NIPS 2013
     """
     def __init__(self, subject_index_generator, subject_candidate_indices,
-                 object_index_generator, object_candidate_indices):
+                 object_index_generator, object_candidate_indices, nb_negatives=1):
 
         # Generator of random subject indices, and array of candidate indices
         self.subject_index_generator = subject_index_generator
@@ -38,7 +48,10 @@ class CorruptedSamplesGenerator(NegativeSamplesGenerator):
         self.object_index_generator = object_index_generator
         self.object_candidate_indices = object_candidate_indices
 
-        self._nb_sample_sets = 2
+        # Number of subject (and object) corruptions of each fact
+        self.nb_negatives = nb_negatives
+
+        self._nb_sample_sets = 2 * nb_negatives
 
     def __call__(self, Xr, Xe):
         """
@@ -55,19 +68,22 @@ class CorruptedSamplesGenerator(NegativeSamplesGenerator):
         negative_Xr = Xr
 
         # Entity (subject and object) indices, on the other hand, are corrupted for generating
-        # two new sets of triples.
+        # 2 * nb_negatives new sets of triples.
+        predicate_idxs = np.repeat(Xr[:, 0], self.nb_negatives)
 
-        # Create a new set of examples by corrupting the subjects
-        negative_subject_idxs = self.subject_index_generator(nb_samples, self.subject_candidate_indices)
-        negative_Xe_subject = np.copy(Xe)
-        negative_Xe_subject[:, 0] = negative_subject_idxs
+        # Create nb_negatives new sets of examples by corrupting the subjects
+        negative_subject_idxs = self.subject_index_generator(nb_samples * self.nb_negatives,
+                                                             self.subject_candidate_indices, predicate_idxs)
+        negative_Xe_subject = _repeat_samples(Xe, self.nb_negatives)
+        negative_Xe_subject[:, :, 0] = negative_subject_idxs.reshape((nb_samples, self.nb_negatives))
 
-        # Create a new set of examples by corrupting the objects
-        negative_object_idxs = self.object_index_generator(nb_samples, self.object_candidate_indices)
-        negative_Xe_object = np.copy(Xe)
-        negative_Xe_object[:, 1] = negative_object_idxs
+        # Create nb_negatives new sets of examples by corrupting the objects
+        negative_object_idxs = self.object_index_generator(nb_samples * self.nb_negatives,
+                                                           self.object_candidate_indices, predicate_idxs)
+        negative_Xe_object = _repeat_samples(Xe, self.nb_negatives)
+        negative_Xe_object[:, :, 1] = negative_object_idxs.reshape((nb_samples, self.nb_negatives))
 
-        return [(negative_Xr, negative_Xe_subject), (negative_Xr, negative_Xe_object)]
+        return _sample_sets(negative_Xr, negative_Xe_subject) + _sample_sets(negative_Xr, negative_Xe_object)
 
     @property
     def nb_sample_sets(self):
@@ -82,13 +98,16 @@ class LCWANegativeSamplesGenerator(NegativeSamplesGenerator):
 
     [1] X L Dong et al. - Knowledge Vault: A Web-Scale Approach to Probabilistic Knowledge Fusion - KDD 2014
     """
-    def __init__(self, object_index_generator, object_candidate_indices):
+    def __init__(self, object_index_generator, object_candidate_indices, nb_negatives=1):
 
         # Generator of random object indices, and array of candidate indices
         self.object_index_generator = object_index_generator
         self.object_candidate_indices = object_candidate_indices
 
-        self._nb_sample_sets = 1
+        # Number of object corruptions of each fact
+        self.nb_negatives = nb_negatives
+
+        self._nb_sample_sets = nb_negatives
 
     def __call__(self, Xr, Xe):
         """
@@ -102,13 +121,15 @@ class LCWANegativeSamplesGenerator(NegativeSamplesGenerator):
 
         # Relation indices are not changed.
         negative_Xr = np.copy(Xr)
+        predicate_idxs = np.repeat(Xr[:, 0], self.nb_negatives)
 
-        # Create a new set of examples by corrupting the objects
-        negative_object_idxs = self.object_index_generator(nb_samples, self.object_candidate_indices)
-        negative_Xe_object = np.copy(Xe)
-        negative_Xe_object[:, 1] = negative_object_idxs
+        # Create nb_negatives new sets of examples by corrupting the objects
+        negative_object_idxs = self.object_index_generator(nb_samples * self.nb_negatives,
+                                                           self.object_candidate_indices, predicate_idxs)
+        negative_Xe_object = _repeat_samples(Xe, self.nb_negatives)
+        negative_Xe_object[:, :, 1] = negative_object_idxs.reshape((nb_samples, self.nb_negatives))
 
-        return [(negative_Xr, negative_Xe_object)]
+        return _sample_sets(negative_Xr, negative_Xe_object)
 
     @property
     def nb_sample_sets(self):
@@ -117,12 +138,15 @@ class LCWANegativeSamplesGenerator(NegativeSamplesGenerator):
 
 class SchemaAwareNegativeSamplesGenerator(NegativeSamplesGenerator):
     def __init__(self, index_generator, candidate_indices,
-                 random_state, predicate2type):
+                 random_state, predicate2type, nb_negatives=1):
         # Generator of random entity indices, and array of candidate indices
         self.index_generator = index_generator
         self.candidate_indices = candidate_indices
 
-        self._nb_sample_sets = 1
+        # Number of corruptions of each fact
+        self.nb_negatives = nb_negatives
+
+        self._nb_sample_sets = nb_negatives
 
         self.random_state = random_state
 
@@ -144,21 +168,19 @@ class SchemaAwareNegativeSamplesGenerator(NegativeSamplesGenerator):
         # Relation indices are not changed.
         negative_Xr = np.copy(Xr)
 
-        # Create a new set of examples by corrupting the objects
-        negative_idxs = self.index_generator(nb_samples, self.candidate_indices)
-        negative_Xe = np.copy(Xe)
+        # Create nb_negatives new sets of examples by corrupting the objects
+        negative_idxs = self.index_generator(nb_samples * self.nb_negatives, self.candidate_indices)
+        negative_Xe = _repeat_samples(Xe, self.nb_negatives).reshape((nb_samples * self.nb_negatives, -1))
+        predicate_types = self.predicate2type[np.repeat(Xr[:, 0], self.nb_negatives)]
 
-        for i in range(nb_samples):
-            predicate_type = self.predicate2type[Xr[i, 0]]
-            if predicate_type == util.PredicateType.one_to_many.value:
-                idx_to_corrupt = 0
-            elif predicate_type == util.PredicateType.many_to_one.value:
-                idx_to_corrupt = 1
-            else:
-                idx_to_corrupt = self.random_state.randint(0, 2)
-            negative_Xe[i, idx_to_corrupt] = negative_idxs[i]
+        # Subjects of one-to-many and objects of many-to-one predicates are corrupted, and a random side otherwise
+        idxs_to_corrupt = self.random_state.randint(0, 2, size=predicate_types.shape[0])
+        idxs_to_corrupt[predicate_types == util.PredicateType.one_to_many.value] = 0
+        idxs_to_corrupt[predicate_types == util.PredicateType.many_to_one.value] = 1
+
+        negative_Xe[np.arange(negative_Xe.shape[0]), idxs_to_corrupt] = negative_idxs
 
-        return [(negative_Xr, negative_Xe)]
+        return _sample_sets(negative_Xr, negative_Xe.reshape((nb_samples, self.nb_negatives, -1)))
 
     @property
     def nb_sample_sets(self):
@@ -167,28 +189,20 @@ class SchemaAwareNegativeSamplesGenerator(NegativeSamplesGenerator):
 
 class BernoulliNegativeSamplesGenerator(NegativeSamplesGenerator):
     def __init__(self, index_generator, candidate_indices,
-                 random_state, ps_count, po_count):
+                 random_state, ps_count, po_count, nb_negatives=1):
         # Generator of random entity indices, and array of candidate indices
         self.index_generator = index_generator
         self.candidate_indices = candidate_indices
 
-        self._nb_sample_sets = 1
-
-        self.random_state = random_state
+        # Number of corruptions of each fact
+        self.nb_negatives = nb_negatives
 
-        entities = sorted(set([s for (_, s) in ps_count.keys()] + [o for (_, o) in po_count.keys()]))
-        predicates = sorted(set([p for (p, _) in ps_count.keys()] + [p for (p, _) in po_count.keys()]))
+        self._nb_sample_sets = nb_negatives
 
-        max_entity_index = max(entities)
-        max_predicate_index = max(predicates)
-
-        self.objects_per_subject = np.zeros((max_predicate_index + 1, max_entity_index + 1))
-        for (predicate_idx, subject_idx), objects_count in ps_count.items():
-            self.objects_per_subject[predicate_idx, subject_idx] = objects_count
+        self.random_state = random_state
 
-        self.subjects_per_object = np.zeros((max_predicate_index + 1, max_entity_index + 1))
-        for (predicate_idx, object_idx), subjects_count in po_count.items():
-            self.objects_per_subject[predicate_idx, object_idx] = subjects_count
+        # Number of facts with each (predicate, subject) and (predicate, object) pair (see util.PairCounts)
+        self.ps_count, self.po_count = ps_count, po_count
 
     def __call__(self, Xr, Xe):
         """
@@ -203,29 +217,274 @@ class BernoulliNegativeSamplesGenerator(NegativeSamplesGenerator):
         # Relation indices are not changed.
         negative_Xr = np.copy(Xr)
 
-        # Create a new set of examples by corrupting the objects
-        negative_idxs = self.index_generator(nb_samples, self.candidate_indices)
-        negative_Xe = np.copy(Xe)
+        # Create nb_negatives new sets of examples by corrupting the objects
+        negative_idxs = self.index_generator(nb_samples * self.nb_negatives, self.candidate_indices)
+        negative_Xe = _repeat_samples(Xe, self.nb_negatives).reshape((nb_samples * self.nb_negatives, -1))
+        predicate_idxs = np.repeat(Xr[:, 0], self.nb_negatives)
+        subject_idxs, object_idxs = negative_Xe[:, 0], negative_Xe[:, 1]
+
+        objects_per_subject = self.ps_count(predicate_idxs, subject_idxs)  # tph
+        subjects_per_object = self.po_count(predicate_idxs, object_idxs)  # hpt
 
-        for i in range(nb_samples):
-            predicate_idx, subject_idx, object_idx = Xr[i, 0], Xe[i, 0], Xe[i, 1]
+        # Probability of replacing the subject
+        p = objects_per_subject / (objects_per_subject + subjects_per_object)
+
+        idxs_to_corrupt = np.where(self.random_state.binomial(1, p) == 1, 0, 1)
+        negative_Xe[np.arange(negative_Xe.shape[0]), idxs_to_corrupt] = negative_idxs
+
+        return _sample_sets(negative_Xr, negative_Xe.reshape((nb_samples, self.nb_negatives, -1)))
+
+    @property
+    def nb_sample_sets(self):
+        return self._nb_sample_sets
+
+
+class HardNegativeSamplesGenerator(NegativeSamplesGenerator):
+    """
+    Instances of this class corrupt the subjects and objects of a set of triples (as in CorruptedSamplesGenerator),
+    drawing a share of the corrupting entities from a cache of hard negatives: for each predicate and side, the
+    cache contains the entities in a random candidate pool that the current model scores highest when used for
+    corrupting the facts of that predicate. The cache is updated by calling refresh periodically during training.
+    """
+    def __init__(self, index_generator, candidate_indices, random_state, nb_negatives=1,
+                 pool_size=1000, cache_size=100, hard_ratio=.5, nb_queries=10, buffer_size=2 ** 20, seed=1):
+        """
+        :param index_generator: Generator of random entity indices, used for the uniform corruptions.
+        :param candidate_indices: Vector of candidate entity indices.
+        :param random_state: numpy.random.RandomState instance.
+        :param nb_negatives: Number of subject (and object) corruptions of each fact.
+        :param pool_size: Number of random candidates scored for each predicate and side when refreshing the cache.
+        :param cache_size: Number of hard negatives cached for each predicate and side.
+        :param hard_ratio: Share of the corruptions drawn from the cache, once it is available.
+        :param nb_queries: Number of facts of each predicate used for scoring the candidates.
+        :param buffer_size: Maximum number of (fact, candidate) pairs scored at once when refreshing the cache.
+        :param seed: Seed of the random state used for refreshing the cache.
+        """
+        self.index_generator = index_generator
+        self.candidate_indices = np.asarray(candidate_indices)
+        self.random_state = random_state
 
-            objects_per_subject = self.objects_per_subject[predicate_idx, subject_idx]  # tph
-            subjects_per_object = self.subjects_per_object[predicate_idx, object_idx]  # hpt
+        self.nb_negatives = nb_negatives
+        self._nb_sample_sets = 2 * nb_negatives
 
-            # Probability of replacing the subject
-            p = objects_per_subject / (objects_per_subject + subjects_per_object)
+        self.pool_size, self.cache_size = min(pool_size, self.candidate_indices.shape[0]), cache_size
+        self.hard_ratio, self.nb_queries, self.buffer_size = hard_ratio, nb_queries, buffer_size
 
-            idx_to_corrupt = 0 if self.random_state.binomial(1, p) == 1 else 1
-            negative_Xe[i, idx_to_corrupt] = negative_idxs[i]
+        # Refreshes use their own random state, which is not re-seeded at the beginning of each epoch
+        self.refresh_random_state = np.random.RandomState(seed)
 
-        return [(negative_Xr, negative_Xe)]
+        # [nb_predicates + 1, cache_size] matrices of hard subject and object corruptions (empty before a refresh)
+        self.caches = None
+
+    def _refresh_side(self, scorer, Xr, Xe, side):
+        Xr, Xe = np.asarray(Xr, dtype=np.int64), np.asarray(Xe, dtype=np.int64)
+        rs = self.refresh_random_state
+
+        # Facts grouped by predicate, so that nb_queries facts of each predicate can be drawn at once
+        order = np.argsort(Xr[:, 0], kind='mergesort')
+        predicates, starts, counts = np.unique(Xr[order, 0], return_index=True, return_counts=True)
+
+        cache = np.zeros((int(predicates.max()) + 1, min(self.cache_size, self.pool_size)), dtype=np.int64)
+
+        chunk_size = max(1, self.buffer_size // (self.nb_queries * self.pool_size))
+        for start in range(0, predicates.shape[0], chunk_size):
+            chunk_predicates = predicates[start:start + chunk_size]
+            nb_predicates = chunk_predicates.shape[0]
+
+            # [nb_predicates, nb_queries] facts to corrupt, and [pool_size] candidate entities shared by the chunk
+            fact_idxs = order[starts[start:start + chunk_size, np.newaxis] + (
+                rs.random_sample((nb_predicates, self.nb_queries)) * counts[start:start + chunk_size, np.newaxis]
+            ).astype(np.int64)]
+            pool = rs.choice(self.candidate_indices, self.pool_size, replace=False)
+
+            # Scores of the facts with the subject (or object) replaced by each candidate in the pool
+            query_predicates, query_facts = np.repeat(chunk_predicates, self.nb_queries), Xe[fact_idxs.reshape(-1)]
+            if side == 0:
+                scores = scorer.score_subjects(query_predicates, query_facts[:, 1], candidate_idxs=pool)
+            else:
+                scores = scorer.score_objects(query_facts[:, 0], query_predicates, candidate_idxs=pool)
+
+            # Average score of each candidate over the corrupted facts, and highest-scoring candidates
+            scores = np.asarray(scores, dtype=np.float64).reshape((nb_predicates, self.nb_queries, -1)).mean(axis=1)
+            top_idxs = np.argpartition(- scores, cache.shape[1] - 1, axis=1)[:, :cache.shape[1]]
+            cache[chunk_predicates, :] = pool[top_idxs]
+
+        return cache
+
+    def refresh(self, scorer, Xr, Xe):
+        """
+        Refreshes the cache of hard negatives using the current model.
+
+        :param scorer: EmbeddingScorer or FunctionScorer instance (see hyper.evaluation.scoring).
+        :param Xr: [nb_samples, 1] matrix containing the relation indices of the facts.
+        :param Xe: [nb_samples, 2] matrix containing subject and object indices of the facts.
+        """
+        self.caches = [self._refresh_side(scorer, Xr, Xe, side) for side in [0, 1]]
+
+    def get_state(self):
+        """
+        Returns the state of the generator (cache of hard negatives and random state used for refreshing it), e.g.
+        for checkpointing.
+        """
+        return dict(caches=self.caches, refresh_random_state=self.refresh_random_state.get_state())
+
+    def set_state(self, state):
+        """
+        Restores a state returned by get_state.
+        """
+        self.caches = state['caches']
+        self.refresh_random_state.set_state(state['refresh_random_state'])
+
+    def _corruptions(self, predicate_idxs, side):
+        nb_samples = predicate_idxs.shape[0]
+
+        idxs = self.index_generator(nb_samples * self.nb_negatives, self.candidate_indices)
+        idxs = idxs.reshape((nb_samples, self.nb_negatives))
+
+        caches = self.caches
+        if caches is not None:
+            cache = caches[side]
+            is_cached = predicate_idxs < cache.shape[0]
+            predicate_idxs = np.where(is_cached, predicate_idxs, 0)
+            is_hard = (self.random_state.random_sample(idxs.shape) < self.hard_ratio) & is_cached[:, np.newaxis]
+            hard_idxs = cache[predicate_idxs[:, np.newaxis], self.random_state.randint(0, cache.shape[1], idxs.shape)]
+
+            # Predicates without facts at refresh time have an empty (all-zeros) cache
+            is_hard &= hard_idxs > 0
+            idxs = np.where(is_hard, hard_idxs, idxs)
+
+        return idxs
+
+    def __call__(self, Xr, Xe):
+        """
+        Generates sets of negative examples, by corrupting the facts provided as input.
+
+        :param Xr: [nb_samples, 1] matrix containing the relation indices.
+        :param Xe: [nb_samples, 2] matrix containing subject and object indices.
+        :return: list of ([nb_samples, 1], [nb_samples, 2]) pairs containing sets of negative examples.
+        """
+        negative_Xr = Xr
+
+        negative_Xe_subject = _repeat_samples(Xe, self.nb_negatives)
+        negative_Xe_subject[:, :, 0] = self._corruptions(Xr[:, 0], 0)
+
+        negative_Xe_object = _repeat_samples(Xe, self.nb_negatives)
+        negative_Xe_object[:, :, 1] = self._corruptions(Xr[:, 0], 1)
+
+        return _sample_sets(negative_Xr, negative_Xe_subject) + _sample_sets(negative_Xr, negative_Xe_object)
 
     @property
     def nb_sample_sets(self):
         return self._nb_sample_sets
 
 
+class TripleSet:
+    """
+    Compact set of (subject, predicate, object) triples, each encoded as a single int64 key, supporting
+    vectorized membership queries by means of binary search over the sorted keys.
+    """
+    def __init__(self, Xr, Xe):
+        """
+        Builds the set.
+
+        :param Xr: [nb_triples, 1] matrix containing the relation indices.
+        :param Xe: [nb_triples, 2] matrix containing subject and object indices.
+        """
+        Xr, Xe = np.asarray(Xr, dtype=np.int64), np.asarray(Xe, dtype=np.int64)
+
+        # Sizes of the predicate and entity spaces used for encoding triples in a single int64 key
+        self.predicate_range = int(Xr.max()) + 1 if Xr.shape[0] > 0 else 1
+        self.entity_range = int(Xe.max()) + 1 if Xe.shape[0] > 0 else 1
+
+        self.keys = np.unique(self._encode(Xr, Xe))
+
+    def _encode(self, Xr, Xe):
+        return (Xe[:, 0] * self.predicate_range + Xr[:, 0]) * self.entity_range + Xe[:, 1]
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def contains(self, Xr, Xe):
+        """
+        Checks which of the given triples belong to the set.
+
+        :param Xr: [nb_samples, 1] matrix containing the relation indices.
+        :param Xe: [nb_samples, 2] matrix containing subject and object indices.
+        :return: [nb_samples] boolean vector.
+        """
+        Xr, Xe = np.asarray(Xr, dtype=np.int64), np.asarray(Xe, dtype=np.int64)
+
+        # Triples with indices outside of the encoding ranges cannot belong to the set
+        is_valid = (Xr[:, 0] < self.predicate_range) & np.all(Xe < self.entity_range, axis=1)
+        keys = self._encode(np.where(is_valid[:, np.newaxis], Xr, 0), np.where(is_valid[:, np.newaxis], Xe, 0))
+
+        is_member = np.zeros(keys.shape[0], dtype=bool)
+        if len(self) > 0:
+            positions = np.minimum(np.searchsorted(self.keys, keys), len(self) - 1)
+            is_member = is_valid & (self.keys[positions] == keys)
+        return is_member
+
+
+class FilteredNegativeSamplesGenerator(NegativeSamplesGenerator):
+    """
+    Wraps a generator of negative examples, so that corruptions which are known true triples are rejected and
+    redrawn from the wrapped generator, in a vectorized fashion, for up to a given number of rounds.
+    """
+    def __init__(self, negative_samples_generator, true_triples, max_rounds=10):
+        """
+        :param negative_samples_generator: Wrapped generator of negative examples.
+        :param true_triples: TripleSet containing the known true triples (e.g. the training facts).
+        :param max_rounds: Maximum number of times rejected negative examples are redrawn - those still rejected
+            after the last round are kept.
+        """
+        self.negative_samples_generator = negative_samples_generator
+        self.true_triples = true_triples
+        self.max_rounds = max_rounds
+
+        # Share of rejected negative examples in the last call, and number of those which could not be redrawn
+        self.rejection_rate, self.nb_unresolved = None, 0
+
+    def __call__(self, Xr, Xe):
+        """
+        Generates sets of negative examples using the wrapped generator, redrawing the ones that are true triples.
+
+        :param Xr: [nb_samples, 1] matrix containing the relation indices.
+        :param Xe: [nb_samples, 2] matrix containing subject and object indices.
+        :return: list of ([nb_samples, 1], [nb_samples, 2]) pairs containing sets of negative examples.
+        """
+        negative_samples = [(negative_Xr, np.array(negative_Xe))
+                            for negative_Xr, negative_Xe in self.negative_samples_generator(Xr, Xe)]
+
+        # [nb_samples, nb_sample_sets] boolean matrix, True for the negative examples that are true triples
+        is_rejected = np.stack([self.true_triples.contains(negative_Xr, negative_Xe)
+                                for negative_Xr, negative_Xe in negative_samples], axis=1)
+        nb_rejected = int(is_rejected.sum())
+
+        for _ in range(self.max_rounds):
+            sample_idxs = np.where(is_rejected.any(axis=1))[0]
+            if sample_idxs.shape[0] == 0:
+                break
+
+            # Draw new negative examples for all the facts with at least one rejected corruption
+            redrawn_samples = self.negative_samples_generator(Xr[sample_idxs], Xe[sample_idxs])
+
+            for i, (negative_Xr, negative_Xe) in enumerate(negative_samples):
+                redrawn_Xr, redrawn_Xe = redrawn_samples[i]
+                is_redrawn = is_rejected[sample_idxs, i] & ~self.true_triples.contains(redrawn_Xr, redrawn_Xe)
+
+                negative_Xe[sample_idxs[is_redrawn]] = redrawn_Xe[is_redrawn]
+                is_rejected[sample_idxs[is_redrawn], i] = False
+
+        self.rejection_rate = nb_rejected / is_rejected.size if is_rejected.size > 0 else .0
+        self.nb_unresolved = int(is_rejected.sum())
+
+        return negative_samples
+
+    @property
+    def nb_sample_sets(self):
+        return self.negative_samples_generator.nb_sample_sets
+
+
 def get_function(function_name):
     this_module = sys.modules[__name__]
     if hasattr(this_module, function_name):
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.learning.batches import BatchAssembler
+
+import contextlib
+import queue
+import threading
+import time
+
+
+class Epoch:
+    """
+    Training examples of an epoch: positive examples in shuffled order, each followed by its negative examples.
+    """
+    def __init__(self, epoch_no, Xr, Xe, preparation_time, assembler=None, rejection_rate=None):
+        self.epoch_no = epoch_no
+        self.Xr, self.Xe = Xr, Xe
+        self.preparation_time = preparation_time
+        # Share of negative examples rejected because they were true triples, if they are filtered
+        self.rejection_rate = rejection_rate
+        self.wait_time = .0
+        self.assembler = assembler
+
+
+class EpochProducer:
+    """
+    Prepares the training examples of each epoch - shuffling, negative sampling and interleaving of positive and
+    negative examples - either inline or in a background thread, which works up to queue_size epochs ahead of the
+    training loop consuming them.
+
+    The random state shared with the negative samples generator is re-seeded at the beginning of each epoch with
+    a seed derived from the global one, so the examples of each epoch do not depend on whether they are prepared
+    inline or in the background. Changes to the state of the generator (e.g. refreshing a cache of hard negatives)
+    must happen within paused, so that the epochs prepared in advance are prepared again with the new state.
+    """
+    def __init__(self, Xr, Xe, negative_samples_generator, random_state, nb_epochs, seed=1, queue_size=0,
+                 initial_epoch=1):
+        """
+        :param Xr: [nb_samples, 1] matrix containing the relation indices of the positive examples.
+        :param Xe: [nb_samples, 2] matrix containing the subject and object indices of the positive examples.
+        :param negative_samples_generator: Generator of negative examples (see hyper.learning.negatives).
+        :param random_state: numpy.random.RandomState instance used for shuffling, and by the negative samples
+            generator.
+        :param nb_epochs: Number of epochs.
+        :param seed: Seed used for deriving the seed of each epoch.
+        :param queue_size: Number of epochs prepared in advance by a background thread - if 0, epochs are
+            prepared inline.
+        :param initial_epoch: Number of the first epoch (e.g. when resuming training from a checkpoint).
+        """
+        self.Xr, self.Xe = Xr, Xe
+        self.negative_samples_generator = negative_samples_generator
+        self.nb_sample_sets = negative_samples_generator.nb_sample_sets + 1
+        self.random_state = random_state
+        self.nb_epochs, self.initial_epoch = nb_epochs, initial_epoch
+        self.queue_size = queue_size
+
+        self.epoch_seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=nb_epochs)
+
+        # One assembler is used by the training loop, queue_size are in the queue, and one is being filled
+        self.free_assemblers = queue.Queue()
+        for _ in range(queue_size + 2 if queue_size > 0 else 1):
+            self.free_assemblers.put(BatchAssembler(nb_sample_sets=self.nb_sample_sets))
+
+        # Number of the last epoch yielded to the training loop
+        self.epoch_no = initial_epoch - 1
+
+        self.thread, self.ready_epochs, self.stop_event = None, None, threading.Event()
+        if queue_size > 0:
+            self.ready_epochs = queue.Queue(maxsize=queue_size)
+            self._start(initial_epoch)
+
+    def _start(self, initial_epoch):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._produce, args=(initial_epoch,), daemon=True)
+        self.thread.start()
+
+    def _stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _prepare(self, epoch_no, assembler):
+        start_time = time.time()
+
+        self.random_state.seed(self.epoch_seeds[epoch_no - 1])
+
+        # Negative examples are generated for the positive examples in their original order,
+        # and then shuffled together with them
+        order = self.random_state.permutation(self.Xr.shape[0])
+        negative_samples = self.negative_samples_generator(self.Xr, self.Xe)
+
+        assembler.set_samples([(self.Xr, self.Xe)] + negative_samples)
+        Xr, Xe = assembler(order)
+
+        rejection_rate = getattr(self.negative_samples_generator, 'rejection_rate', None)
+        return Epoch(epoch_no, Xr, Xe, time.time() - start_time, assembler=assembler, rejection_rate=rejection_rate)
+
+    def _get(self, items):
+        # Blocking get, which gives up (returning None) when the producer is closed
+        while not self.stop_event.is_set():
+            try:
+                return items.get(timeout=.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _put(self, items, item):
+        # Blocking put, which gives up (returning False) when the producer is closed
+        while not self.stop_event.is_set():
+            try:
+                items.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, initial_epoch):
+        try:
+            for epoch_no in range(initial_epoch, self.nb_epochs + 1):
+                assembler = self._get(self.free_assemblers)
+                if assembler is None:
+                    return
+                if not self._put(self.ready_epochs, self._prepare(epoch_no, assembler)):
+                    self.free_assemblers.put(assembler)
+                    return
+        except Exception as e:
+            # Exceptions are re-raised in the training loop
+            self._put(self.ready_epochs, e)
+
+    def __iter__(self):
+        """
+        Yields the Epoch instances in order; the buffers of an epoch are reused once the next one is requested.
+        """
+        for epoch_no in range(self.initial_epoch, self.nb_epochs + 1):
+            if self.ready_epochs is None:
+                epoch = self._prepare(epoch_no, self.free_assemblers.get())
+                epoch.wait_time = epoch.preparation_time
+            else:
+                wait_start_time = time.time()
+                epoch = self.ready_epochs.get()
+                if isinstance(epoch, Exception):
+                    raise epoch
+                epoch.wait_time = time.time() - wait_start_time
+
+            self.epoch_no = epoch_no
+            yield epoch
+
+            self.free_assemblers.put(epoch.assembler)
+
+    @contextlib.contextmanager
+    def paused(self):
+        """
+        Context in which the background thread, if any, is stopped, so that the state of the negative samples
+        generator can be changed: the epochs prepared in advance are discarded, and prepared again afterwards.
+        """
+        if self.ready_epochs is None:
+            yield
+            return
+
+        self._stop()
+        while not self.ready_epochs.empty():
+            epoch = self.ready_epochs.get()
+            if not isinstance(epoch, Exception):
+                self.free_assemblers.put(epoch.assembler)
+        try:
+            yield
+        finally:
+            self._start(self.epoch_no + 1)
+
+    def close(self):
+        """
+        Stops the background thread, if any.
+        """
+        self._stop()
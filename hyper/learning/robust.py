@@ -11,6 +11,7 @@ from keras.engine.training import make_batches
 import hyper.layers.core as core
 
 from hyper.learning import samples, negatives
+from hyper.learning.engine import make_train_step
 from hyper import ranking_objectives, constraints
 
 import hyper.learning.util as learning_util
@@ -52,9 +53,10 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
                       entity_embedding_size=100, predicate_embedding_size=None,
                       dropout_entity_embeddings=None, dropout_predicate_embeddings=None,
                       model_name='TransE', similarity_name='L1', nb_epochs=1000, batch_size=128, nb_batches=None,
-                      margin=1.0, loss_name='hinge', negatives_name='corrupt',
+                      margin=1.0, loss_name='hinge', negatives_name='corrupt', nb_negatives=1,
+                      negatives_sampler='glorot', filtered_negatives=False, predicate_types_cache=None,
                       optimizer=None, regularizer=None, predicate_constraint=None, visualize=False,
-                      robust_alpha=1.0, robust_beta=1.0):
+                      robust_alpha=1.0, robust_beta=1.0, train_engine='step'):
 
     nb_triples = len(train_sequences)
 
@@ -119,32 +121,43 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
         batch_size = math.ceil(nb_samples / nb_batches)
         logging.info("Samples: %d, no. batches: %d -> batch size: %d" % (nb_samples, nb_batches, batch_size))
 
-    # Random index generator for sampling negative examples
-    random_index_generator = samples.GlorotRandomIndexGenerator(random_state=random_state)
+    # Random index generators for sampling negative examples
+    subject_index_generator, object_index_generator = samples.make_index_generators(
+        negatives_sampler, random_state, Xr, Xe, nb_entities)
+
+    # Used by the methods that do not corrupt subjects and objects separately
+    random_index_generator = object_index_generator
 
     # Creating negative indices..
     candidate_negative_indices = np.arange(1, nb_entities + 1)
 
     if negatives_name == 'corrupt':
         negative_samples_generator = negatives.CorruptedSamplesGenerator(
-            subject_index_generator=random_index_generator, subject_candidate_indices=candidate_negative_indices,
-            object_index_generator=random_index_generator, object_candidate_indices=candidate_negative_indices)
+            subject_index_generator=subject_index_generator, subject_candidate_indices=candidate_negative_indices,
+            object_index_generator=object_index_generator, object_candidate_indices=candidate_negative_indices,
+            nb_negatives=nb_negatives)
     elif negatives_name == 'lcwa':
         negative_samples_generator = negatives.LCWANegativeSamplesGenerator(
-            object_index_generator=random_index_generator, object_candidate_indices=candidate_negative_indices)
+            object_index_generator=object_index_generator, object_candidate_indices=candidate_negative_indices,
+            nb_negatives=nb_negatives)
     elif negatives_name == 'schema':
-        predicate2type = learning_util.find_predicate_types(Xr, Xe)
+        predicate2type = learning_util.find_predicate_types(Xr, Xe, cache_dir=predicate_types_cache)
         negative_samples_generator = negatives.SchemaAwareNegativeSamplesGenerator(
             index_generator=random_index_generator, candidate_indices=candidate_negative_indices,
-            random_state=random_state, predicate2type=predicate2type)
+            random_state=random_state, predicate2type=predicate2type, nb_negatives=nb_negatives)
     elif negatives_name == 'binomial' or negatives_name == 'bernoulli':
         ps_count, po_count = learning_util.predicate_statistics(Xr, Xe)
         negative_samples_generator = negatives.BernoulliNegativeSamplesGenerator(
             index_generator=random_index_generator, candidate_indices=candidate_negative_indices,
-            random_state=random_state, ps_count=ps_count, po_count=po_count)
+            random_state=random_state, ps_count=ps_count, po_count=po_count, nb_negatives=nb_negatives)
     else:
         raise ValueError("Unknown negative samples generator: %s" % negatives_name)
 
+    if filtered_negatives is True:
+        # Corruptions which are training facts are rejected and redrawn
+        negative_samples_generator = negatives.FilteredNegativeSamplesGenerator(
+            negative_samples_generator, negatives.TripleSet(Xr, Xe))
+
     nb_sample_sets = negative_samples_generator.nb_sample_sets + 1
 
     def loss(y_true, y_predicted):
@@ -155,6 +168,9 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
 
     model.compile(loss=loss, optimizer=optimizer)
 
+    # Function running one optimisation step on a batch, and returning the loss
+    train_step = make_train_step(model, engine_name=train_engine)
+
     for epoch_no in range(1, nb_epochs + 1):
 
         _y = model.predict(x=[np.ones((3, 1)), np.ones((3, 2)), np.ones((3, 1))])
@@ -193,9 +209,9 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
 
             x = [train_Xr_batch, train_Xe_batch, train_Xeta_batch]
             y = np.zeros((train_Xr_batch.shape[0], 2))
-            hist = model.fit(x=x, y=y, nb_epoch=1, batch_size=train_Xr_batch.shape[0], shuffle=False, verbose=0)
+            batch_loss = train_step(x, y)
 
-            losses += [hist.history['loss'][0] / float(train_Xr_batch.shape[0])]
+            losses += [batch_loss / float(train_Xr_batch.shape[0])]
 
         if visualize is True:
             hinton_diagram = visualization.HintonDiagram()
@@ -206,4 +222,9 @@ def pairwise_training(train_sequences, nb_entities, nb_predicates, seed=1,
 
         logging.info('Loss: %s +/- %s' % (round(np.mean(losses), 4), round(np.std(losses), 4)))
 
+        if filtered_negatives is True:
+            logging.info('Rejected negative examples: %s (not redrawn: %d)' %
+                         (round(negative_samples_generator.rejection_rate, 4),
+                          negative_samples_generator.nb_unresolved))
+
     return model
@@ -12,7 +12,7 @@ class IndexGenerator(metaclass=ABCMeta):
         logging.debug('IndexGenerator(%s, %s)' % (str(args), str(kwargs)))
 
     @abstractmethod
-    def __call__(self, n_samples, indices):
+    def __call__(self, n_samples, indices, predicate_idxs=None):
         while False:
             yield None
 
@@ -30,17 +30,18 @@ class UniformRandomIndexGenerator(IndexGenerator):
         super().__init__(*args, **kwargs)
         self.random_state = random_state
 
-    def __call__(self, n_samples, indices):
+    def __call__(self, n_samples, indices, predicate_idxs=None):
         """
         Creates a NumPy vector of 'n_samples', randomly selected by 'indices'.
         :param n_samples: Number of samples to generate.
         :param indices: List or NumPy vector containing the candidate indices.
+        :param predicate_idxs: Not used.
         :return:
         """
         if isinstance(indices, list):
             indices = np.array(indices)
 
-        rand_ints = self.random_state.random_integers(0, indices.size - 1, n_samples)
+        rand_ints = self.random_state.randint(0, indices.size, n_samples)
         return indices[rand_ints]
 
 
@@ -59,11 +60,12 @@ class GlorotRandomIndexGenerator(IndexGenerator):
         super().__init__(*args, **kwargs)
         self.random_state = random_state
 
-    def __call__(self, n_samples, indices):
+    def __call__(self, n_samples, indices, predicate_idxs=None):
         """
         Creates a NumPy vector of 'n_samples', randomly selected by 'indices'.
         :param n_samples: Number of samples to generate.
         :param indices: List or NumPy vector containing the candidate indices.
+        :param predicate_idxs: Not used.
         :return:
         """
         if isinstance(indices, list):
@@ -72,3 +74,168 @@ class GlorotRandomIndexGenerator(IndexGenerator):
         shuffled_indices = indices[self.random_state.permutation(len(indices))]
         rand_ints = shuffled_indices[np.arange(n_samples) % len(shuffled_indices)]
         return rand_ints
+
+
+def alias_table(weights):
+    """
+    Builds the alias table [1] of a discrete distribution, which allows sampling from it in O(1) time per sample.
+
+    [1] M D Vose - A Linear Algorithm for Generating Random Numbers with a Given Distribution - IEEE TSE 1991
+
+    :param weights: Vector of non-negative (not necessarily normalized) weights.
+    :return: (probabilities, aliases) pair of vectors: the i-th outcome is drawn by picking a slot j uniformly at
+        random, and returning j with probability probabilities[j], and aliases[j] otherwise.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    nb_outcomes = weights.shape[0]
+
+    probabilities = weights * nb_outcomes / weights.sum()
+    aliases = np.arange(nb_outcomes)
+
+    small, large = np.where(probabilities < 1.)[0].tolist(), np.where(probabilities >= 1.)[0].tolist()
+    while len(small) > 0 and len(large) > 0:
+        small_idx, large_idx = small.pop(), large.pop()
+        aliases[small_idx] = large_idx
+        probabilities[large_idx] -= 1. - probabilities[small_idx]
+        (small if probabilities[large_idx] < 1. else large).append(large_idx)
+
+    # Slots left in either list only differ from 1 because of rounding errors
+    probabilities[small + large] = 1.
+    return probabilities, aliases
+
+
+class AliasIndexGenerator(IndexGenerator):
+    """
+    Instances of this class are used for generating random entity indices from an arbitrary distribution (e.g. the
+    unigram distribution of the entities in the training facts, raised to the power of 3/4), by means of alias
+    tables: each sample costs O(1), regardless of the number of candidates.
+
+    Optionally, each predicate can be given its own subset of candidates (e.g. the entities appearing as objects
+    of the predicate in the training facts), used whenever the predicate of each sample is provided. Predicates
+    with a single candidate are sampled from all the candidate indices instead, as their subset would only contain
+    the entity being corrupted.
+    """
+    def __init__(self, random_state, weights, candidate_pairs=None, *args, **kwargs):
+        """
+        Initializes the generator.
+        :param random_state: numpy.random.RandomState instance.
+        :param weights: Vector of non-negative weights, indexed by entity index.
+        :param candidate_pairs: If provided, [nb_pairs, 2] matrix of (predicate, entity) pairs, defining the subset
+            of candidate entities of each predicate.
+        """
+        super().__init__(*args, **kwargs)
+        self.random_state = random_state
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+        # Alias table of the last vector of candidate indices
+        self.indices, self.probabilities, self.aliases = None, None, None
+
+        self.predicate_offsets, self.predicate_sizes = None, None
+        if candidate_pairs is not None:
+            self._set_candidate_pairs(np.asarray(candidate_pairs, dtype=np.int64).reshape((-1, 2)))
+
+    def _set_candidate_pairs(self, candidate_pairs):
+        # Candidates of all predicates are stored contiguously, sorted by predicate, together with their alias tables
+        candidate_pairs = np.unique(candidate_pairs, axis=0)
+        predicates, starts, sizes = np.unique(candidate_pairs[:, 0], return_index=True, return_counts=True)
+
+        # Predicates with a single candidate fall back to the global table
+        sizes = np.where(sizes > 1, sizes, 0)
+
+        self.predicate_offsets = np.zeros(int(predicates.max()) + 1 if predicates.shape[0] > 0 else 1, dtype=np.int64)
+        self.predicate_sizes = np.zeros(self.predicate_offsets.shape[0], dtype=np.int64)
+        self.predicate_offsets[predicates], self.predicate_sizes[predicates] = starts, sizes
+
+        self.predicate_candidates = candidate_pairs[:, 1]
+        self.predicate_probabilities = np.ones(self.predicate_candidates.shape[0])
+        self.predicate_aliases = np.arange(self.predicate_candidates.shape[0])
+
+        for start, size in zip(starts.tolist(), sizes.tolist()):
+            if size == 0:
+                continue
+            weights = self.weights[self.predicate_candidates[start:start + size]]
+            if weights.sum() > 0:
+                probabilities, aliases = alias_table(weights)
+                self.predicate_probabilities[start:start + size] = probabilities
+                self.predicate_aliases[start:start + size] = aliases + start
+
+    def _sample(self, slots, probabilities, aliases):
+        is_accepted = self.random_state.random_sample(slots.shape[0]) < probabilities[slots]
+        return np.where(is_accepted, slots, aliases[slots])
+
+    def __call__(self, n_samples, indices, predicate_idxs=None):
+        """
+        Creates a NumPy vector of 'n_samples', randomly selected by 'indices' according to the weights.
+        :param n_samples: Number of samples to generate.
+        :param indices: List or NumPy vector containing the candidate indices.
+        :param predicate_idxs: If provided, [n_samples] vector containing the predicate of each sample: samples of
+            predicates with a subset of candidates are drawn from it.
+        :return:
+        """
+        if isinstance(indices, list):
+            indices = np.array(indices)
+
+        # The alias table is rebuilt only when the candidate indices change
+        if indices is not self.indices:
+            weights = self.weights[indices]
+            self.indices = indices
+            self.probabilities, self.aliases = alias_table(weights if weights.sum() > 0 else np.ones_like(weights))
+
+        samples = np.empty(n_samples, dtype=indices.dtype)
+        is_global = np.ones(n_samples, dtype=bool)
+
+        if predicate_idxs is not None and self.predicate_sizes is not None:
+            predicate_idxs = np.asarray(predicate_idxs, dtype=np.int64)
+            is_valid = predicate_idxs < self.predicate_sizes.shape[0]
+            predicate_idxs = np.where(is_valid, predicate_idxs, 0)
+
+            # Samples of predicates with a subset of candidates are drawn from it
+            sizes = np.where(is_valid, self.predicate_sizes[predicate_idxs], 0)
+            is_global = sizes == 0
+
+            slots = self.predicate_offsets[predicate_idxs[~is_global]] + \
+                (self.random_state.random_sample(n_samples - is_global.sum()) * sizes[~is_global]).astype(np.int64)
+            samples[~is_global] = self.predicate_candidates[
+                self._sample(slots, self.predicate_probabilities, self.predicate_aliases)]
+
+        slots = self.random_state.randint(0, indices.shape[0], int(is_global.sum()))
+        samples[is_global] = indices[self._sample(slots, self.probabilities, self.aliases)]
+
+        return samples
+
+
+INDEX_GENERATORS = ['glorot', 'uniform', 'unigram', 'predicate-unigram']
+
+
+def make_index_generators(name, random_state, Xr, Xe, nb_entities, power=.75):
+    """
+    Creates the generators of random subject and object indices used for sampling negative examples.
+
+    :param name: Name of the generator - glorot, uniform, unigram (frequency of the entities in the facts, raised to
+        the given power: entities not appearing in the facts are never drawn) or predicate-unigram (as unigram, but
+        restricted to the subjects and objects seen with each predicate, when there are at least two of them). Only
+        the generators of negative examples which pass the predicate of each sample (corrupt and lcwa) restrict the
+        candidates: with the others (schema, bernoulli and hard), predicate-unigram is equivalent to unigram.
+    :param random_state: numpy.random.RandomState instance.
+    :param Xr: [nb_facts, 1] matrix containing the relation indices of the training facts.
+    :param Xe: [nb_facts, 2] matrix containing subject and object indices of the training facts.
+    :param nb_entities: Number of entities.
+    :param power: Exponent applied to the entity frequencies.
+    :return: (subject index generator, object index generator) pair.
+    """
+    if name == 'glorot':
+        index_generator = GlorotRandomIndexGenerator(random_state=random_state)
+        return index_generator, index_generator
+    elif name == 'uniform':
+        index_generator = UniformRandomIndexGenerator(random_state=random_state)
+        return index_generator, index_generator
+    elif name in ['unigram', 'predicate-unigram']:
+        Xr, Xe = np.asarray(Xr, dtype=np.int64), np.asarray(Xe, dtype=np.int64)
+        weights = np.bincount(Xe.reshape(-1), minlength=nb_entities + 1).astype(np.float64) ** power
+        if name == 'unigram':
+            index_generator = AliasIndexGenerator(random_state=random_state, weights=weights)
+            return index_generator, index_generator
+        return tuple(AliasIndexGenerator(random_state=random_state, weights=weights,
+                                         candidate_pairs=np.column_stack([Xr[:, 0], Xe[:, side]]))
+                     for side in [0, 1])
+    raise ValueError('Unknown index generator: %s' % name)
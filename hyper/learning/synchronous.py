@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+import math
+import numpy as np
+import multiprocessing as mp
+
+from hyper.learning.hogwild import EmbeddingTrainer, check_negatives, make_arrays, make_negative_samples_generator,\
+    sum_rows
+from hyper.evaluation.parallel import SharedArrays, attach_shared_arrays
+
+import time
+import logging
+
+
+def _worker(connection, descriptors, negatives_kwargs, trainer_kwargs, max_slice_size):
+    """
+    Worker process: for each slice of a batch received through the connection, computes the per-row gradients of
+    the loss, writes them in its own shared memory buffers, and replies with the loss and the number of rows.
+    """
+    arrays, blocks = attach_shared_arrays(descriptors)
+    try:
+        random_state = np.random.RandomState()
+        negative_samples_generator = make_negative_samples_generator(random_state=random_state, Xr=arrays['Xr'],
+                                                                     Xe=arrays['Xe'], **negatives_kwargs)
+        trainer = EmbeddingTrainer(arrays, negative_samples_generator, **trainer_kwargs)
+
+        # Each positive example is followed by its negative examples, and each triple reads two entity embeddings
+        nb_triples = max_slice_size * (negative_samples_generator.nb_sample_sets + 1)
+        buffers = dict(entity_rows=np.zeros(2 * nb_triples, dtype=np.int64),
+                       entity_gradients=np.zeros((2 * nb_triples, arrays['entity_embeddings'].shape[1])),
+                       predicate_rows=np.zeros(nb_triples, dtype=np.int64),
+                       predicate_gradients=np.zeros((nb_triples, arrays['predicate_embeddings'].shape[1])))
+    except Exception as e:
+        connection.send(e)
+        return
+
+    with SharedArrays(buffers) as shared_buffers:
+        gradients, gradient_blocks = attach_shared_arrays(shared_buffers.descriptors)
+        connection.send((shared_buffers.descriptors, negative_samples_generator.nb_sample_sets + 1))
+
+        for message in iter(connection.recv, None):
+            if message[0] == 'seed':
+                # Negative examples of the worker in each epoch only depend on the seed it receives
+                random_state.seed(message[1])
+                continue
+
+            _, slice_start, slice_end = message
+            try:
+                reply = (0., 0, 0)
+                if slice_end > slice_start:
+                    sample_idxs = arrays['order'][slice_start:slice_end]
+                    loss, (entity_rows, entity_gradients), (predicate_rows, predicate_gradients) = \
+                        trainer.gradients(arrays['Xr'][sample_idxs], arrays['Xe'][sample_idxs])
+
+                    nb_entity_rows, nb_predicate_rows = entity_rows.shape[0], predicate_rows.shape[0]
+                    gradients['entity_rows'][:nb_entity_rows] = entity_rows
+                    gradients['entity_gradients'][:nb_entity_rows] = entity_gradients
+                    gradients['predicate_rows'][:nb_predicate_rows] = predicate_rows
+                    gradients['predicate_gradients'][:nb_predicate_rows] = predicate_gradients
+                    reply = (loss, nb_entity_rows, nb_predicate_rows)
+            except Exception as e:
+                reply = e
+            connection.send(reply)
+
+        gradients.clear()
+        for block in gradient_blocks:
+            block.close()
+
+
+class WorkerGroup:
+    """
+    Set of worker processes computing the gradients of the slices of each batch, which are then summed by the
+    calling process in the order of the workers - so that, for a given number of workers, the result of each
+    reduction does not depend on the timing of the workers.
+    """
+    def __init__(self, descriptors, negatives_kwargs, trainer_kwargs, nb_workers, max_slice_size):
+        """
+        :param descriptors: SharedArrays.descriptors of the arrays created by hyper.learning.hogwild.make_arrays.
+        :param negatives_kwargs: Arguments of hyper.learning.hogwild.make_negative_samples_generator.
+        :param trainer_kwargs: Arguments of hyper.learning.hogwild.EmbeddingTrainer.
+        :param nb_workers: Number of worker processes.
+        :param max_slice_size: Maximum number of positive examples in the slice of a batch given to a worker.
+        """
+        self.connections, self.processes, self.gradients, self.blocks = [], [], [], []
+        self.nb_sample_sets = None
+        for _ in range(nb_workers):
+            connection, worker_connection = mp.Pipe()
+            process = mp.Process(target=_worker, daemon=True,
+                                 args=(worker_connection, descriptors, negatives_kwargs, trainer_kwargs,
+                                       max_slice_size))
+            process.start()
+            worker_connection.close()
+            self.connections += [connection]
+            self.processes += [process]
+
+        for connection in self.connections:
+            descriptors, self.nb_sample_sets = self._receive(connection)
+            gradients, blocks = attach_shared_arrays(descriptors)
+            self.gradients += [gradients]
+            self.blocks += blocks
+
+    @staticmethod
+    def _receive(connection):
+        # Exceptions raised by the workers are re-raised in the calling process
+        reply = connection.recv()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def seed(self, seeds):
+        """
+        Re-seeds the random state used by each worker for sampling negative examples.
+
+        :param seeds: One seed per worker.
+        """
+        for connection, seed in zip(self.connections, seeds):
+            connection.send(('seed', int(seed)))
+
+    def __call__(self, slices):
+        """
+        Computes the loss and the per-row gradients of a batch, split in one slice per worker.
+
+        :param slices: List of (start, end) pairs of positions in the order of the training facts, one per worker.
+        :return: (loss, (entity_rows, entity_gradients), (predicate_rows, predicate_gradients)) triple, as
+            EmbeddingTrainer.gradients.
+        """
+        for connection, (slice_start, slice_end) in zip(self.connections, slices):
+            connection.send(('slice', int(slice_start), int(slice_end)))
+        replies = [self._receive(connection) for connection in self.connections]
+
+        loss = sum(loss for loss, _, _ in replies)
+
+        entity_rows = np.concatenate([g['entity_rows'][:n] for g, (_, n, _) in zip(self.gradients, replies)])
+        entity_gradients = np.concatenate([g['entity_gradients'][:n]
+                                           for g, (_, n, _) in zip(self.gradients, replies)])
+        predicate_rows = np.concatenate([g['predicate_rows'][:n] for g, (_, _, n) in zip(self.gradients, replies)])
+        predicate_gradients = np.concatenate([g['predicate_gradients'][:n]
+                                              for g, (_, _, n) in zip(self.gradients, replies)])
+
+        return loss, sum_rows(entity_rows, entity_gradients), sum_rows(predicate_rows, predicate_gradients)
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for gradients in self.gradients:
+            gradients.clear()
+        for block in self.blocks:
+            block.close()
+
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                try:
+                    connection.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.gradients, self.blocks = [], []
+
+
+def synchronous_training(train_sequences, nb_entities, nb_predicates, seed=1, entity_embedding_size=100,
+                         predicate_embedding_size=None, model_name='TransE', similarity_name='L1', nb_epochs=1000,
+                         batch_size=128, nb_batches=None, margin=1.0, loss_name='hinge', negatives_name='corrupt',
+                         nb_negatives=1, negatives_sampler='glorot', optimizer_name='adagrad', lr=.1, epsilon=1e-6,
+                         nb_workers=2):
+    """
+    Trains TransE, DistMult or ComplEx with the NumPy implementation of the pairwise training procedure used by
+    hyper.learning.hogwild, but with synchronous data-parallel steps: each batch is split in nb_workers slices, the
+    worker processes compute the per-row gradients of their slices (generating their negative examples), and the
+    gradients are summed in a fixed order before a single update of the embeddings. For a given seed and number of
+    workers, the results are bit-identical across runs.
+
+    :param train_sequences: List of (predicate index, [subject index, object index]) training facts.
+    :param nb_entities: Number of entities.
+    :param nb_predicates: Number of predicates.
+    :param seed: Seed used for initialising the embeddings, shuffling and sampling the negative examples.
+    :param entity_embedding_size: Size of the entity embeddings (doubled for ComplEx).
+    :param predicate_embedding_size: Size of the predicate embeddings (same as the entity embeddings if None).
+    :param model_name: Name of the model - TransE, DistMult or ComplEx.
+    :param similarity_name: Name of the similarity function - L1, L2 or L2sqr for TransE, dot otherwise.
+    :param nb_epochs: Number of epochs.
+    :param batch_size: Number of positive examples in each batch.
+    :param nb_batches: If provided, number of batches per epoch (overrides batch_size).
+    :param margin: Margin of the hinge loss.
+    :param loss_name: Name of the loss - hinge or logistic.
+    :param negatives_name: Name of the generator of negative examples - corrupt or lcwa.
+    :param nb_negatives: Number of negative examples per positive example (and corrupted side).
+    :param negatives_sampler: Name of the generator of random entity indices (see hyper.learning.samples).
+    :param optimizer_name: Name of the optimizer - sgd or adagrad.
+    :param lr: Learning rate.
+    :param epsilon: Epsilon of Adagrad.
+    :param nb_workers: Number of worker processes.
+    :return: (entity_embeddings, predicate_embeddings) pair of NumPy matrices.
+    """
+    check_negatives(negatives_name, negatives_sampler)
+    arrays = make_arrays(train_sequences, nb_entities, nb_predicates, seed=seed,
+                         entity_embedding_size=entity_embedding_size,
+                         predicate_embedding_size=predicate_embedding_size, model_name=model_name,
+                         similarity_name=similarity_name, optimizer_name=optimizer_name)
+    nb_samples = arrays['Xr'].shape[0]
+
+    if nb_batches is not None:
+        batch_size = math.ceil(nb_samples / nb_batches)
+        logging.info("Samples: %d, no. batches: %d -> batch size: %d" % (nb_samples, nb_batches, batch_size))
+
+    batch_size = int(min(batch_size, nb_samples))
+    nb_workers = max(1, min(nb_workers, batch_size))
+
+    negatives_kwargs = dict(negatives_name=negatives_name, nb_entities=nb_entities, nb_negatives=nb_negatives,
+                            negatives_sampler=negatives_sampler)
+    trainer_kwargs = dict(model_name=model_name, similarity_name=similarity_name, loss_name=loss_name,
+                          margin=margin, lr=lr, epsilon=epsilon)
+
+    epoch_seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=nb_epochs)
+
+    logging.info('Synchronous training with %d workers' % nb_workers)
+
+    t0, workers, trainer = time.time(), None, None
+    with SharedArrays(arrays) as shared_arrays:
+        shared, blocks = attach_shared_arrays(shared_arrays.descriptors)
+        try:
+            workers = WorkerGroup(shared_arrays.descriptors, negatives_kwargs, trainer_kwargs, nb_workers,
+                                  max_slice_size=int(math.ceil(batch_size / nb_workers)))
+
+            # Only used for applying the (reduced) gradients to the shared embeddings
+            trainer = EmbeddingTrainer(shared, None, **trainer_kwargs)
+
+            for epoch_no in range(1, nb_epochs + 1):
+                logging.info('Epoch no. %d of %d (samples: %d)' % (epoch_no, nb_epochs, nb_samples))
+                epoch_start_time, gradients_time = time.time(), .0
+
+                epoch_random_state = np.random.RandomState(epoch_seeds[epoch_no - 1])
+                shared['order'][:] = epoch_random_state.permutation(nb_samples)
+                workers.seed(epoch_random_state.randint(0, 2 ** 31 - 1, size=nb_workers))
+
+                losses = []
+                for batch_start in range(0, nb_samples, batch_size):
+                    batch_end = min(batch_start + batch_size, nb_samples)
+                    boundaries = np.linspace(batch_start, batch_end, nb_workers + 1).astype(int)
+
+                    gradients_start_time = time.time()
+                    loss, entity_gradients, predicate_gradients = workers(list(zip(boundaries[:-1], boundaries[1:])))
+                    gradients_time += time.time() - gradients_start_time
+
+                    trainer.update(*(entity_gradients + predicate_gradients))
+
+                    losses += [loss / float((batch_end - batch_start) * workers.nb_sample_sets)]
+
+                epoch_duration = time.time() - epoch_start_time
+
+                logging.info('Loss: %s +/- %s' % (round(np.mean(losses), 4), round(np.std(losses), 4)))
+                logging.info('Epoch duration (s): %s (gradients: %s, batches: %d)' %
+                             (round(epoch_duration, 4), round(gradients_time, 4), len(losses)))
+                logging.info('Throughput (triples/s): %s with %d workers' %
+                             (round(nb_samples / epoch_duration, 2), nb_workers))
+
+                if np.isnan(np.mean(losses)):
+                    raise ValueError('NaN propagation.')
+
+            entity_embeddings = np.copy(shared['entity_embeddings'])
+            predicate_embeddings = np.copy(shared['predicate_embeddings'])
+        finally:
+            if workers is not None:
+                workers.close()
+
+            # Views of the shared blocks (also held by the trainer) need to be released before closing them
+            del trainer
+            shared.clear()
+            for block in blocks:
+                block.close()
+
+    t1 = time.time()
+
+    logging.info('Training duration (ms): %s' % str(t1 - t0))
+    logging.info('Throughput (triples/s): %s with %d workers' % (round(nb_samples * nb_epochs / (t1 - t0), 2),
+                                                                  nb_workers))
+
+    return entity_embeddings, predicate_embeddings
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
+
 from enum import Enum
+
+import os
+import json
+import hashlib
 import logging
 
 
@@ -14,56 +20,129 @@ class PredicateType(Enum):
         return self.name
 
 
-def predicate_statistics(Xr, Xe):
-    ps_count = dict()
-    po_count = dict()
-
-    for [p], [s, o] in zip(Xr, Xe):
-        if (p, s) not in ps_count:
-            ps_count[(p, s)] = 0
-        if (p, o) not in po_count:
-            po_count[(p, o)] = 0
+class PairCounts:
+    """
+    Number of facts containing each (predicate, entity) pair, stored as sorted int64 keys and counts, so that
+    its memory cost scales with the number of distinct pairs rather than with the number of predicates and entities.
+    """
+    def __init__(self, predicate_idxs, entity_idxs):
+        """
+        :param predicate_idxs: [nb_facts] vector of predicate indices.
+        :param entity_idxs: [nb_facts] vector of entity (subject or object) indices.
+        """
+        predicate_idxs = np.asarray(predicate_idxs, dtype=np.int64).reshape(-1)
+        entity_idxs = np.asarray(entity_idxs, dtype=np.int64).reshape(-1)
+
+        self.entity_range = int(entity_idxs.max()) + 1 if entity_idxs.shape[0] > 0 else 1
+        self.keys, self.counts = np.unique(predicate_idxs * self.entity_range + entity_idxs, return_counts=True)
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def __call__(self, predicate_idxs, entity_idxs):
+        """
+        Looks up the counts of the given (predicate, entity) pairs.
+
+        :param predicate_idxs: Vector of predicate indices.
+        :param entity_idxs: Vector of entity indices.
+        :return: Vector containing the number of facts with each pair (0 for unseen pairs).
+        """
+        predicate_idxs = np.asarray(predicate_idxs, dtype=np.int64)
+        entity_idxs = np.asarray(entity_idxs, dtype=np.int64)
+
+        keys = predicate_idxs * self.entity_range + entity_idxs
+        counts = np.zeros(keys.shape, dtype=np.int64)
+        if len(self) > 0:
+            positions = np.minimum(np.searchsorted(self.keys, keys), len(self) - 1)
+            is_found = (self.keys[positions] == keys) & (entity_idxs < self.entity_range)
+            counts[is_found] = self.counts[positions[is_found]]
+        return counts
+
+    def items(self):
+        """
+        :return: List of ((predicate, entity), count) pairs.
+        """
+        predicate_idxs, entity_idxs = np.divmod(self.keys, self.entity_range)
+        return [((p, e), c) for p, e, c in zip(predicate_idxs.tolist(), entity_idxs.tolist(), self.counts.tolist())]
 
-        ps_count[(p, s)] += 1
-        po_count[(p, o)] += 1
 
+def predicate_statistics(Xr, Xe):
+    """
+    Counts the facts containing each (predicate, subject) and each (predicate, object) pair.
+
+    :param Xr: [nb_facts, 1] matrix containing the relation indices.
+    :param Xe: [nb_facts, 2] matrix containing subject and object indices.
+    :return: (ps_count, po_count) pair of PairCounts instances.
+    """
+    Xr, Xe = np.asarray(Xr), np.asarray(Xe)
+    ps_count = PairCounts(Xr[:, 0], Xe[:, 0])
+    po_count = PairCounts(Xr[:, 0], Xe[:, 1])
     return ps_count, po_count
 
 
-def find_predicate_types(Xr, Xe):
-    logging.info('Recognizing the type of each predicate (1-to-1, 1-to-M, M-to-1, M-to-M) ..')
-
-    predicates = set([p for [p] in Xr])
-
+def _predicate_types(Xr, Xe):
     ps_count, po_count = predicate_statistics(Xr, Xe)
 
-    predicate2type = dict()
-
-    for p in predicates:
-        at_most_one_o_per_s = True
-        at_most_one_s_per_o = True
+    predicates = np.unique(np.asarray(Xr, dtype=np.int64)[:, 0])
+    nb_predicates = int(predicates.max()) + 1 if predicates.shape[0] > 0 else 1
 
-        for (_p, _), count in ps_count.items():
-            if p == _p and count > 1:
-                at_most_one_o_per_s = False
+    # Maximum number of objects per subject, and of subjects per object, for each predicate
+    max_counts = []
+    for pair_counts in [ps_count, po_count]:
+        predicate_max_counts = np.zeros(nb_predicates, dtype=np.int64)
+        np.maximum.at(predicate_max_counts, pair_counts.keys // pair_counts.entity_range, pair_counts.counts)
+        max_counts += [predicate_max_counts]
 
-        for (_p, _), count in po_count.items():
-            if p == _p and count > 1:
-                at_most_one_s_per_o = False
+    at_most_one_o_per_s, at_most_one_s_per_o = max_counts[0] <= 1, max_counts[1] <= 1
 
-        predicate_type = None
-        if at_most_one_o_per_s is True and at_most_one_s_per_o is True:
+    predicate2type = dict()
+    for p in predicates.tolist():
+        if at_most_one_o_per_s[p] and at_most_one_s_per_o[p]:
             predicate_type = PredicateType.one_to_one
-        elif at_most_one_o_per_s is True and at_most_one_s_per_o is False:
+        elif at_most_one_o_per_s[p] and not at_most_one_s_per_o[p]:
             predicate_type = PredicateType.many_to_one
-        elif at_most_one_o_per_s is False and at_most_one_s_per_o is True:
+        elif not at_most_one_o_per_s[p] and at_most_one_s_per_o[p]:
             predicate_type = PredicateType.one_to_many
-        elif at_most_one_o_per_s is False and at_most_one_s_per_o is False:
+        else:
             predicate_type = PredicateType.many_to_many
-
         predicate2type[p] = predicate_type
 
     return predicate2type
 
 
+def find_predicate_types(Xr, Xe, cache_dir=None):
+    """
+    Recognizes the type of each predicate (1-to-1, 1-to-M, M-to-1, M-to-M) from the facts.
+
+    :param Xr: [nb_facts, 1] matrix containing the relation indices.
+    :param Xe: [nb_facts, 2] matrix containing subject and object indices.
+    :param cache_dir: If provided, directory where the predicate types are cached, in a file whose name contains
+        a digest of the facts.
+    :return: Dictionary mapping each predicate index to a PredicateType.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha1()
+        for X in [Xr, Xe]:
+            digest.update(np.ascontiguousarray(X, dtype=np.int64).tobytes())
+        cache_path = os.path.join(cache_dir, 'predicate_types_%s.json' % digest.hexdigest())
+
+        if os.path.isfile(cache_path):
+            logging.info('Loading the type of each predicate from %s ..' % cache_path)
+            with open(cache_path, 'r') as f:
+                return {int(p): PredicateType[name] for p, name in json.load(f).items()}
 
+    logging.info('Recognizing the type of each predicate (1-to-1, 1-to-M, M-to-1, M-to-M) ..')
+    predicate2type = _predicate_types(Xr, Xe)
+
+    if cache_path is not None:
+        # Written to a temporary file first, so that concurrent runs never read a partial cache
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({str(p): predicate_type.name for p, predicate_type in predicate2type.items()}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.warning('Could not cache the type of each predicate in %s: %s' % (cache_path, e))
+
+    return predicate2type
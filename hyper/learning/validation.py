@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.evaluation import metrics
+from hyper.evaluation.filters import make_filter_index
+from hyper.evaluation.scoring import make_scorer
+
+import logging
+
+
+class EarlyStopping:
+    """
+    Periodically evaluates a model during training by means of the filtered Mean Reciprocal Rank on a (possibly
+    sampled) subset of the validation triples, keeps the weights of the best model seen so far, and signals when
+    training should stop because the MRR did not improve for a given number of evaluations.
+    """
+    def __init__(self, validation_triples, true_triples, nb_entities, model_name='TransE', similarity_name='L1',
+                 interval=10, patience=5, nb_triples=None, nb_candidates=None, seed=1, tie_policy='mean'):
+        """
+        :param validation_triples: List of (s, p, o) validation triples.
+        :param true_triples: FilterIndex or [nb_triples, 3] matrix of true triples, used for the filtered ranks.
+        :param nb_entities: Number of entities.
+        :param model_name: Name of the model, used for scoring directly on the embedding matrices when possible.
+        :param similarity_name: Name of the similarity function.
+        :param interval: The model is evaluated every interval epochs.
+        :param patience: Number of evaluations without improvements after which training should stop
+            (if None, training is never stopped early).
+        :param nb_triples: If provided, size of the random subset of the validation triples used for evaluation.
+        :param nb_candidates: If provided, targets are ranked against this many sampled candidates
+            (see metrics.sampled_ranking_scores) rather than against all entities.
+        :param seed: Seed used for sampling the validation triples and the candidates.
+        :param tie_policy: Tie policy used for computing the ranks (see metrics.compute_ranks).
+        """
+        triples = np.asarray(validation_triples, dtype=np.int64).reshape((-1, 3))
+        if nb_triples is not None and nb_triples < triples.shape[0]:
+            random_state = np.random.RandomState(seed)
+            triples = triples[np.sort(random_state.choice(triples.shape[0], nb_triples, replace=False))]
+
+        self.triples = triples
+        self.filter_index = make_filter_index(true_triples)
+        self.nb_entities = nb_entities
+
+        self.model_name, self.similarity_name = model_name, similarity_name
+        self.interval, self.patience = interval, patience
+        self.nb_candidates, self.seed, self.tie_policy = nb_candidates, seed, tie_policy
+
+        self.best_mrr, self.best_epoch, self.best_weights = None, None, None
+        self.nb_evaluations_without_improvement = 0
+
+    def evaluate(self, model):
+        """
+        Computes the filtered MRR of a model on the validation triples.
+
+        :param model: Keras model.
+        :return: Filtered Mean Reciprocal Rank.
+        """
+        scorer = make_scorer(model, self.nb_entities, model_name=self.model_name, similarity_name=self.similarity_name)
+        if self.nb_candidates is not None:
+            _, filtered_res = metrics.sampled_ranking_scores(scorer, self.triples, nb_candidates=self.nb_candidates,
+                                                             filter_index=self.filter_index, seed=self.seed,
+                                                             tie_policy=self.tie_policy)
+        else:
+            _, filtered_res = metrics.scorer_ranking_scores(scorer, self.triples, filter_index=self.filter_index,
+                                                            tie_policy=self.tie_policy)
+        return metrics.rank_metrics(filtered_res[0] + filtered_res[1])['mrr']
+
+    def __call__(self, model, epoch_no, force=False):
+        """
+        Evaluates the model, if epoch_no is a multiple of the evaluation interval (or if force is True).
+
+        :param model: Keras model.
+        :param epoch_no: Number of the current epoch.
+        :param force: Evaluate the model regardless of the epoch number.
+        :return: True if training should stop, False otherwise.
+        """
+        if force is False and epoch_no % self.interval != 0:
+            return False
+
+        mrr = self.evaluate(model)
+
+        if self.best_mrr is None or mrr > self.best_mrr:
+            self.best_mrr, self.best_epoch, self.best_weights = mrr, epoch_no, model.get_weights()
+            self.nb_evaluations_without_improvement = 0
+        else:
+            self.nb_evaluations_without_improvement += 1
+
+        logging.info('Epoch no. %d - validation filtered MRR: %s (best: %s, epoch no. %d)' %
+                     (epoch_no, round(mrr, 4), round(self.best_mrr, 4), self.best_epoch))
+
+        return self.patience is not None and self.nb_evaluations_without_improvement >= self.patience
+
+    def get_state(self):
+        """
+        Returns the state of the early stopping procedure (best MRR and weights so far, and number of evaluations
+        without improvements), e.g. for checkpointing.
+        """
+        return dict(best_mrr=self.best_mrr, best_epoch=self.best_epoch, best_weights=self.best_weights,
+                    nb_evaluations_without_improvement=self.nb_evaluations_without_improvement)
+
+    def set_state(self, state):
+        """
+        Restores a state returned by get_state.
+        """
+        self.best_mrr, self.best_epoch = state['best_mrr'], state['best_epoch']
+        self.best_weights = state['best_weights']
+        self.nb_evaluations_without_improvement = state['nb_evaluations_without_improvement']
+
+    def restore(self, model):
+        """
+        Sets the weights of the model to the best ones found during training.
+
+        :param model: Keras model.
+        """
+        if self.best_weights is not None:
+            logging.info('Restoring the weights from epoch no. %d (validation filtered MRR: %s)' %
+                         (self.best_epoch, round(self.best_mrr, 4)))
+            model.set_weights(self.best_weights)
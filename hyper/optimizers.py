@@ -1,13 +1,206 @@
 # -*- coding: utf-8 -*-
 
-from keras.optimizers import SGD, Adagrad, Adadelta, RMSprop, Adam, Adamax
+from keras.optimizers import Optimizer, SGD, Adagrad, Adadelta, RMSprop, Adam, Adamax
+from keras import backend as K
+
+import theano.tensor as T
+from theano.gof import graph
 
 import inspect
 import logging
 
 
+def _row_gathers(params, loss):
+    """
+    For each parameter, finds the row gathers (e.g. the lookups of an Embedding layer) reading it in the graph of
+    the loss.
+
+    :param params: List of parameters (Theano shared variables).
+    :param loss: Loss expression.
+    :return: Dictionary mapping each parameter to a list of (gathered rows, row indices) pairs, or to None if the
+        parameter is also used by operations other than row gathers (e.g. a regularizer on the whole matrix).
+    """
+    row_gathers = {p: [] for p in params}
+    for node in graph.io_toposort(graph.inputs([loss]), [loss]):
+        for i, node_input in enumerate(node.inputs):
+            if node_input not in row_gathers or row_gathers[node_input] is None:
+                continue
+            if isinstance(node.op, T.subtensor.AdvancedSubtensor1) and i == 0:
+                row_gathers[node_input] += [(node.outputs[0], node.inputs[1])]
+            else:
+                row_gathers[node_input] = None
+    return {p: gathers if gathers else None for p, gathers in row_gathers.items()}
+
+
+def _row_gradients(loss, gathers):
+    """
+    Computes the gradient of the loss with respect to the rows of a parameter read by the given row gathers.
+
+    :param loss: Loss expression.
+    :param gathers: List of (gathered rows, row indices) pairs.
+    :return: (rows, gradients) pair, where rows is a vector of distinct row indices, and gradients[i] is the
+        gradient of the loss with respect to row rows[i] (summed over all the gathers reading it).
+    """
+    outputs = [output for output, _ in gathers]
+    gradients = T.grad(loss, outputs)
+
+    idxs = T.concatenate([idxs.flatten() for _, idxs in gathers])
+    gradients = T.concatenate([g.reshape((-1, g.shape[-1])) for g in gradients], axis=0)
+
+    # Gradients of rows gathered more than once are summed, so that each row is updated exactly once
+    rows, inverse = T.extra_ops.Unique(return_inverse=True)(idxs)
+    row_gradients = T.inc_subtensor(T.zeros((rows.shape[0], gradients.shape[1]), dtype=gradients.dtype)[inverse],
+                                    gradients)
+    return rows, row_gradients
+
+
+def _get_rows(x, rows):
+    return x if rows is None else x[rows]
+
+
+def _set_rows(x, rows, value):
+    return value if rows is None else T.set_subtensor(x[rows], value)
+
+
+class SparseOptimizer(Optimizer):
+    """
+    Base class of the optimizers that, for parameters only accessed through row gathers in the graph of the loss
+    (e.g. the embedding matrices of Embedding layers), update only the rows read by the current batch, together
+    with their optimizer state (accumulators, moments): the cost of each step scales with the number of rows read
+    rather than with the size of the matrices. All other parameters receive dense updates.
+    """
+    # Number of state variables (e.g. accumulators) for each parameter
+    nb_states = 0
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.iterations = K.variable(0.)
+
+    def step(self, p, g, states):
+        """
+        Computes the new values of (a subset of the rows of) a parameter and of its state variables.
+
+        :param p: Current value of the parameter (or of the updated rows).
+        :param g: Gradient of the loss with respect to p.
+        :param states: List of the current values of the state variables (or of the updated rows).
+        :return: (new value of p, list of new values of the state variables) pair.
+        """
+        raise NotImplementedError
+
+    def get_updates(self, params, constraints, loss):
+        row_gathers = _row_gathers(params, loss)
+
+        dense_params = [p for p in params if row_gathers[p] is None]
+        dense_gradients = dict(zip(dense_params, self.get_gradients(loss, dense_params))) if dense_params else {}
+
+        self.updates = [(self.iterations, self.iterations + 1.)]
+        self.weights = []
+
+        for p in params:
+            states = [K.zeros(K.get_value(p).shape) for _ in range(self.nb_states)]
+            self.weights += states
+
+            if row_gathers[p] is None:
+                rows, g = None, dense_gradients[p]
+            else:
+                rows, g = _row_gradients(loss, row_gathers[p])
+
+            new_p, new_states = self.step(_get_rows(p, rows), g, [_get_rows(s, rows) for s in states])
+
+            self.updates += [(s, _set_rows(s, rows, new_s)) for s, new_s in zip(states, new_states)]
+
+            new_p = _set_rows(p, rows, new_p)
+            if p in constraints:
+                new_p = constraints[p](new_p)
+            self.updates += [(p, new_p)]
+
+        return self.updates
+
+
+class SparseSGD(SparseOptimizer):
+    """
+    Stochastic gradient descent with (optional) momentum; with sparse updates, the velocity of a row is only
+    updated when the row is read by a batch.
+    """
+    nb_states = 1
+
+    def __init__(self, lr=0.01, momentum=0., **kwargs):
+        super().__init__(**kwargs)
+        self.lr, self.momentum = K.variable(lr), K.variable(momentum)
+
+    def step(self, p, g, states):
+        [velocity] = states
+        new_velocity = self.momentum * velocity - self.lr * g
+        return p + new_velocity, [new_velocity]
+
+    def get_config(self):
+        config = {'lr': float(K.get_value(self.lr)), 'momentum': float(K.get_value(self.momentum))}
+        return dict(list(super().get_config().items()) + list(config.items()))
+
+
+class SparseAdagrad(SparseOptimizer):
+    """
+    Adagrad; since rows that are not read by a batch have a null gradient, sparse updates are equivalent to
+    dense ones.
+    """
+    nb_states = 1
+
+    def __init__(self, lr=0.01, epsilon=1e-6, **kwargs):
+        super().__init__(**kwargs)
+        self.lr, self.epsilon = K.variable(lr), epsilon
+
+    def step(self, p, g, states):
+        [accumulator] = states
+        new_accumulator = accumulator + K.square(g)
+        return p - self.lr * g / (K.sqrt(new_accumulator) + self.epsilon), [new_accumulator]
+
+    def get_config(self):
+        config = {'lr': float(K.get_value(self.lr)), 'epsilon': self.epsilon}
+        return dict(list(super().get_config().items()) + list(config.items()))
+
+
+class SparseAdam(SparseOptimizer):
+    """
+    Adam; with sparse updates, the moments of a row are only updated when the row is read by a batch (as in the
+    "lazy" variant of Adam), while the bias correction depends on the global number of steps.
+    """
+    nb_states = 2
+
+    def __init__(self, lr=0.001, beta_1=0.9, beta_2=0.999, epsilon=1e-8, **kwargs):
+        super().__init__(**kwargs)
+        self.lr, self.beta_1, self.beta_2 = K.variable(lr), K.variable(beta_1), K.variable(beta_2)
+        self.epsilon = epsilon
+
+    def step(self, p, g, states):
+        m, v = states
+        t = self.iterations + 1.
+        lr_t = self.lr * K.sqrt(1. - K.pow(self.beta_2, t)) / (1. - K.pow(self.beta_1, t))
+
+        new_m = (self.beta_1 * m) + (1. - self.beta_1) * g
+        new_v = (self.beta_2 * v) + (1. - self.beta_2) * K.square(g)
+        return p - lr_t * new_m / (K.sqrt(new_v) + self.epsilon), [new_m, new_v]
+
+    def get_config(self):
+        config = {'lr': float(K.get_value(self.lr)), 'beta_1': float(K.get_value(self.beta_1)),
+                  'beta_2': float(K.get_value(self.beta_2)), 'epsilon': self.epsilon}
+        return dict(list(super().get_config().items()) + list(config.items()))
+
+
+def updates_only_read_rows(optimizer):
+    """
+    Checks whether an optimizer leaves unchanged the rows of the embedding matrices that are not read by a batch
+    (and thus have a null gradient), so that constraints only need to be applied to the rows read by the batch.
+
+    :param optimizer: Keras Optimizer.
+    :return: True if only the rows read by each batch are updated, False otherwise.
+    """
+    if isinstance(optimizer, (SparseOptimizer, Adagrad)):
+        return True
+    return isinstance(optimizer, SGD) and float(K.get_value(optimizer.momentum)) == 0.
+
+
 def make_optimizer(optimizer_name, lr=0.01, momentum=0., decay=0., nesterov=False, epsilon=1e-6, rho=0.95,
-                   beta_1=0.9, beta_2=0.999):
+                   beta_1=0.9, beta_2=0.999, sparse=False):
     """
     Returns a Keras Optimizer.
     :param optimizer_name: Name of the optimizer - sgd, adagrad, adadelta, rmsprop, adam.
@@ -19,6 +212,8 @@ def make_optimizer(optimizer_name, lr=0.01, momentum=0., decay=0., nesterov=Fals
     :param rho: rho (used by adadelta, rmsprop).
     :param beta_1: beta_1 (used by adam and adamax).
     :param beta_2: beta_2 (used by adam and adamax).
+    :param sparse: whether to update only the rows of the embedding matrices read by each batch (supported by
+        sgd, without decay and Nesterov momentum, adagrad and adam).
     :return: a Keras Optimizer.
     """
 
@@ -27,7 +222,17 @@ def make_optimizer(optimizer_name, lr=0.01, momentum=0., decay=0., nesterov=Fals
 
     optimizer = None
 
-    if optimizer_name == 'sgd':
+    if sparse is True:
+        if optimizer_name == 'sgd' and decay == 0. and nesterov is False:
+            optimizer = SparseSGD(lr=lr, momentum=momentum)
+        elif optimizer_name == 'adagrad':
+            optimizer = SparseAdagrad(lr=lr, epsilon=epsilon)
+        elif optimizer_name == 'adam':
+            optimizer = SparseAdam(lr=lr, beta_1=beta_1, beta_2=beta_2, epsilon=epsilon)
+
+        if optimizer is None:
+            raise ValueError('Sparse updates are not supported by the optimizer: %s' % optimizer_name)
+    elif optimizer_name == 'sgd':
         optimizer = SGD(lr=lr, momentum=momentum, decay=decay, nesterov=nesterov)
     elif optimizer_name == 'adagrad':
         optimizer = Adagrad(lr=lr, epsilon=epsilon)
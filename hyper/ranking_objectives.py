@@ -5,6 +5,18 @@ from keras import backend as K
 from hyper import objectives
 
 
+def _score_differences(y_true, y_pred, nb_sample_sets):
+    # Scores of the positive and negative examples are interleaved, so that reshaping them in a
+    # [nb_positives, nb_sample_sets] matrix yields one positive example followed by its negatives per row
+    scores = K.reshape(y_pred, (-1, nb_sample_sets))
+    targets = K.reshape(y_true, (-1, nb_sample_sets))
+
+    # [nb_positives * (nb_sample_sets - 1), 1] matrix of positive_score - negative_score differences; the
+    # positive scores are broadcast along an explicit new axis, since Theano does not broadcast scores[:, :1]
+    diff = K.reshape(K.expand_dims(scores[:, 0], 1) - scores[:, 1:], (-1, 1))
+    return diff, targets[:, 0]
+
+
 def margin_based_loss(y_true, y_pred, nb_sample_sets=3, *args, **kwargs):
     """
     Margin-based Ranking Loss.
@@ -19,14 +31,10 @@ def margin_based_loss(y_true, y_pred, nb_sample_sets=3, *args, **kwargs):
     :param kwargs: Various.
     :return: Loss.
     """
-    positive_scores, target, loss = y_pred[0::nb_sample_sets], y_true[0::nb_sample_sets], .0
+    diff, target = _score_differences(y_true, y_pred, nb_sample_sets)
 
-    for j in range(1, nb_sample_sets):
-        negative_scores = y_pred[j::nb_sample_sets]
-
-        # loss = max{margin - 1 (positive_scores - negative_scores), 0}
-        diff = positive_scores - negative_scores
-        loss += K.sum(objectives.hinge_loss(1, diff, *args, **kwargs))
+    # loss = max{margin - 1 (positive_scores - negative_scores), 0}
+    loss = K.sum(objectives.hinge_loss(1, diff, *args, **kwargs))
 
     return loss + K.sum(target)
 
@@ -45,14 +53,10 @@ def logistic_loss(y_true, y_pred, nb_sample_sets=3, *args, **kwargs):
     :param kwargs: Various.
     :return: Loss.
     """
-    positive_scores, target, loss = y_pred[0::nb_sample_sets], y_true[0::nb_sample_sets], .0
-
-    for j in range(1, nb_sample_sets):
-        negative_scores = y_pred[j::nb_sample_sets]
+    diff, target = _score_differences(y_true, y_pred, nb_sample_sets)
 
-        # loss = log(1 + exp(- (positive_scores - negative_scores)))
-        diff = positive_scores - negative_scores
-        loss += K.sum(objectives.logistic_loss(1, diff))
+    # loss = log(1 + exp(- (positive_scores - negative_scores)))
+    loss = K.sum(objectives.logistic_loss(1, diff))
 
     return loss + K.sum(target)
 
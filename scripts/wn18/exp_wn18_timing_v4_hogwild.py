@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import os
+import os.path
+
+
+def cartesian_product(dicts):
+    return (dict(zip(dicts, x)) for x in itertools.product(*dicts.values()))
+
+
+def summary(configuration):
+    kvs = sorted([(k, v) for k, v in configuration.items()], key=lambda e: e[0])
+    return '_'.join([('%s=%s' % (k, v)) for (k, v) in kvs])
+
+
+def to_command(c):
+    command = "PYTHONPATH=. ./bin/hyper-cli.py" \
+              " --train data/wn18/wordnet-mlj12-train.txt" \
+              " --epochs %s" \
+              " --optimizer %s" \
+              " --lr %s" \
+              " --batches %s" \
+              " --model %s" \
+              " --similarity %s" \
+              " --margin %s" \
+              " --entity-embedding-size %s" \
+              " --hogwild-workers %s" \
+              % (c['epochs'], c['optimizer'], c['lr'], c['batches'], c['model'], c['similarity'], c['margin'],
+                 c['embedding_size'], c['workers'])
+    return command
+
+
+def to_logfile(c, dir):
+    outfile = "%s/exp_wn18_timing_v4_hogwild.%s.log" % (dir, summary(c))
+    return outfile
+
+
+# Scaling of Hogwild training with the number of worker processes: the 'Throughput' log lines report the number
+# of training triples processed per second
+hyperparameters_space = dict(
+    epochs=[10],
+    optimizer=['adagrad'],
+    lr=[.1],
+    batches=[100, 1000, 10000],
+    model=['DistMult', 'ComplEx'],
+    similarity=['dot'],
+    margin=[1],
+    embedding_size=[20, 100],
+    workers=[1, 2, 4, 8, 16, 32]
+)
+
+configurations = cartesian_product(hyperparameters_space)
+
+dir = 'logs/exp_wn18_timing_v4_hogwild/'
+
+for c in configurations:
+    logfile = to_logfile(c, dir)
+
+    completed = False
+    if os.path.isfile(logfile):
+        with open(logfile, 'r') as f:
+            content = f.read()
+            completed = 'Training duration' in content
+
+    if not completed:
+        line = '%s >> %s 2>&1' % (to_command(c), logfile)
+        print(line)
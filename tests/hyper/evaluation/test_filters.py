@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from hyper.evaluation.filters import FilterIndex
+
+import unittest
+
+
+class TestFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_filter_index(self):
+        true_triples = np.array([[1, 1, 3], [3, 1, 1], [1, 1, 1], [1, 2, 2], [1, 1, 3]])
+        filter_index = FilterIndex(true_triples)
+
+        self.assertEqual(filter_index.objects(1, 1).tolist(), [1, 3])
+        self.assertEqual(filter_index.objects(1, 2).tolist(), [2])
+        self.assertEqual(filter_index.subjects(1, 1).tolist(), [1, 3])
+        self.assertEqual(filter_index.subjects(2, 2).tolist(), [1])
+
+        self.assertEqual(filter_index.objects(2, 1).tolist(), [])
+        self.assertEqual(filter_index.subjects(3, 1).tolist(), [])
+        self.assertEqual(filter_index.objects(100, 100).tolist(), [])
+
+        empty_index = FilterIndex(np.empty((0, 3)))
+        self.assertEqual(empty_index.objects(1, 1).tolist(), [])
+        self.assertEqual(empty_index.subjects(1, 1).tolist(), [])
+
+    def test_filter_index_random(self):
+        for _ in range(16):
+            true_triples = self.rs.randint(1, 8, size=(64, 3))
+            filter_index = FilterIndex(true_triples)
+
+            for s, p, o in self.rs.randint(1, 9, size=(32, 3)):
+                objects = sorted(set(true_triples[(true_triples[:, 0] == s) & (true_triples[:, 1] == p), 2]))
+                subjects = sorted(set(true_triples[(true_triples[:, 1] == p) & (true_triples[:, 2] == o), 0]))
+                self.assertEqual(filter_index.objects(s, p).tolist(), objects)
+                self.assertEqual(filter_index.subjects(p, o).tolist(), subjects)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,12 @@
 
 import numpy as np
 from hyper.evaluation import metrics
+from hyper.evaluation.filters import FilterIndex
+from hyper.evaluation.scoring import EmbeddingScorer, FunctionScorer
+from hyper.io import ResultsSink, read_results
 
+import os
+import tempfile
 import unittest
 
 
@@ -37,7 +42,28 @@ def scoring_function(args):
 class TestMetrics(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.rs = np.random.RandomState(1)
+
+    def test_compute_ranks(self):
+        scores = np.array([[1., 3., 3., 2., 3.],
+                           [1., 3., 3., 2., 3.],
+                           [- np.inf, 0., 0., - np.inf, 1.]])
+        target_idxs = np.array([1, 3, 2])
+
+        self.assertEqual(metrics.compute_ranks(scores, target_idxs, 'optimistic').tolist(), [1, 4, 2])
+        self.assertEqual(metrics.compute_ranks(scores, target_idxs, 'pessimistic').tolist(), [3, 4, 3])
+        self.assertEqual(metrics.compute_ranks(scores, target_idxs, 'mean').tolist(), [2., 4., 2.5])
+
+        self.assertEqual(metrics.compute_ranks(scores[0], 0).tolist(), [5])
+
+        for _ in range(16):
+            scores = self.rs.rand(8, 32)
+            target_idxs = self.rs.randint(0, 32, size=8)
+            expected = [np.argsort(np.argsort(- row))[idx] + 1 for row, idx in zip(scores, target_idxs)]
+            self.assertEqual(metrics.compute_ranks(scores, target_idxs).tolist(), expected)
+
+        with self.assertRaises(ValueError):
+            metrics.compute_ranks(scores, target_idxs, 'random')
 
     def test_ranking_score(self):
         true_triples = np.empty((0, 3))
@@ -85,6 +111,184 @@ class TestMetrics(unittest.TestCase):
         err_subj, err_obj = metrics.filtered_ranking_score(scoring_function, [(1, 1, 1)], 4, 4, true_triples)
         self.assertTrue(err_subj[0] == 1 and err_obj[0] == 2)
 
+    def test_filtered_ranking_score_index(self):
+        filter_index = FilterIndex(np.array([[1, 1, 3], [3, 1, 1]]))
+        triples = [(1, 1, 1), (1, 1, 2), (2, 1, 1)]
+
+        err_subj, err_obj = metrics.filtered_ranking_score(scoring_function, triples, 4, 4, filter_index)
+        self.assertEqual((list(err_subj), list(err_obj)), ([1, 1, 2], [2, 1, 3]))
+
+        err_subj, err_obj = metrics.filtered_ranking_score_fast(scoring_function, triples, 4, 4, filter_index)
+        self.assertEqual((list(err_subj), list(err_obj)), ([1, 1, 2], [2, 1, 3]))
+
+    def test_fast_ranking_score_chunks(self):
+        triples = [(1, 1, 1), (1, 1, 2), (2, 1, 1), (3, 1, 2), (4, 1, 3)]
+        true_triples = np.array([[1, 1, 3], [3, 1, 1]])
+
+        expected = metrics.ranking_score(scoring_function, triples, 4, 4)
+        expected_filtered = metrics.filtered_ranking_score(scoring_function, triples, 4, 4, true_triples)
+
+        # A budget of 1e-4 MB only fits a single triple per chunk
+        for memory_budget_mb in [None, 1e-4, 1e-3]:
+            res = metrics.ranking_score_fast(scoring_function, triples, 4, 4, memory_budget_mb=memory_budget_mb)
+            self.assertEqual([list(r) for r in res], [list(r) for r in expected])
+
+            res = metrics.filtered_ranking_score_fast(scoring_function, triples, 4, 4, true_triples,
+                                                      memory_budget_mb=memory_budget_mb)
+            self.assertEqual([list(r) for r in res], [list(r) for r in expected_filtered])
+
+    def test_scorer_ranking_score(self):
+        scorer = FunctionScorer(scoring_function, 4)
+        triples = [(1, 1, 1), (1, 1, 2), (2, 1, 1)]
+
+        err_subj, err_obj = metrics.scorer_ranking_score(scorer, triples, batch_size=2)
+        self.assertEqual((list(err_subj), list(err_obj)), ([2, 1, 3], [3, 2, 3]))
+
+        true_triples = np.array([[1, 1, 3], [3, 1, 1]])
+        err_subj, err_obj = metrics.scorer_ranking_score(scorer, triples, true_triples=true_triples, batch_size=2)
+        self.assertEqual((list(err_subj), list(err_obj)), ([1, 1, 2], [2, 1, 3]))
+
+    def test_scorer_ranking_scores_dedup(self):
+        nb_entities = 6
+
+        def random_scoring_function(args):
+            Xr, Xe = args
+            return np.sin(Xr[:, 0] * 7 + Xe[:, 0] * 3 + Xe[:, 1] * 5)
+
+        # Few predicates and entities, so that many triples share their (s, p) and (p, o) patterns
+        triples = np.column_stack([self.rs.randint(1, 4, size=50), self.rs.randint(1, 3, size=50),
+                                   self.rs.randint(1, 4, size=50)])
+        true_triples = np.concatenate([triples, [[4, 1, 5], [5, 2, 6]]])
+
+        scorer, stats = FunctionScorer(random_scoring_function, nb_entities), {}
+        res, filtered_res = metrics.scorer_ranking_scores(scorer, triples, filter_index=true_triples,
+                                                          batch_size=4, stats=stats)
+
+        self.assertEqual(res, metrics.ranking_score(random_scoring_function, triples, nb_entities, nb_entities))
+        self.assertEqual(filtered_res, metrics.filtered_ranking_score(random_scoring_function, triples,
+                                                                      nb_entities, nb_entities, true_triples))
+
+        nb_patterns = len({(p, o) for _, p, o in triples}) + len({(s, p) for s, p, _ in triples})
+        self.assertEqual(stats, dict(queries=100, scored_queries=nb_patterns))
+
+    def test_rank_metrics(self):
+        ranks = self.rs.randint(1, 20, size=100)
+        res = metrics.rank_metrics(ranks, hits_at=[1, 3, 10])
+
+        self.assertAlmostEqual(res['mr'], np.mean(ranks))
+        self.assertAlmostEqual(res['median'], np.median(ranks))
+        self.assertAlmostEqual(res['mrr'], np.mean(1. / ranks))
+        for k in [1, 3, 10]:
+            self.assertAlmostEqual(res['hits@%d' % k], np.mean(ranks <= k) * 100)
+
+    def test_ranking_summary_sink(self):
+        res = ([1, 2, 4, 10], [1, 1, 3, 20])
+
+        with tempfile.TemporaryDirectory() as path:
+            results_path = os.path.join(path, 'results.jsonl')
+
+            with ResultsSink(results_path, config={'model': 'TransE'}) as sink:
+                dres = metrics.ranking_summary(res, tag='test raw', n=[1, 3, 5, 10], sink=sink,
+                                               record={'split': 'test', 'setting': 'raw'}, tie_policy='mean')
+                metrics.ranking_summary(res, tag='test raw', n=10, sink=sink)
+
+            records = read_results(results_path)
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['config'], {'model': 'TransE'})
+        self.assertEqual((records[0]['split'], records[0]['setting']), ('test', 'raw'))
+        self.assertEqual(records[0]['tie_policy'], 'mean')
+        self.assertNotIn('tie_policy', records[1])
+        self.assertEqual(records[0]['left']['hits@3'], 50.)
+        self.assertEqual(records[0]['global']['hits@10'], 87.5)
+        self.assertEqual(records[1]['right']['hits@10'], 75.)
+
+        self.assertEqual(dres['microlhits@1'], 25.)
+        self.assertEqual(dres['microghits@n'], 87.5)
+        self.assertAlmostEqual(dres['micrormrr'], np.mean(1. / np.array(res[1])))
+
+    def test_candidate_strata(self):
+        strata, allocation = metrics.candidate_strata(10, 5)
+        self.assertEqual([stratum.tolist() for stratum in strata], [list(range(1, 11))])
+        self.assertEqual(allocation.tolist(), [5])
+
+        frequencies = np.array([5, 1, 9, 3, 7, 2, 8, 0])
+        strata, allocation = metrics.candidate_strata(8, 8, entity_frequencies=frequencies, nb_strata=2)
+        self.assertEqual([stratum.tolist() for stratum in strata], [[8, 2, 6, 4], [1, 5, 7, 3]])
+        self.assertEqual(allocation.tolist(), [4, 4])
+
+    def test_sampled_ranking_scores(self):
+        nb_entities, nb_predicates = 200, 3
+        scorer = EmbeddingScorer(self.rs.randn(nb_entities + 1, 10), self.rs.randn(nb_predicates + 1, 10),
+                                 model_name='DistMult', similarity_name='dot')
+
+        triples = np.column_stack([self.rs.randint(1, nb_entities + 1, size=100),
+                                   self.rs.randint(1, nb_predicates + 1, size=100),
+                                   self.rs.randint(1, nb_entities + 1, size=100)])
+        frequencies = self.rs.randint(0, 100, size=nb_entities)
+
+        res, filtered_res = metrics.scorer_ranking_scores(scorer, triples, filter_index=triples)
+
+        for entity_frequencies in [None, frequencies]:
+            kwargs = dict(nb_candidates=100, filter_index=triples, entity_frequencies=entity_frequencies, seed=2)
+            sampled_res, sampled_filtered_res = metrics.sampled_ranking_scores(scorer, triples, **kwargs)
+
+            # Candidates are drawn with a fixed seed
+            self.assertEqual((sampled_res, sampled_filtered_res),
+                             metrics.sampled_ranking_scores(scorer, triples, batch_size=7, **kwargs))
+
+            self.assertTrue(all(f <= r for f, r in zip(sampled_filtered_res[0], sampled_res[0])))
+
+            # Estimated mean ranks are close to the exact ones
+            self.assertLess(abs(np.mean(sampled_res[0]) - np.mean(res[0])), 10.)
+            self.assertLess(abs(np.mean(sampled_filtered_res[1]) - np.mean(filtered_res[1])), 10.)
+
+    def test_bootstrap_rank_metrics(self):
+        ranks = self.rs.randint(1, 20, size=500)
+        point_estimates = metrics.rank_metrics(ranks)
+        intervals = metrics.bootstrap_rank_metrics(ranks, nb_samples=200)
+
+        for name, (lower, upper) in intervals.items():
+            self.assertLessEqual(lower, point_estimates[name])
+            self.assertLessEqual(point_estimates[name], upper)
+
+        self.assertEqual(intervals, metrics.bootstrap_rank_metrics(ranks, nb_samples=200))
+
+        # Without ranks, all the intervals are undefined
+        intervals = metrics.bootstrap_rank_metrics([], hits_at=[1, 10])
+        self.assertEqual(sorted(intervals), ['hits@1', 'hits@10', 'mr', 'mrr'])
+        self.assertTrue(all(np.isnan(lower) and np.isnan(upper) for lower, upper in intervals.values()))
+
+    def test_relation_metrics(self):
+        idxo = self.rs.randint(1, 6, size=200)
+        res = (self.rs.randint(1, 30, size=200).tolist(), self.rs.randint(1, 30, size=200).tolist())
+
+        table = metrics.relation_metrics(res, idxo, hits_at=[1, 10])
+        self.assertEqual(table['relations'].tolist(), sorted(set(idxo)))
+
+        for i, relation in enumerate(table['relations']):
+            left, right = np.asarray(res[0])[idxo == relation], np.asarray(res[1])[idxo == relation]
+            both = np.concatenate([left, right])
+
+            self.assertEqual(table['count'][i], left.shape[0])
+            for side, ranks in [('l', left), ('r', right), ('g', both)]:
+                self.assertAlmostEqual(table['%smean' % side][i], np.mean(ranks))
+                self.assertAlmostEqual(table['%smedian' % side][i], np.median(ranks))
+                self.assertAlmostEqual(table['%smrr' % side][i], np.mean(1. / ranks))
+                self.assertAlmostEqual(table['%shits@10' % side][i], np.mean(ranks <= 10) * 100)
+
+        dres = metrics.ranking_summary(res, idxo=idxo, n=[1, 10])
+        self.assertAlmostEqual(dres['macrolmean'], np.mean(table['lmean']))
+        self.assertAlmostEqual(dres['macroghits@n'], np.mean(table['ghits@10']))
+
+        for i, relation in enumerate(table['relations'].tolist()):
+            left, right = np.asarray(res[0])[idxo == relation], np.asarray(res[1])[idxo == relation]
+            self.assertEqual(dres['dictrelres'][relation], [left.tolist(), right.tolist()])
+            self.assertAlmostEqual(dres['dictrellmean'][relation], table['lmean'][i])
+            self.assertAlmostEqual(dres['dictrelrmedian'][relation], table['rmedian'][i])
+            self.assertAlmostEqual(dres['dictrelgrn'][relation], table['ghits@10'][i])
+        self.assertAlmostEqual(dres['macrorhits@1'], np.mean(table['rhits@1']))
+
 
 if __name__ == '__main__':
     unittest.main()
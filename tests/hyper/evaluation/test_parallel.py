@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from hyper.evaluation import metrics, parallel
+from hyper.evaluation.filters import FilterIndex
+from hyper.evaluation.scoring import EmbeddingScorer
+
+import unittest
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_parallel_ranking_scores(self):
+        nb_entities, nb_predicates, embedding_size = 64, 4, 8
+
+        entity_embeddings = self.rs.randn(nb_entities + 1, embedding_size)
+        predicate_embeddings = self.rs.randn(nb_predicates + 1, embedding_size)
+        scorer = EmbeddingScorer(entity_embeddings, predicate_embeddings, model_name='TransE', similarity_name='L1')
+
+        triples = np.column_stack([self.rs.randint(1, nb_entities + 1, size=37),
+                                   self.rs.randint(1, nb_predicates + 1, size=37),
+                                   self.rs.randint(1, nb_entities + 1, size=37)])
+        filter_index = FilterIndex(triples)
+
+        expected_res = metrics.scorer_ranking_score(scorer, triples)
+        expected_filtered_res = metrics.scorer_ranking_score(scorer, triples, true_triples=filter_index)
+
+        for nb_workers in [1, 3]:
+            stats = {}
+            res, filtered_res = parallel.parallel_ranking_scores(scorer, triples, filter_index=filter_index,
+                                                                 nb_workers=nb_workers, batch_size=5, stats=stats)
+            self.assertEqual(res, expected_res)
+            self.assertEqual(filtered_res, expected_filtered_res)
+            self.assertEqual(stats['queries'], 2 * triples.shape[0])
+            self.assertLessEqual(stats['scored_queries'], stats['queries'])
+
+        res, filtered_res = parallel.parallel_ranking_scores(scorer, triples, nb_workers=2)
+        self.assertEqual(res, expected_res)
+        self.assertIsNone(filtered_res)
+
+
+if __name__ == '__main__':
+    unittest.main()
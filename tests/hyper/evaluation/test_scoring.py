@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from hyper.evaluation import scoring
+
+import unittest
+
+
+class TestScoring(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_circular_cross_correlation(self):
+        for _ in range(16):
+            x, y = self.rs.randn(7), self.rs.randn(7)
+            expected = np.array([sum(x[j] * y[(i + j) % 7] for j in range(7)) for i in range(7)])
+            self.assertTrue(np.allclose(scoring.circular_cross_correlation(x, y), expected))
+
+    def test_scorer(self):
+        n, nb_entities, nb_predicates = 4, 16, 3
+        predicate_embedding_sizes = dict(
+            TransE=n, DualTransE=2 * n, ComplEx=n, DistMult=n, DualScalE=2 * n, ScalTransE=2 * n, HolE=n,
+            DAffinE=2 * n, ConcatE=2 * n, RESCAL=n ** 2, DualRESCAL=2 * (n ** 2), AffinE=(n ** 2) + n,
+            ManifoldESphere=n + 1, ManifoldEHyperplane=(2 * n) + 1)
+
+        entity_embeddings = self.rs.randn(nb_entities + 1, n)
+        all_entities = np.arange(1, nb_entities + 1)
+
+        for model_name, predicate_embedding_size in predicate_embedding_sizes.items():
+            predicate_embeddings = self.rs.randn(nb_predicates + 1, predicate_embedding_size)
+
+            for similarity_name in ['dot', 'L1', 'L2', 'l2sqr', 'cosine']:
+                scorer = scoring.EmbeddingScorer(entity_embeddings, predicate_embeddings,
+                                                 model_name=model_name, similarity_name=similarity_name)
+
+                triples = self.rs.randint(1, nb_predicates + 1, size=(8, 3))
+                triples[:, [0, 2]] = self.rs.randint(1, nb_entities + 1, size=(8, 2))
+                subj_idxs, pred_idxs, obj_idxs = triples[:, 0], triples[:, 1], triples[:, 2]
+
+                scores_right = scorer.score_objects(subj_idxs, pred_idxs)
+                scores_left = scorer.score_subjects(pred_idxs, obj_idxs)
+
+                for i, (s, p, o) in enumerate(triples):
+                    Xr = np.full((nb_entities, 1), p)
+
+                    Xe = np.column_stack([np.full(nb_entities, s), all_entities])
+                    self.assertTrue(np.allclose(scores_right[i, :], scorer([Xr, Xe])))
+
+                    Xe = np.column_stack([all_entities, np.full(nb_entities, o)])
+                    self.assertTrue(np.allclose(scores_left[i, :], scorer([Xr, Xe])))
+
+                # Scores restricted to a subset of the candidates
+                candidate_idxs = self.rs.choice(all_entities, 5, replace=False)
+                self.assertTrue(np.allclose(scorer.score_objects(subj_idxs, pred_idxs, candidate_idxs=candidate_idxs),
+                                            scores_right[:, candidate_idxs - 1]))
+                self.assertTrue(np.allclose(scorer.score_subjects(pred_idxs, obj_idxs, candidate_idxs=candidate_idxs),
+                                            scores_left[:, candidate_idxs - 1]))
+
+    def test_unsupported(self):
+        self.assertFalse(scoring.EmbeddingScorer.is_supported('ER-MLP', 'dot'))
+        self.assertFalse(scoring.EmbeddingScorer.is_supported('TransE', None))
+        self.assertTrue(scoring.EmbeddingScorer.is_supported('TransE', 'L1'))
+        with self.assertRaises(ValueError):
+            scoring.EmbeddingScorer(np.zeros((2, 2)), np.zeros((2, 2)), model_name='LSTM', similarity_name='dot')
+
+
+if __name__ == '__main__':
+    unittest.main()
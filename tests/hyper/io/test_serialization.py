@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.io.serialization import save_checkpoint, load_checkpoint, CheckpointWriter
+
+import os
+import tempfile
+import unittest
+
+
+class TestSerialization(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.p')
+
+            state = dict(epoch_no=3, weights=[self.rs.randn(4, 2)], random_state=self.rs.get_state())
+            save_checkpoint(path, state)
+
+            loaded_state = load_checkpoint(path)
+            self.assertEqual(loaded_state['epoch_no'], 3)
+            self.assertTrue(np.array_equal(loaded_state['weights'][0], state['weights'][0]))
+
+            # The random state continues where it was saved
+            random_state = np.random.RandomState()
+            random_state.set_state(loaded_state['random_state'])
+            self.assertTrue(np.array_equal(random_state.randn(5), self.rs.randn(5)))
+
+            # No temporary files are left behind
+            self.assertEqual(os.listdir(directory), ['checkpoint.p'])
+
+    def test_checkpoint_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.p')
+
+            writer = CheckpointWriter(path)
+            for epoch_no in range(1, 11):
+                writer(dict(epoch_no=epoch_no))
+            writer.close()
+
+            # The last checkpoint is always written
+            self.assertEqual(load_checkpoint(path)['epoch_no'], 10)
+            self.assertFalse(writer.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from hyper.learning.batches import BatchAssembler
+
+import unittest
+
+
+class TestBatchAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_batch_assembler(self):
+        nb_samples, nb_sample_sets = 37, 3
+
+        samples_sets = [(self.rs.randint(0, 100, size=(nb_samples, 1)), self.rs.randint(0, 100, size=(nb_samples, 2)))
+                        for _ in range(nb_sample_sets)]
+
+        batch_assembler = BatchAssembler(nb_sample_sets=nb_sample_sets)
+
+        for _ in range(2):
+            batch_assembler.set_samples(samples_sets)
+            order = self.rs.permutation(nb_samples)
+
+            for batch_start in range(0, nb_samples, 10):
+                sample_idxs = order[batch_start:batch_start + 10]
+                Xr_batch, Xe_batch = batch_assembler(sample_idxs)
+
+                self.assertEqual(Xr_batch.dtype, np.int32)
+                self.assertEqual(Xe_batch.shape, (sample_idxs.shape[0] * nb_sample_sets, 2))
+
+                # Strided interleaving of the (shuffled) sets of samples
+                for i, (Xr, Xe) in enumerate(samples_sets):
+                    self.assertTrue(np.array_equal(Xr_batch[i::nb_sample_sets], Xr[sample_idxs]))
+                    self.assertTrue(np.array_equal(Xe_batch[i::nb_sample_sets], Xe[sample_idxs]))
+
+        with self.assertRaises(ValueError):
+            batch_assembler.set_samples(samples_sets[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
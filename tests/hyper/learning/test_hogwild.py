@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.learning import hogwild
+from hyper.evaluation.scoring import merge_functions, similarities
+
+import unittest
+
+
+class TestHogwild(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_score_gradients(self):
+        for model_name, similarity_names in hogwild.HOGWILD_MODELS.items():
+            for similarity_name in similarity_names:
+                s, p, o = self.rs.randn(3, 4, 6)
+
+                def score(args):
+                    return np.sum(merge_functions[model_name](*args, similarities[similarity_name]))
+
+                gradients = hogwild.score_gradients(model_name, similarity_name, s, p, o)
+
+                # Central finite differences
+                for i, gradient in enumerate(gradients):
+                    numerical_gradient = np.zeros(gradient.shape)
+                    for idx in np.ndindex(gradient.shape):
+                        args_plus, args_minus = [s.copy(), p.copy(), o.copy()], [s.copy(), p.copy(), o.copy()]
+                        args_plus[i][idx] += 1e-6
+                        args_minus[i][idx] -= 1e-6
+                        numerical_gradient[idx] = (score(args_plus) - score(args_minus)) / 2e-6
+                    self.assertTrue(np.allclose(gradient, numerical_gradient, atol=1e-4))
+
+    def test_sum_rows(self):
+        idxs = np.array([3, 1, 3, 2, 1, 3])
+        gradients = self.rs.randn(6, 2)
+
+        rows, row_gradients = hogwild.sum_rows(idxs, gradients)
+
+        self.assertEqual(rows.tolist(), [1, 2, 3])
+        for row, row_gradient in zip(rows, row_gradients):
+            self.assertTrue(np.allclose(row_gradient, np.sum(gradients[idxs == row], axis=0)))
+
+    def test_hogwild_training(self):
+        nb_entities, nb_predicates = 50, 3
+        train_sequences = [(int(self.rs.randint(1, nb_predicates + 1)),
+                            [int(self.rs.randint(1, nb_entities + 1)), int(self.rs.randint(1, nb_entities + 1))])
+                           for _ in range(200)]
+
+        kwargs = dict(train_sequences=train_sequences, nb_entities=nb_entities, nb_predicates=nb_predicates,
+                      entity_embedding_size=5, model_name='ComplEx', similarity_name='dot', nb_epochs=2,
+                      batch_size=16)
+
+        entity_embeddings, predicate_embeddings = hogwild.hogwild_training(nb_workers=1, **kwargs)
+        self.assertEqual(entity_embeddings.shape, (nb_entities + 1, 10))
+        self.assertEqual(predicate_embeddings.shape, (nb_predicates + 1, 10))
+        self.assertTrue(np.allclose(np.linalg.norm(entity_embeddings, axis=1), 1.))
+
+        # With a single worker, training is deterministic
+        other_entity_embeddings, _ = hogwild.hogwild_training(nb_workers=1, **kwargs)
+        self.assertTrue(np.array_equal(entity_embeddings, other_entity_embeddings))
+
+        entity_embeddings, predicate_embeddings = hogwild.hogwild_training(nb_workers=2, **kwargs)
+        self.assertTrue(np.all(np.isfinite(entity_embeddings)) and np.all(np.isfinite(predicate_embeddings)))
+        self.assertTrue(np.allclose(np.linalg.norm(entity_embeddings, axis=1), 1.))
+
+        with self.assertRaises(ValueError):
+            hogwild.hogwild_training(train_sequences, nb_entities, nb_predicates, model_name='HolE')
+
+        # Unsupported generators of negative examples are rejected before starting the worker pool
+        for negatives_name in ['bernoulli', 'schema', 'hard']:
+            with self.assertRaises(ValueError):
+                hogwild.hogwild_training(nb_workers=2, **dict(kwargs, negatives_name=negatives_name))
+        with self.assertRaises(ValueError):
+            hogwild.hogwild_training(nb_workers=2, **dict(kwargs, negatives_sampler='zipf'))
+
+
+if __name__ == '__main__':
+    unittest.main()
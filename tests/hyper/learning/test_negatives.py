@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.learning import samples, negatives, util
+from hyper.evaluation import scoring
+
+import unittest
+
+
+class TestNegatives(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+        nb_samples, self.nb_entities = 40, 30
+        self.Xr = self.rs.randint(1, 4, size=(nb_samples, 1))
+        self.Xe = self.rs.randint(1, self.nb_entities + 1, size=(nb_samples, 2))
+        self.candidate_indices = np.arange(1, self.nb_entities + 1)
+
+    def check_corruptions(self, sample_sets, corrupted_columns):
+        for (negative_Xr, negative_Xe), column in zip(sample_sets, corrupted_columns):
+            self.assertTrue(np.array_equal(negative_Xr, self.Xr))
+            self.assertEqual(negative_Xe.shape, self.Xe.shape)
+            if column is not None:
+                # Only the corrupted column can differ from the positive examples
+                self.assertTrue(np.array_equal(negative_Xe[:, 1 - column], self.Xe[:, 1 - column]))
+            else:
+                self.assertTrue(np.all(np.sum(negative_Xe != self.Xe, axis=1) <= 1))
+            self.assertTrue(np.all(np.isin(negative_Xe, self.candidate_indices)))
+
+    def test_negatives_per_positive(self):
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=self.rs)
+
+        for nb_negatives in [1, 3]:
+            generator = negatives.CorruptedSamplesGenerator(
+                subject_index_generator=index_generator, subject_candidate_indices=self.candidate_indices,
+                object_index_generator=index_generator, object_candidate_indices=self.candidate_indices,
+                nb_negatives=nb_negatives)
+
+            sample_sets = generator(self.Xr, self.Xe)
+            self.assertEqual(len(sample_sets), generator.nb_sample_sets)
+            self.assertEqual(generator.nb_sample_sets, 2 * nb_negatives)
+            self.check_corruptions(sample_sets, [0] * nb_negatives + [1] * nb_negatives)
+
+            generator = negatives.LCWANegativeSamplesGenerator(
+                object_index_generator=index_generator, object_candidate_indices=self.candidate_indices,
+                nb_negatives=nb_negatives)
+
+            sample_sets = generator(self.Xr, self.Xe)
+            self.assertEqual(len(sample_sets), nb_negatives)
+            self.check_corruptions(sample_sets, [1] * nb_negatives)
+
+            predicate2type = {1: util.PredicateType.one_to_many, 2: util.PredicateType.many_to_one,
+                              3: util.PredicateType.many_to_many}
+            generator = negatives.SchemaAwareNegativeSamplesGenerator(
+                index_generator=index_generator, candidate_indices=self.candidate_indices,
+                random_state=self.rs, predicate2type=predicate2type, nb_negatives=nb_negatives)
+
+            sample_sets = generator(self.Xr, self.Xe)
+            self.assertEqual(len(sample_sets), nb_negatives)
+            self.check_corruptions(sample_sets, [None] * nb_negatives)
+
+            ps_count, po_count = util.predicate_statistics(self.Xr, self.Xe)
+            generator = negatives.BernoulliNegativeSamplesGenerator(
+                index_generator=index_generator, candidate_indices=self.candidate_indices,
+                random_state=self.rs, ps_count=ps_count, po_count=po_count, nb_negatives=nb_negatives)
+
+            sample_sets = generator(self.Xr, self.Xe)
+            self.assertEqual(len(sample_sets), nb_negatives)
+            self.check_corruptions(sample_sets, [None] * nb_negatives)
+
+    def test_triple_set(self):
+        triple_set = negatives.TripleSet(self.Xr, self.Xe)
+        self.assertTrue(np.all(triple_set.contains(self.Xr, self.Xe)))
+
+        true_triples = set((s, p, o) for (p,), (s, o) in zip(self.Xr.tolist(), self.Xe.tolist()))
+        Xr = self.rs.randint(0, 6, size=(200, 1))
+        Xe = self.rs.randint(0, self.nb_entities + 5, size=(200, 2))
+        expected = [(s, p, o) in true_triples for (p,), (s, o) in zip(Xr.tolist(), Xe.tolist())]
+        self.assertEqual(triple_set.contains(Xr, Xe).tolist(), expected)
+
+        self.assertFalse(np.any(negatives.TripleSet(Xr[:0], Xe[:0]).contains(Xr, Xe)))
+
+    def test_filtered_negatives(self):
+        # Few entities, so that a large share of the corruptions are true triples
+        nb_entities = 4
+        Xr = np.ones((12, 1), dtype=int)
+        Xe = np.array([[s, o] for s in range(1, nb_entities + 1) for o in range(1, nb_entities + 1) if s != o])
+
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=self.rs)
+        candidate_indices = np.arange(1, nb_entities + 1)
+        generator = negatives.FilteredNegativeSamplesGenerator(
+            negatives.CorruptedSamplesGenerator(
+                subject_index_generator=index_generator, subject_candidate_indices=candidate_indices,
+                object_index_generator=index_generator, object_candidate_indices=candidate_indices,
+                nb_negatives=2),
+            negatives.TripleSet(Xr, Xe), max_rounds=100)
+
+        sample_sets = generator(Xr, Xe)
+        self.assertEqual(len(sample_sets), generator.nb_sample_sets)
+        self.assertTrue(generator.rejection_rate > 0.)
+        self.assertEqual(generator.nb_unresolved, 0)
+
+        # The only negative examples that are not true triples are the (e, p, e) ones
+        for negative_Xr, negative_Xe in sample_sets:
+            self.assertTrue(np.array_equal(negative_Xr, Xr))
+            self.assertTrue(np.all(negative_Xe[:, 0] == negative_Xe[:, 1]))
+
+    def test_schema_aware_sides(self):
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=self.rs)
+        predicate2type = {1: util.PredicateType.one_to_many, 2: util.PredicateType.many_to_one,
+                          3: util.PredicateType.many_to_many}
+        generator = negatives.SchemaAwareNegativeSamplesGenerator(
+            index_generator=index_generator, candidate_indices=self.candidate_indices,
+            random_state=self.rs, predicate2type=predicate2type, nb_negatives=2)
+
+        for negative_Xr, negative_Xe in generator(self.Xr, self.Xe):
+            # Subjects of one-to-many predicates and objects of many-to-one predicates are corrupted
+            is_one_to_many, is_many_to_one = self.Xr[:, 0] == 1, self.Xr[:, 0] == 2
+            self.assertTrue(np.array_equal(negative_Xe[is_one_to_many, 1], self.Xe[is_one_to_many, 1]))
+            self.assertTrue(np.array_equal(negative_Xe[is_many_to_one, 0], self.Xe[is_many_to_one, 0]))
+
+    def test_bernoulli_sides(self):
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=self.rs)
+
+        # Predicate 1 is one-to-many (the subject is always corrupted), predicate 2 is many-to-one
+        Xr = np.array([[1]] * 10 + [[2]] * 10)
+        Xe = np.array([[1, o] for o in range(2, 12)] + [[s, 1] for s in range(2, 12)])
+
+        ps_count, po_count = util.predicate_statistics(Xr, Xe)
+        generator = negatives.BernoulliNegativeSamplesGenerator(
+            index_generator=index_generator, candidate_indices=self.candidate_indices,
+            random_state=self.rs, ps_count=ps_count, po_count=po_count, nb_negatives=10)
+
+        is_subject_corrupted = np.stack([negative_Xe[:, 1] == Xe[:, 1] for _, negative_Xe in generator(Xr, Xe)])
+        self.assertTrue(is_subject_corrupted[:, :10].mean() > .8)
+        self.assertTrue(is_subject_corrupted[:, 10:].mean() < .2)
+
+    def test_hard_negatives(self):
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=self.rs)
+
+        # DistMult scorer for which entities with larger indices have higher scores
+        entity_embeddings = np.arange(self.nb_entities + 1, dtype=float).reshape((-1, 1))
+        scorer = scoring.EmbeddingScorer(entity_embeddings, np.ones((4, 1)), model_name='DistMult',
+                                         similarity_name='dot')
+
+        generator = negatives.HardNegativeSamplesGenerator(
+            index_generator=index_generator, candidate_indices=self.candidate_indices, random_state=self.rs,
+            nb_negatives=2, pool_size=self.nb_entities, cache_size=5, hard_ratio=1.)
+
+        sample_sets = generator(self.Xr, self.Xe)
+        self.assertEqual(len(sample_sets), generator.nb_sample_sets)
+        self.check_corruptions(sample_sets, [0, 0, 1, 1])
+
+        generator.refresh(scorer, self.Xr, self.Xe)
+        for cache in generator.caches:
+            self.assertEqual(sorted(cache[1:, :].reshape(-1).tolist()),
+                             sorted(list(range(self.nb_entities - 4, self.nb_entities + 1)) * 3))
+
+        # All corruptions are drawn from the cache of hard negatives
+        sample_sets = generator(self.Xr, self.Xe)
+        self.check_corruptions(sample_sets, [0, 0, 1, 1])
+        for i, (_, negative_Xe) in enumerate(sample_sets):
+            self.assertTrue(np.all(negative_Xe[:, i // 2] > self.nb_entities - 5))
+
+        # The cache and the random state used for refreshing it are restored from a checkpoint
+        restored_generator = negatives.HardNegativeSamplesGenerator(
+            index_generator=index_generator, candidate_indices=self.candidate_indices, random_state=self.rs,
+            nb_negatives=2, pool_size=self.nb_entities, cache_size=5, hard_ratio=1.)
+        restored_generator.set_state(generator.get_state())
+        for cache, restored_cache in zip(generator.caches, restored_generator.caches):
+            self.assertTrue(np.array_equal(cache, restored_cache))
+        self.assertEqual(generator.refresh_random_state.randint(1000),
+                         restored_generator.refresh_random_state.randint(1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
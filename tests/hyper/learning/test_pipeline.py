@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.learning import samples, negatives
+from hyper.learning.pipeline import EpochProducer
+from hyper.evaluation.scoring import FunctionScorer
+
+import unittest
+
+
+class FailingSamplesGenerator(negatives.LCWANegativeSamplesGenerator):
+    def __call__(self, Xr, Xe):
+        raise ValueError('Failing generator')
+
+
+class TestEpochProducer(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+        nb_samples, self.nb_entities = 50, 20
+        self.Xr = self.rs.randint(1, 5, size=(nb_samples, 1))
+        self.Xe = self.rs.randint(1, self.nb_entities + 1, size=(nb_samples, 2))
+
+    def epochs(self, queue_size, nb_epochs=5, initial_epoch=1):
+        random_state = np.random.RandomState(1)
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=random_state)
+        candidate_indices = np.arange(1, self.nb_entities + 1)
+        negative_samples_generator = negatives.CorruptedSamplesGenerator(
+            subject_index_generator=index_generator, subject_candidate_indices=candidate_indices,
+            object_index_generator=index_generator, object_candidate_indices=candidate_indices)
+
+        producer = EpochProducer(self.Xr, self.Xe, negative_samples_generator, random_state, nb_epochs,
+                                 seed=1, queue_size=queue_size, initial_epoch=initial_epoch)
+        try:
+            return [(epoch.epoch_no, epoch.Xr.copy(), epoch.Xe.copy()) for epoch in producer]
+        finally:
+            producer.close()
+
+    def test_epoch_producer(self):
+        inline_epochs = self.epochs(queue_size=0)
+        self.assertEqual([epoch_no for epoch_no, _, _ in inline_epochs], [1, 2, 3, 4, 5])
+
+        for epoch_no, Xr, Xe in inline_epochs:
+            # Positive examples (shuffled) are followed by one subject and one object corruption
+            self.assertEqual(Xe.shape, (self.Xe.shape[0] * 3, 2))
+            self.assertTrue(np.array_equal(Xr[0::3], Xr[1::3]))
+            self.assertTrue(np.array_equal(Xe[0::3, 1], Xe[1::3, 1]))
+            self.assertTrue(np.array_equal(Xe[0::3, 0], Xe[2::3, 0]))
+            self.assertEqual(sorted(map(tuple, Xe[0::3])), sorted(map(tuple, self.Xe)))
+
+        # Examples do not depend on whether they are prepared in the background
+        for queue_size in [1, 3]:
+            background_epochs = self.epochs(queue_size=queue_size)
+            for (_, Xr_a, Xe_a), (_, Xr_b, Xe_b) in zip(inline_epochs, background_epochs):
+                self.assertTrue(np.array_equal(Xr_a, Xr_b))
+                self.assertTrue(np.array_equal(Xe_a, Xe_b))
+
+        # Examples do not depend on the epoch training starts from (e.g. when resuming from a checkpoint)
+        resumed_epochs = self.epochs(queue_size=1, initial_epoch=4)
+        self.assertEqual([epoch_no for epoch_no, _, _ in resumed_epochs], [4, 5])
+        for (_, Xr_a, Xe_a), (_, Xr_b, Xe_b) in zip(inline_epochs[3:], resumed_epochs):
+            self.assertTrue(np.array_equal(Xr_a, Xr_b))
+            self.assertTrue(np.array_equal(Xe_a, Xe_b))
+
+    def hard_epochs(self, queue_size, nb_epochs=6, refresh_interval=2, initial_epoch=1, state=None, states=None):
+        random_state = np.random.RandomState(1)
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=random_state)
+        negative_samples_generator = negatives.HardNegativeSamplesGenerator(
+            index_generator=index_generator, candidate_indices=np.arange(1, self.nb_entities + 1),
+            random_state=random_state, pool_size=10, cache_size=3, hard_ratio=1.)
+        if state is not None:
+            negative_samples_generator.set_state(state)
+
+        producer = EpochProducer(self.Xr, self.Xe, negative_samples_generator, random_state, nb_epochs,
+                                 seed=1, queue_size=queue_size, initial_epoch=initial_epoch)
+        epochs = []
+        try:
+            for epoch in producer:
+                epochs += [epoch.Xe.copy()]
+                if epoch.epoch_no % refresh_interval == 0:
+                    # Scores which change at each refresh, as those of a model being trained
+                    def scoring_function(args, epoch_no=epoch.epoch_no):
+                        return np.sin(args[1][:, 0] * epoch_no + args[1][:, 1])
+
+                    with producer.paused():
+                        negative_samples_generator.refresh(FunctionScorer(scoring_function, self.nb_entities),
+                                                           self.Xr, self.Xe)
+                if states is not None:
+                    states[epoch.epoch_no] = negative_samples_generator.get_state()
+        finally:
+            producer.close()
+        return epochs
+
+    def test_hard_negatives_refresh(self):
+        inline_epochs = self.hard_epochs(queue_size=0)
+
+        # Epochs prepared in advance with a cache of hard negatives that is then refreshed are prepared again
+        for queue_size in [1, 3]:
+            background_epochs = self.hard_epochs(queue_size=queue_size)
+            self.assertEqual(len(inline_epochs), len(background_epochs))
+            for Xe_a, Xe_b in zip(inline_epochs, background_epochs):
+                self.assertTrue(np.array_equal(Xe_a, Xe_b))
+
+    def test_hard_negatives_resume(self):
+        states = {}
+        epochs = self.hard_epochs(queue_size=1, states=states)
+
+        # Runs resumed from the state of the generator at the end of an epoch see the same hard negatives
+        for epoch_no in [2, 3]:
+            resumed_epochs = self.hard_epochs(queue_size=1, initial_epoch=epoch_no + 1, state=states[epoch_no])
+            self.assertEqual(len(resumed_epochs), len(epochs) - epoch_no)
+            for Xe_a, Xe_b in zip(epochs[epoch_no:], resumed_epochs):
+                self.assertTrue(np.array_equal(Xe_a, Xe_b))
+
+    def test_early_close(self):
+        random_state = np.random.RandomState(1)
+        index_generator = samples.GlorotRandomIndexGenerator(random_state=random_state)
+        negative_samples_generator = negatives.LCWANegativeSamplesGenerator(
+            object_index_generator=index_generator, object_candidate_indices=np.arange(1, self.nb_entities + 1))
+
+        producer = EpochProducer(self.Xr, self.Xe, negative_samples_generator, random_state, 100, queue_size=2)
+        for epoch in producer:
+            if epoch.epoch_no == 3:
+                break
+        producer.close()
+        self.assertFalse(producer.thread.is_alive())
+
+    def test_exceptions(self):
+        random_state = np.random.RandomState(1)
+        negative_samples_generator = FailingSamplesGenerator(object_index_generator=None,
+                                                             object_candidate_indices=None)
+
+        producer = EpochProducer(self.Xr, self.Xe, negative_samples_generator, random_state, 10, queue_size=2)
+        with self.assertRaises(ValueError):
+            for _ in producer:
+                pass
+        producer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,5 +41,37 @@ class TestSamples(unittest.TestCase):
         self.assertTrue(X_train.shape == (20000, 200))
         self.assertTrue(X_valid.shape == (5000, 200))
 
+    def test_alias(self):
+        rs = np.random.RandomState(1)
+
+        weights = np.array([0., 1., 2., 3., 4., 0., 10.])
+        probabilities, aliases = samples.alias_table(weights)
+
+        # Probability of each outcome, summing over the slots of the table
+        outcome_probabilities = np.zeros(weights.shape[0])
+        np.add.at(outcome_probabilities, np.arange(weights.shape[0]), probabilities / weights.shape[0])
+        np.add.at(outcome_probabilities, aliases, (1. - probabilities) / weights.shape[0])
+        self.assertTrue(np.allclose(outcome_probabilities, weights / weights.sum()))
+
+        ig = samples.AliasIndexGenerator(rs, weights)
+        indices = np.arange(1, 7)
+        frequencies = np.bincount(ig(100000, indices), minlength=7) / 100000.
+        self.assertTrue(np.allclose(frequencies, weights / weights.sum(), atol=.01))
+
+    def test_alias_predicates(self):
+        rs = np.random.RandomState(1)
+
+        candidate_pairs = np.array([[1, 2], [1, 3], [2, 5], [2, 5]])
+        ig = samples.AliasIndexGenerator(rs, np.ones(8), candidate_pairs=candidate_pairs)
+
+        predicate_idxs = np.array([1, 2, 3, 7] * 256)
+        idxs = ig(predicate_idxs.shape[0], np.arange(1, 8), predicate_idxs=predicate_idxs)
+
+        self.assertEqual(set(idxs[predicate_idxs == 1].tolist()), {2, 3})
+
+        # Predicates with a single candidate, or without candidates, are sampled from all the candidate indices
+        self.assertEqual(set(idxs[predicate_idxs >= 2].tolist()), set(range(1, 8)))
+
+
 if __name__ == '__main__':
     unittest.main()
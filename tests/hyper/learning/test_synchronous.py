@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.learning import synchronous
+
+import unittest
+
+
+class TestSynchronous(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_synchronous_training(self):
+        nb_entities, nb_predicates = 50, 3
+        train_sequences = [(int(self.rs.randint(1, nb_predicates + 1)),
+                            [int(self.rs.randint(1, nb_entities + 1)), int(self.rs.randint(1, nb_entities + 1))])
+                           for _ in range(200)]
+
+        kwargs = dict(train_sequences=train_sequences, nb_entities=nb_entities, nb_predicates=nb_predicates,
+                      entity_embedding_size=5, model_name='TransE', similarity_name='L1', nb_epochs=2,
+                      batch_size=32, nb_workers=2)
+
+        entity_embeddings, predicate_embeddings = synchronous.synchronous_training(**kwargs)
+        self.assertEqual(entity_embeddings.shape, (nb_entities + 1, 5))
+        self.assertEqual(predicate_embeddings.shape, (nb_predicates + 1, 5))
+        self.assertTrue(np.allclose(np.linalg.norm(entity_embeddings, axis=1), 1.))
+
+        # For a given seed and number of workers, results are bit-identical
+        other_entity_embeddings, other_predicate_embeddings = synchronous.synchronous_training(**kwargs)
+        self.assertTrue(np.array_equal(entity_embeddings, other_entity_embeddings))
+        self.assertTrue(np.array_equal(predicate_embeddings, other_predicate_embeddings))
+
+        # Unsupported generators of negative examples are rejected before starting the workers
+        with self.assertRaises(ValueError):
+            synchronous.synchronous_training(**dict(kwargs, negatives_name='schema'))
+        with self.assertRaises(ValueError):
+            synchronous.synchronous_training(**dict(kwargs, negatives_sampler='zipf'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hyper.learning import util
+
+import os
+import tempfile
+import collections
+import unittest
+
+
+class TestUtil(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_predicate_statistics(self):
+        Xr = self.rs.randint(1, 5, size=(500, 1))
+        Xe = self.rs.randint(1, 30, size=(500, 2))
+
+        ps_count, po_count = util.predicate_statistics(Xr, Xe)
+
+        expected_ps_count = collections.Counter((p, s) for [p], [s, _] in zip(Xr.tolist(), Xe.tolist()))
+        expected_po_count = collections.Counter((p, o) for [p], [_, o] in zip(Xr.tolist(), Xe.tolist()))
+
+        self.assertEqual(dict(ps_count.items()), dict(expected_ps_count))
+        self.assertEqual(dict(po_count.items()), dict(expected_po_count))
+
+        predicate_idxs, entity_idxs = self.rs.randint(0, 7, size=100), self.rs.randint(0, 35, size=100)
+        self.assertEqual(ps_count(predicate_idxs, entity_idxs).tolist(),
+                         [expected_ps_count[(p, e)] for p, e in zip(predicate_idxs.tolist(), entity_idxs.tolist())])
+
+    def test_find_predicate_types(self):
+        # 1: one-to-one, 2: one-to-many, 3: many-to-one, 4: many-to-many
+        triples = [(1, 1, 2), (3, 1, 4),
+                   (1, 2, 2), (1, 2, 3),
+                   (1, 3, 4), (2, 3, 4),
+                   (1, 4, 2), (1, 4, 3), (2, 4, 2)]
+        Xr = np.array([[p] for (_, p, _) in triples])
+        Xe = np.array([[s, o] for (s, _, o) in triples])
+
+        expected = {1: util.PredicateType.one_to_one, 2: util.PredicateType.one_to_many,
+                    3: util.PredicateType.many_to_one, 4: util.PredicateType.many_to_many}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.assertEqual(util.find_predicate_types(Xr, Xe, cache_dir=cache_dir), expected)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # Cached results are returned for the same facts
+            self.assertEqual(util.find_predicate_types(Xr, Xe, cache_dir=cache_dir), expected)
+            self.assertEqual(util.find_predicate_types(Xr[:2], Xe[:2], cache_dir=cache_dir),
+                             {1: util.PredicateType.one_to_one})
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from hyper.learning.validation import EarlyStopping
+
+import unittest
+
+
+class LookupModel:
+    """
+    Model scoring a triple (s, p, o) as W[s, o], exposing the subset of the Keras model interface used by
+    EarlyStopping.
+    """
+    def __init__(self, W):
+        self.W = W
+
+    def predict(self, x, batch_size=None):
+        Xr, Xe = x
+        return self.W[Xe[:, 0].astype(int), Xe[:, 1].astype(int)].reshape((-1, 1))
+
+    def get_weights(self):
+        return [self.W.copy()]
+
+    def set_weights(self, weights):
+        self.W = weights[0].copy()
+
+
+class TestEarlyStopping(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def test_early_stopping(self):
+        nb_entities = 10
+        triples = [(1, 1, 2), (3, 1, 4), (5, 1, 6)]
+
+        good_W = self.rs.rand(nb_entities + 1, nb_entities + 1)
+        for s, _, o in triples:
+            good_W[s, o] = 2.
+
+        model = LookupModel(good_W)
+
+        early_stopping = EarlyStopping(triples, triples, nb_entities, model_name='ER-MLP', interval=2, patience=2)
+
+        # Only every interval epochs
+        self.assertFalse(early_stopping(model, 1))
+        self.assertIsNone(early_stopping.best_mrr)
+
+        self.assertFalse(early_stopping(model, 2))
+        self.assertEqual(early_stopping.best_mrr, 1.)
+
+        model.W = self.rs.rand(nb_entities + 1, nb_entities + 1)
+        self.assertFalse(early_stopping(model, 4))
+        self.assertTrue(early_stopping(model, 6))
+
+        early_stopping.restore(model)
+        self.assertTrue(np.array_equal(model.W, good_W))
+        self.assertEqual(early_stopping.best_epoch, 2)
+
+    def test_sampled_validation(self):
+        triples = [(s, 1, s + 1) for s in range(1, 20)]
+        early_stopping = EarlyStopping(triples, triples, 20, model_name='ER-MLP', nb_triples=5, nb_candidates=5)
+
+        self.assertEqual(early_stopping.triples.shape, (5, 3))
+        self.assertTrue(0. < early_stopping.evaluate(LookupModel(self.rs.rand(21, 21))) <= 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@ import numpy as np
 
 from keras import backend as K
 import hyper.layers.core
-from hyper.constraints import norm, mask
+from hyper.constraints import norm, mask, RowProjection
 import unittest
 
 
@@ -52,5 +52,23 @@ class TestConstraints(unittest.TestCase):
             for i in range(S):
                 self.assertTrue(abs(masked_value[R, i]) > masked_value[R, S + i])
 
+    def test_row_projection(self):
+        W_value = self.rs.rand(32, 8) * 10.
+        W = K.variable(W_value)
+
+        row_projection = RowProjection(W, norm(m=1., axis=1))
+
+        # Only the given rows are projected, and repeated rows are projected once
+        rows = np.array([1, 5, 5, 9])
+        row_projection(rows)
+        W_projected = K.get_value(W)
+
+        self.assertTrue(np.allclose(np.linalg.norm(W_projected[rows], axis=1), 1., atol=1e-5))
+        other_rows = np.setdiff1d(np.arange(32), rows)
+        self.assertTrue(np.allclose(W_projected[other_rows], W_value[other_rows]))
+
+        row_projection(None)
+        self.assertTrue(np.allclose(np.linalg.norm(K.get_value(W), axis=1), 1., atol=1e-5))
+
 if __name__ == '__main__':
     unittest.main()
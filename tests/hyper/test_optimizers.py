@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from keras import backend as K
+from keras.optimizers import SGD, Adagrad
+
+from hyper import optimizers
+
+import unittest
+
+
+class TestOptimizers(unittest.TestCase):
+
+    def setUp(self):
+        self.rs = np.random.RandomState(1)
+
+    def run_steps(self, optimizer, W_value, batches):
+        W = K.variable(W_value)
+        idxs = K.placeholder(ndim=1, dtype='int32')
+
+        # Loss reading the rows of W via a gather, as in an Embedding layer
+        loss = K.sum(K.square(K.gather(W, idxs) - 1.))
+        train_function = K.function([idxs], [loss], updates=optimizer.get_updates([W], {}, loss))
+
+        for batch in batches:
+            train_function([batch])
+        return K.get_value(W)
+
+    def test_sparse_updates(self):
+        W_value = self.rs.randn(16, 4)
+
+        # Batches with repeated rows
+        batches = [self.rs.randint(0, 16, size=8).astype('int32') for _ in range(16)]
+
+        optimizer_pairs = [(SGD(lr=.1), optimizers.SparseSGD(lr=.1)),
+                           (Adagrad(lr=.1, epsilon=1e-6), optimizers.SparseAdagrad(lr=.1, epsilon=1e-6))]
+
+        for dense_optimizer, sparse_optimizer in optimizer_pairs:
+            dense_W = self.run_steps(dense_optimizer, W_value, batches)
+            sparse_W = self.run_steps(sparse_optimizer, W_value, batches)
+            self.assertTrue(np.allclose(dense_W, sparse_W, atol=1e-5))
+
+        # Rows never read by a batch are not changed by the lazy Adam updates
+        sparse_W = self.run_steps(optimizers.SparseAdam(lr=.1), W_value, batches[:1])
+        unread_rows = np.setdiff1d(np.arange(16), batches[0])
+        self.assertTrue(np.allclose(sparse_W[unread_rows], W_value[unread_rows]))
+        self.assertFalse(np.allclose(sparse_W[batches[0]], W_value[batches[0]]))
+
+    def test_make_optimizer(self):
+        self.assertTrue(isinstance(optimizers.make_optimizer('adagrad', sparse=True), optimizers.SparseAdagrad))
+        with self.assertRaises(ValueError):
+            optimizers.make_optimizer('rmsprop', sparse=True)
+
+
+if __name__ == '__main__':
+    unittest.main()